@@ -0,0 +1,65 @@
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+import torch
+
+from common import add_data_args, build_model, evaluate, load_corpus, make_config, train_epochs
+from candidates import CandidateIndex
+
+# 只对候选实体打分(按关系的候选索引，可选按关系相似度扩展)相对全部实体打分的评估时间、MRR和漏召回
+# python benchmarks/bench_candidates.py --data_dir=./data/FB15k-237 --widen=0,0.2,0.5 --eval_triples=500
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--models", default="DisenE_Trans,DisenE")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--eval_triples", type=int, default=300)
+    parser.add_argument("--widen", default="0,0.3", help="candidate_widen values to compare")
+    args = parser.parse_args()
+
+    config = make_config(args)
+    corpus, entity_emb, relation_emb = load_corpus(args, config)
+    test = corpus.test_indices[:args.eval_triples]
+
+    indices = {}
+    for widen in [float(w) for w in args.widen.split(',')]:
+        start = time.time()
+        index = CandidateIndex.from_triples(corpus.train_indices, corpus.num_entities, corpus.num_relations, widen)
+        build_time = time.time() - start
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = index.report(test)
+        indices[widen] = index
+        print("widen {:<5} build {:.3f}s  head: mean {:.1f} miss {:.2%}  tail: mean {:.1f} miss {:.2%}".format(
+            widen, build_time, stats['head']['mean'], stats['head']['miss_rate'],
+            stats['tail']['mean'], stats['tail']['miss_rate']))
+
+    print("\n{:<14}{:<12}{:>10}{:>10}{:>10}{:>10}".format("model", "candidates", "seconds", "speedup", "MRR",
+                                                          "Hits@10"))
+    for model_name in args.models.split(','):
+        np.random.seed(args.seed)
+        torch.manual_seed(args.seed)
+        model = build_model(model_name, entity_emb, relation_emb, config)
+        train_epochs(model, corpus, config, args.epochs)
+
+        corpus.candidate_index = None
+        start = time.time()
+        metrics = evaluate(model, corpus, config, args.eval_triples)
+        base_time = time.time() - start
+        print("{:<14}{:<12}{:>10.2f}{:>10.2f}{:>10.4f}{:>10.4f}".format(
+            model_name, 'all', base_time, 1.0, metrics['MRR'], metrics['Hits@10']))
+        for widen, index in indices.items():
+            corpus.candidate_index = index
+            start = time.time()
+            metrics = evaluate(model, corpus, config, args.eval_triples)
+            elapsed = time.time() - start
+            print("{:<14}{:<12}{:>10.2f}{:>10.2f}{:>10.4f}{:>10.4f}".format(
+                model_name, 'widen=%g' % widen, elapsed, base_time / elapsed, metrics['MRR'], metrics['Hits@10']))
+        corpus.candidate_index = None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+
+from common import add_data_args, build_model, evaluate, load_corpus, make_config, train_epochs
+from embedding_store import EntityStore
+
+# 内存映射实体表 + 热点行缓存：不同缓存大小/淘汰策略下的命中率、训练吞吐和MRR，与整表在内存中的训练对比
+# python benchmarks/bench_entity_store.py --epochs=3 --cache_fractions=0.4,0.7,1.0
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--models", default="DisenE_Trans,DisenE")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--eval_triples", type=int, default=300)
+    parser.add_argument("--cache_fractions", default="0.4,0.7,1.0", help="cache size as a fraction of the entities")
+    parser.add_argument("--policies", default="lru,lfu")
+    args = parser.parse_args()
+
+    config = make_config(args)
+    corpus, entity_emb, relation_emb = load_corpus(args, config)
+    num_entities = entity_emb.shape[0]
+
+    print("{:<14}{:<10}{:>8}{:>10}{:>12}{:>10}{:>10}".format(
+        "model", "policy", "cache", "hit rate", "triples/s", "MRR", "Hits@10"))
+    for model_name in args.models.split(','):
+        np.random.seed(args.seed)
+        torch.manual_seed(args.seed)
+        model = build_model(model_name, entity_emb, relation_emb, config)
+        speed = train_epochs(model, corpus, config, args.epochs)
+        metrics = evaluate(model, corpus, config, args.eval_triples)
+        print("{:<14}{:<10}{:>8}{:>10}{:>12.0f}{:>10.4f}{:>10.4f}".format(
+            model_name, "in-RAM", "-", "-", speed, metrics['MRR'], metrics['Hits@10']))
+
+        for policy in args.policies.split(','):
+            for fraction in [float(f) for f in args.cache_fractions.split(',')]:
+                folder = tempfile.mkdtemp()
+                try:
+                    table = build_model(model_name, entity_emb, relation_emb, config).entity_embeddings.detach()
+                    EntityStore.create(folder, num_entities, table.shape[1],
+                                       lambda start, end: table[start:end].numpy())
+                    store = EntityStore(folder, int(fraction * num_entities), policy)
+
+                    np.random.seed(args.seed)
+                    torch.manual_seed(args.seed)
+                    model = build_model(model_name, entity_emb[:1], relation_emb, config)
+                    speed = train_epochs(model, corpus, config, args.epochs, store=store)
+                    hit_rate = store.hit_rate()
+                    store.attach(model, normalize=config.do_normalize and model_name in ('ConvKB', 'DisenE'))
+                    metrics = evaluate(model, corpus, config, args.eval_triples)
+                    print("{:<14}{:<10}{:>8}{:>10.4f}{:>12.0f}{:>10.4f}{:>10.4f}".format(
+                        model_name, policy, store.cache_rows, hit_rate, speed, metrics['MRR'], metrics['Hits@10']))
+                    del model, store
+                finally:
+                    shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import argparse
+
+import numpy as np
+import torch
+
+from common import add_data_args, build_model, evaluate, load_corpus, make_config, train_epochs
+
+# 完整实体表 vs --factored_rank 的紧凑表(base + 低秩的每因子偏移)：实体参数内存(含Adam两个动量)、训练吞吐、MRR/Hits@10
+# python benchmarks/bench_factored.py --data_dir=./data/FB15k-237 --k_factors=6 --embedding_size=200 --ranks=0,8,32 --epochs=20
+
+
+def entity_mb(model):
+    params = [param for name, param in model.named_parameters() if name.startswith('entity_embeddings')]
+    # 参数本身 + Adam 的 exp_avg / exp_avg_sq
+    return 3 * sum(param.numel() * param.element_size() for param in params) / 2 ** 20
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--models", default="DisenE_Trans,DisenE")
+    parser.add_argument("--ranks", default="0,4,16", help="0 is the full table")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--eval_triples", type=int, default=200)
+    args = parser.parse_args()
+
+    print("{:<14}{:<10}{:>12}{:>14}{:>10}{:>10}".format("model", "table", "entity MB", "triples/s", "MRR",
+                                                        "Hits@10"))
+    for model_name in args.models.split(','):
+        for rank in [int(r) for r in args.ranks.split(',')]:
+            config = make_config(args, factored_rank=rank)
+            corpus, entity_emb, relation_emb = load_corpus(args, config)
+            np.random.seed(args.seed)
+            torch.manual_seed(args.seed)
+            model = build_model(model_name, entity_emb, relation_emb, config)
+            throughput = train_epochs(model, corpus, config, args.epochs)
+            metrics = evaluate(model, corpus, config, args.eval_triples)
+            print("{:<14}{:<10}{:>12.2f}{:>14.0f}{:>10.4f}{:>10.4f}".format(
+                model_name, 'rank %d' % rank if rank else 'full', entity_mb(model), throughput, metrics['MRR'],
+                metrics['Hits@10']))
+
+
+if __name__ == '__main__':
+    main()
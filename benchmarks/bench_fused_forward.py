@@ -0,0 +1,63 @@
+import argparse
+
+import torch
+
+from common import add_data_args, build_model, load_corpus, make_config, peak_rss_mb, saved_activation_mb, timeit
+
+# DisenE 原始前向与 --fused_forward 的对比：反向需要保存的激活大小、一个训练步的峰值内存(CUDA上为峰值显存)、吞吐、数值差
+# python benchmarks/bench_fused_forward.py --k_factors=6 --embedding_size=100 --out_channels=50 --repeat=3
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    config = make_config(args)
+    corpus, entity_emb, relation_emb = load_corpus(args, config)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = build_model('DisenE', entity_emb, relation_emb, config).to(device)
+
+    batch_triples, batch_labels = corpus.get_iteration_batch(0)
+    batch_triples = torch.LongTensor(batch_triples).to(device)
+    batch_labels = torch.FloatTensor(batch_labels).to(device)
+
+    def step():
+        model.zero_grad()
+        loss, _ = model(batch_triples, batch_labels)
+        loss.backward()
+
+    print("batch of {} triples, K={}, emb_s={}, out_channels={}".format(
+        len(batch_triples), args.k_factors, args.embedding_size, args.out_channels))
+    print("{:<10}{:>14}{:>14}{:>12}{:>16}".format("forward", "saved MB", "peak MB", "step ms", "triples/s"))
+    results = {}
+    for fused in (0, 1):
+        model.fused_forward = fused
+        model.eval()
+        with torch.no_grad():
+            results[fused] = model(batch_triples)[0]
+        model.train()
+
+        saved = saved_activation_mb(lambda: model(batch_triples, batch_labels)[0])
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            step()
+            torch.cuda.synchronize()
+            peak = torch.cuda.max_memory_allocated() / 2 ** 20
+        else:
+            peak = peak_rss_mb(step)
+
+        def timed_step():
+            step()
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+
+        seconds = timeit(timed_step, args.repeat)
+        print("{:<10}{:>14.2f}{:>14.2f}{:>12.2f}{:>16.0f}".format(
+            'fused' if fused else 'concat', saved, peak, seconds * 1000, len(batch_triples) / seconds))
+    print("max score diff {:.2e}".format((results[0] - results[1]).abs().max().item()))
+
+
+if __name__ == '__main__':
+    main()
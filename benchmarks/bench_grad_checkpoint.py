@@ -0,0 +1,54 @@
+import argparse
+
+import torch
+
+from common import add_data_args, build_model, load_corpus, make_config, peak_rss_mb, saved_activation_mb, timeit
+
+# DisenE 训练时 --grad_checkpoint=none/block/factor 的对比：反向保存的激活、一个训练步的峰值内存(CUDA上为峰值显存)、每步时间
+# python benchmarks/bench_grad_checkpoint.py --ks=6,10 --embedding_size=100 --out_channels=50 --repeat=3
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--ks", default="6,10")
+    parser.add_argument("--modes", default="none,block,factor")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    print("{:<4}{:<10}{:>14}{:>14}{:>12}{:>12}".format("K", "mode", "saved MB", "peak MB", "step ms", "slowdown"))
+    for k in [int(k) for k in args.ks.split(',')]:
+        config = make_config(args, k_factors=k)
+        corpus, entity_emb, relation_emb = load_corpus(args, config)
+        model = build_model('DisenE', entity_emb, relation_emb, config).to(device).train()
+
+        batch_triples, batch_labels = corpus.get_iteration_batch(0)
+        batch_triples = torch.LongTensor(batch_triples).to(device)
+        batch_labels = torch.FloatTensor(batch_labels).to(device)
+
+        def step():
+            model.zero_grad()
+            loss, _ = model(batch_triples, batch_labels)
+            loss.backward()
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+
+        base = None
+        for mode in args.modes.split(','):
+            model.grad_checkpoint = mode
+            saved = saved_activation_mb(lambda: model(batch_triples, batch_labels)[0])
+            if device.type == 'cuda':
+                torch.cuda.reset_peak_memory_stats()
+                step()
+                peak = torch.cuda.max_memory_allocated() / 2 ** 20
+            else:
+                peak = peak_rss_mb(step)
+            seconds = timeit(step, args.repeat)
+            if base is None:
+                base = seconds
+            print("{:<4}{:<10}{:>14.2f}{:>14.2f}{:>12.2f}{:>12.2f}".format(
+                k, mode, saved, peak, seconds * 1000, seconds / base))
+
+
+if __name__ == '__main__':
+    main()
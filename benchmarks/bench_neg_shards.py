@@ -0,0 +1,56 @@
+import argparse
+import contextlib
+import io
+import shutil
+import tempfile
+import time
+
+from common import add_data_args, load_corpus, make_config
+from dataloader import NegativeShards
+from neg_shards import write_shards
+
+# 每个epoch取批次的时间：Corpus.get_iteration_batch 现场采样 vs 从预先生成的负样本文件组装；以及生成文件的时间随进程数的变化
+# python benchmarks/bench_neg_shards.py --data_dir=./data/FB15k-237 --epochs=4 --workers=1,2,4
+
+
+def epoch_time(get_batch, num_iters):
+    start = time.time()
+    for iters in range(num_iters):
+        get_batch(iters)
+    return time.time() - start
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--epochs", type=int, default=2, help="epochs of shards to generate")
+    parser.add_argument("--workers", default="1,2")
+    args = parser.parse_args()
+
+    config = make_config(args)
+    corpus, _, _ = load_corpus(args, config)
+    num_iters = (len(corpus.train_indices) + config.batch_size - 1) // config.batch_size
+    folder = tempfile.mkdtemp()
+    try:
+        print("{:<28}{:>12}".format("generation", "seconds"))
+        for workers in [int(w) for w in args.workers.split(',')]:
+            start = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                write_shards(corpus, folder, args.epochs, config.batch_size, config.valid_invalid_ratio,
+                             args.seed, workers)
+            print("{:<28}{:>12.2f}".format("{} epochs, {} workers".format(args.epochs, workers),
+                                           time.time() - start))
+
+        shards = NegativeShards(folder, corpus.train_indices, config.batch_size, config.valid_invalid_ratio,
+                                corpus.num_entities)
+        sampled = epoch_time(corpus.get_iteration_batch, num_iters)
+        shards.start_epoch(0)
+        replayed = epoch_time(shards.get_batch, num_iters)
+        print("\n{:<28}{:>12}{:>12}".format("batches per epoch", "seconds", "speedup"))
+        print("{:<28}{:>12.3f}{:>12.2f}".format("get_iteration_batch", sampled, 1.0))
+        print("{:<28}{:>12.3f}{:>12.2f}".format("NegativeShards.get_batch", replayed, sampled / replayed))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
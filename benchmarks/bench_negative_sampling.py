@@ -0,0 +1,36 @@
+import argparse
+
+import numpy as np
+import torch
+
+from common import add_data_args, build_model, evaluate, load_corpus, make_config, train_epochs
+
+# 比较逐正样本负采样(Corpus.get_iteration_batch)与共享负样本池(Corpus.get_pool_batch)的吞吐量和MRR
+# python benchmarks/bench_negative_sampling.py --epochs=5 --pool_size=256
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--models", default="TransE,DisenE_Trans")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--pool_size", type=int, default=256)
+    parser.add_argument("--eval_triples", type=int, default=200)
+    args = parser.parse_args()
+
+    config = make_config(args)
+    corpus, entity_emb, relation_emb = load_corpus(args, config)
+
+    print("{:<14}{:<14}{:>16}{:>10}{:>10}".format("model", "neg_mode", "pos triples/s", "MRR", "Hits@10"))
+    for model_name in args.models.split(','):
+        for neg_mode in ('per_positive', 'shared_pool'):
+            np.random.seed(args.seed)
+            torch.manual_seed(args.seed)
+            model = build_model(model_name, entity_emb, relation_emb, config)
+            throughput = train_epochs(model, corpus, config, args.epochs, neg_mode, args.pool_size)
+            metrics = evaluate(model, corpus, config, args.eval_triples)
+            print("{:<14}{:<14}{:>16.1f}{:>10.4f}{:>10.4f}".format(
+                model_name, neg_mode, throughput, metrics['MRR'], metrics['Hits@10']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+import torch
+
+from common import add_data_args, build_model, load_corpus, make_config
+
+# 多进程评估的运行时间随进程数的变化，并检查结果与顺序评估一致
+# python benchmarks/bench_parallel_eval.py --workers=1,2,4,8 --eval_triples=500
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--model_name", default="DisenE_Trans")
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--eval_triples", type=int, default=200)
+    args = parser.parse_args()
+
+    config = make_config(args)
+    corpus, entity_emb, relation_emb = load_corpus(args, config)
+    corpus.test_indices = corpus.test_indices[:args.eval_triples]
+    model = build_model(args.model_name, entity_emb, relation_emb, config).eval()
+    scorer = model.test if args.model_name in ('TransE', 'DisenE_Trans') else model
+
+    print("{:<10}{:>12}{:>10}{:>10}".format("workers", "seconds", "speedup", "MRR"))
+    base_time, base_metrics = None, None
+    for workers in [int(w) for w in args.workers.split(',')]:
+        config.eval_workers = workers
+        start = time.time()
+        with torch.no_grad(), contextlib.redirect_stdout(io.StringIO()):
+            metrics = corpus.get_validation_pred(config, scorer)
+        elapsed = time.time() - start
+        if base_time is None:
+            base_time, base_metrics = elapsed, metrics
+        assert np.allclose(metrics, base_metrics), "parallel metrics differ from the first run"
+        print("{:<10}{:>12.2f}{:>10.2f}{:>10.4f}".format(workers, elapsed, base_time / elapsed, metrics[0]))
+
+
+if __name__ == '__main__':
+    main()
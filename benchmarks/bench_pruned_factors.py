@@ -0,0 +1,75 @@
+import argparse
+
+import numpy as np
+import torch
+
+from common import add_data_args, build_model, evaluate, load_corpus, make_config, timeit, train_epochs
+
+# DisenE 推理时只对注意力最大的因子算卷积(--prune_factors / --prune_mass)，相对全部K个因子的打分吞吐和MRR/Hits@10变化
+# python benchmarks/bench_pruned_factors.py --ks=4,6,8 --modes=top1,top2,mass0.8 --epochs=5 --eval_triples=300
+
+
+def parse_mode(mode):
+    if mode.startswith('top'):
+        return int(mode[3:]), 0.0
+    if mode.startswith('mass'):
+        return 0, float(mode[4:])
+    raise ValueError("mode must be topN or massX, got {}".format(mode))
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--ks", default="4,6,8")
+    parser.add_argument("--modes", default="top1,top2,mass0.8")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--eval_triples", type=int, default=200)
+    parser.add_argument("--score_triples", type=int, default=20000, help="random triples scored for throughput")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("{:<4}{:<10}{:>10}{:>14}{:>10}{:>10}{:>10}{:>10}".format(
+        "K", "mode", "factors", "triples/s", "speedup", "MRR", "dMRR", "dHits@10"))
+    for k in [int(k) for k in args.ks.split(',')]:
+        config = make_config(args, k_factors=k)
+        corpus, entity_emb, relation_emb = load_corpus(args, config)
+        np.random.seed(args.seed)
+        torch.manual_seed(args.seed)
+        model = build_model('DisenE', entity_emb, relation_emb, config)
+        train_epochs(model, corpus, config, args.epochs)
+        model.eval()
+
+        rng = np.random.RandomState(args.seed)
+        triples = torch.LongTensor(np.stack([rng.randint(0, corpus.num_entities, args.score_triples),
+                                             rng.randint(0, corpus.num_relations, args.score_triples),
+                                             rng.randint(0, corpus.num_entities, args.score_triples)], 1))
+
+        def score():
+            with torch.no_grad():
+                return model(triples)
+
+        base_time, base = None, None
+        for mode in ['full'] + args.modes.split(','):
+            model.prune_factors, model.prune_mass = (0, 0.0) if mode == 'full' else parse_mode(mode)
+            elapsed = timeit(score, args.repeat)
+            metrics = evaluate(model, corpus, config, args.eval_triples)
+            # 平均每个三元组实际计算的因子个数
+            with torch.no_grad():
+                _, att = model(triples)
+            sorted_att = att.sort(1, descending=True)[0]
+            factors = float(k)
+            if mode != 'full':
+                n = model.prune_factors or k
+                needed = torch.full((len(att),), n)
+                if model.prune_mass:
+                    needed = torch.min(needed, (sorted_att.cumsum(1) < model.prune_mass).sum(1) + 1)
+                factors = needed.float().mean().item()
+            if base is None:
+                base_time, base = elapsed, metrics
+            print("{:<4}{:<10}{:>10.2f}{:>14.0f}{:>10.2f}{:>10.4f}{:>+10.4f}{:>+10.4f}".format(
+                k, mode, factors, len(triples) / elapsed, base_time / elapsed, metrics['MRR'],
+                metrics['MRR'] - base['MRR'], metrics['Hits@10'] - base['Hits@10']))
+        model.prune_factors, model.prune_mass = 0, 0.0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import argparse
+
+import numpy as np
+import torch
+
+from common import add_data_args, build_model, evaluate, load_corpus, make_config, train_epochs
+from inference import ScriptedScorer, build_scorer
+
+# int8 实体表(每行/每个因子一个缩放系数)相对float32的MRR/Hits@10变化和内存占用
+# python benchmarks/bench_quantization.py --epochs=5 --eval_triples=300
+
+
+def table_bytes(scorer):
+    return sum(buf.numel() * buf.element_size() for buf in scorer.entities.buffers())
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--models", default="TransE,DisenE_Trans,ConvKB,DisenE")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--eval_triples", type=int, default=300)
+    args = parser.parse_args()
+
+    config = make_config(args)
+    corpus, entity_emb, relation_emb = load_corpus(args, config)
+
+    print("{:<14}{:<12}{:>8}{:>10}{:>10}{:>12}{:>12}".format(
+        "model", "table", "MB", "MRR", "Hits@10", "dMRR", "dHits@10"))
+    for model_name in args.models.split(','):
+        np.random.seed(args.seed)
+        torch.manual_seed(args.seed)
+        model = build_model(model_name, entity_emb, relation_emb, config)
+        train_epochs(model, corpus, config, args.epochs)
+        model.eval()
+
+        base = None
+        for quantize in ('none', 'row', 'factor'):
+            scorer = build_scorer(model, model_name, quantize)
+            metrics = evaluate(ScriptedScorer(scorer, torch.device('cpu')), corpus, config, args.eval_triples)
+            if base is None:
+                base = metrics
+            print("{:<14}{:<12}{:>8.2f}{:>10.4f}{:>10.4f}{:>+12.4f}{:>+12.4f}".format(
+                model_name, 'float32' if quantize == 'none' else 'int8/' + quantize, table_bytes(scorer) / 2 ** 20,
+                metrics['MRR'], metrics['Hits@10'], metrics['MRR'] - base['MRR'],
+                metrics['Hits@10'] - base['Hits@10']))
+
+
+if __name__ == '__main__':
+    main()
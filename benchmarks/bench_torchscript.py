@@ -0,0 +1,48 @@
+import argparse
+
+import torch
+
+from common import add_data_args, build_model, load_corpus, make_config, timeit
+from inference import export_scorer
+
+# 比较eager模式与冻结的TorchScript打分模块在CPU上的延迟和吞吐量
+# python benchmarks/bench_torchscript.py --num_entities=20000 --threads=4
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--models", default="TransE,DisenE_Trans,ConvKB,DisenE")
+    parser.add_argument("--method", default="script", choices=["script", "trace"])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--output", default="/tmp/scorer.pt")
+    args = parser.parse_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    config = make_config(args)
+    corpus, entity_emb, relation_emb = load_corpus(args, config)
+    num_entities = entity_emb.shape[0]
+
+    # 一次查询 = 对所有实体替换尾实体后打分
+    query = torch.LongTensor(corpus.test_indices[:1]).repeat(num_entities, 1)
+    query[:, 2] = torch.arange(num_entities)
+
+    print("{:<14}{:>14}{:>14}{:>12}{:>16}{:>12}".format(
+        "model", "eager ms", "script ms", "speedup", "cand/s script", "max diff"))
+    for model_name in args.models.split(','):
+        model = build_model(model_name, entity_emb, relation_emb, config).eval()
+        eager = model.test if model_name in ('TransE', 'DisenE_Trans') else model
+        scripted = export_scorer(model, model_name, args.output, args.method)
+
+        with torch.no_grad():
+            diff = (eager(query)[0].view(-1) - scripted(query)).abs().max().item()
+            eager_time = timeit(lambda: eager(query), args.repeat)
+            script_time = timeit(lambda: scripted(query), args.repeat)
+        print("{:<14}{:>14.2f}{:>14.2f}{:>12.2f}{:>16.0f}{:>12.2e}".format(
+            model_name, eager_time * 1000, script_time * 1000, eager_time / script_time,
+            num_entities / script_time, diff))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+import torch
+
+from common import add_data_args, build_model, load_corpus, make_config
+from run import cal_atten_loss
+
+# 训练一步的耗时：每步多次 .item() 同步 + 逐对计算注意力损失(原来的写法) 与 设备上累加loss + 批量配对(run.train) 的对比
+# python benchmarks/bench_train_step.py --models=DisenE_Trans,DisenE --iters=30
+
+
+def cal_atten_loss_per_pair(args, batch_atten, batch_triples, batch_labels, tmp_size):
+    """原来的实现：每一对都要比较设备上的张量，每次比较都是一次同步"""
+    att_loss = torch.zeros(1, device=batch_atten.device)
+    sample_num = min(args.sample_num, batch_triples.shape[0])
+    cnt = 0
+    for i in range(tmp_size):
+        rel = batch_triples[i, 1]
+        att = batch_atten[i, :]
+        random_idx = (np.random.choice(batch_triples.shape[0], sample_num, replace=False)).tolist()
+        for idx in random_idx:
+            if rel == batch_triples[idx, 1] and batch_labels[idx] == 1:
+                att_loss += torch.dist(att, batch_atten[idx, :], p=2)
+                cnt += 1
+    if cnt == 0:
+        return att_loss
+    return att_loss / cnt
+
+
+def run_steps(model, corpus, config, iters, synced, device):
+    optimizer = torch.optim.Adam(model.parameters(), lr=config.lr, weight_decay=config.weight_decay)
+    model.train()
+    np.random.seed(config.seed)
+    loss_sum = 0.0
+    start_time = time.time()
+    for it in range(iters):
+        batch_triples, batch_labels = corpus.get_iteration_batch(it)
+        host_triples, host_labels = batch_triples, batch_labels
+        batch_triples = torch.LongTensor(batch_triples).to(device)
+        batch_labels = torch.FloatTensor(batch_labels).to(device)
+
+        pred_loss, batch_atten = model(batch_triples, batch_labels)
+        sorted_att, _ = torch.sort(batch_atten, dim=-1, descending=True)
+        top_att_loss = torch.mean(1 - torch.sum(sorted_att[:, :config.top_n], 1))
+        if synced:
+            att_loss = cal_atten_loss_per_pair(config, batch_atten, batch_triples, batch_labels.view(-1),
+                                               config.batch_size)
+        else:
+            att_loss = cal_atten_loss(config, batch_atten, host_triples, host_labels, it, corpus.train_indices)
+        loss = pred_loss + config.w1 * top_att_loss + config.w2 * att_loss
+
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        if synced:
+            # 原来每一步都读回各项loss
+            loss_sum += loss.item()
+            pred_loss.item(), top_att_loss.item(), att_loss.item()
+        else:
+            loss_sum = loss_sum + loss.detach()
+    loss_sum = float(loss_sum)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.time() - start_time) / iters, loss_sum / iters
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--models", default="DisenE_Trans,DisenE")
+    parser.add_argument("--iters", type=int, default=30)
+    args = parser.parse_args()
+
+    config = make_config(args, w1=0.1, w2=0.1)
+    corpus, entity_emb, relation_emb = load_corpus(args, config)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    corpus.train_indices = corpus.train_indices[:args.iters * args.batch_size]
+
+    print("{:<14}{:>14}{:>14}{:>10}{:>14}".format("model", "before ms", "after ms", "speedup", "loss diff"))
+    for model_name in args.models.split(','):
+        results = []
+        for synced in (True, False):
+            torch.manual_seed(args.seed)
+            model = build_model(model_name, entity_emb, relation_emb, config).to(device)
+            # 原来 DisenE_Trans 每一步都打印一次调试张量
+            model.debug = synced
+            with contextlib.redirect_stdout(io.StringIO()):
+                results.append(run_steps(model, corpus, config, args.iters, synced, device))
+        (before, loss_before), (after, loss_after) = results
+        print("{:<14}{:>14.2f}{:>14.2f}{:>10.2f}{:>14.2e}".format(
+            model_name, before * 1000, after * 1000, before / after, abs(loss_before - loss_after)))
+
+
+if __name__ == '__main__':
+    main()
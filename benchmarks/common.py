@@ -0,0 +1,198 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+import torch
+
+from dataloader import Corpus
+from models import ConvKB, DisenE, DisenE_Trans, TransE
+from process_data import build_data, init_embeddings
+
+MODELS = {'ConvKB': ConvKB, 'TransE': TransE, 'DisenE': DisenE, 'DisenE_Trans': DisenE_Trans}
+
+
+def add_data_args(parser):
+    parser.add_argument("--data_dir", default="None", help="real dataset folder; a synthetic KG is used if not given")
+    parser.add_argument("--num_entities", type=int, default=2000)
+    parser.add_argument("--num_relations", type=int, default=20)
+    parser.add_argument("--num_triples", type=int, default=20000)
+    parser.add_argument("--embedding_size", type=int, default=50)
+    parser.add_argument("--k_factors", type=int, default=4)
+    parser.add_argument("--out_channels", type=int, default=8)
+    parser.add_argument("--batch_size", type=int, default=128)
+    parser.add_argument("--valid_invalid_ratio", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser
+
+
+def make_config(args, **overrides):
+    # run.py 的默认超参数，再用命令行参数和overrides覆盖
+    config = argparse.Namespace(dataset="synthetic", lr=1e-3, weight_decay=1e-5, dropout=0.3, do_normalize=1,
+                                margin=5.0, sample_num=50, w1=0.0, w2=0.0, top_n=2, pretrained_emb=0)
+    for key, value in vars(args).items():
+        setattr(config, key, value)
+    for key, value in overrides.items():
+        setattr(config, key, value)
+    return config
+
+
+def synthetic_kg(num_entities, num_relations, num_triples, dim=16, seed=0):
+    """按平移结构生成的小图谱：t 是 h + r 最近的几个实体之一，因此可以学习"""
+    rng = np.random.RandomState(seed)
+    ent = rng.randn(num_entities, dim).astype(np.float32)
+    rel = rng.randn(num_relations, dim).astype(np.float32)
+
+    heads = rng.randint(0, num_entities, num_triples)
+    relations = rng.randint(0, num_relations, num_triples)
+    tails = np.empty(num_triples, dtype=np.int64)
+    for start in range(0, num_triples, 1024):
+        end = min(start + 1024, num_triples)
+        target = ent[heads[start:end]] + rel[relations[start:end]]
+        dist = np.abs(target[:, None, :] - ent[None, :, :]).sum(-1)
+        nearest = np.argpartition(dist, 3, axis=1)[:, :3]
+        tails[start:end] = nearest[np.arange(end - start), rng.randint(0, 3, end - start)]
+
+    triples = np.unique(np.stack([heads, relations, tails], 1), axis=0)
+    triples = triples[rng.permutation(len(triples))]
+    n_test = max(1, len(triples) // 20)
+    test, valid, train = triples[:n_test], triples[n_test:2 * n_test], triples[2 * n_test:]
+    to_list = lambda arr: [tuple(t) for t in arr.tolist()]
+    entity2id = {"e%d" % i: i for i in range(num_entities)}
+    relation2id = {"r%d" % i: i for i in range(num_relations)}
+    return to_list(train), to_list(valid), to_list(test), entity2id, relation2id
+
+
+def load_corpus(args, config):
+    """返回 Corpus 以及初始的实体/关系嵌入"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args.data_dir != "None":
+            config.dataset = os.path.basename(os.path.normpath(args.data_dir))
+            train, valid, test, link, entity2id, relation2id = build_data(args.data_dir)
+        else:
+            train, valid, test, entity2id, relation2id = synthetic_kg(
+                args.num_entities, args.num_relations, args.num_triples, seed=args.seed)
+            link = []
+        corpus = Corpus(config, train, valid, test, link, entity2id, relation2id,
+                        config.batch_size, config.valid_invalid_ratio)
+
+    if args.data_dir != "None" and os.path.exists(os.path.join(args.data_dir, 'entity2vec.txt')):
+        entity_emb, relation_emb = init_embeddings(os.path.join(args.data_dir, 'entity2vec.txt'),
+                                                   os.path.join(args.data_dir, 'relation2vec.txt'),
+                                                   config.k_factors, config.embedding_size)
+    else:
+        rng = np.random.RandomState(args.seed)
+        entity_emb = rng.randn(len(entity2id), config.embedding_size * config.k_factors)
+        relation_emb = rng.randn(len(relation2id), config.embedding_size)
+    return corpus, torch.FloatTensor(entity_emb), torch.FloatTensor(relation_emb)
+
+
+def build_model(model_name, entity_emb, relation_emb, config):
+    entity_emb = entity_emb.clone()
+    if model_name in ('ConvKB', 'TransE'):
+        # 非解耦模型只用第一个因子大小的嵌入
+        entity_emb = entity_emb[:, :relation_emb.shape[1]].contiguous()
+    return MODELS[model_name](entity_emb, relation_emb.clone(), config=config)
+
+
+def train_epochs(model, corpus, config, epochs, neg_mode='per_positive', pool_size=256, store=None):
+    """run.train 的精简版(不含注意力损失)，返回每秒处理的正样本数；store: EntityStore"""
+    params = model.parameters()
+    if store is not None:
+        params = [param for name, param in model.named_parameters() if name != 'entity_embeddings']
+    optimizer = torch.optim.Adam(params, lr=config.lr, weight_decay=config.weight_decay)
+    model.train()
+    num_iters = (len(corpus.train_indices) + config.batch_size - 1) // config.batch_size
+    seen, start_time = 0, time.time()
+    for epoch in range(epochs):
+        np.random.shuffle(corpus.train_indices)
+        for iters in range(num_iters):
+            if neg_mode == 'shared_pool':
+                batch_triples, pool, pool_mask = corpus.get_pool_batch(iters, pool_size)
+                if store is not None:
+                    batch_triples, pool = store.swap_in(model, batch_triples, pool)
+                loss, _ = model.forward_pool(torch.LongTensor(batch_triples), torch.LongTensor(pool),
+                                             torch.from_numpy(pool_mask))
+                seen += len(batch_triples)
+            else:
+                batch_triples, batch_labels = corpus.get_iteration_batch(iters)
+                if store is not None:
+                    batch_triples, = store.swap_in(model, batch_triples)
+                loss, _ = model(torch.LongTensor(batch_triples), torch.FloatTensor(batch_labels))
+                seen += len(batch_triples) // (config.valid_invalid_ratio + 1)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            if store is not None:
+                store.step(model, config.lr, config.weight_decay)
+    return seen / (time.time() - start_time)
+
+
+def evaluate(model, corpus, config, max_triples=None):
+    """用 Corpus.get_validation_pred 计算过滤后的 MRR / Hits@10"""
+    model.eval()
+    scorer = model.test if isinstance(model, (TransE, DisenE_Trans)) else model
+    test_indices = corpus.test_indices
+    if max_triples is not None:
+        corpus.test_indices = test_indices[:max_triples]
+    try:
+        with torch.no_grad(), contextlib.redirect_stdout(io.StringIO()):
+            mrr, mr, h1, h3, h10 = corpus.get_validation_pred(config, scorer)
+    finally:
+        corpus.test_indices = test_indices
+    return {'MRR': mrr, 'MR': mr, 'Hits@1': h1, 'Hits@3': h3, 'Hits@10': h10}
+
+
+def timeit(fn, repeat=5, warmup=1):
+    for _ in range(warmup):
+        fn()
+    start = time.time()
+    for _ in range(repeat):
+        fn()
+    return (time.time() - start) / repeat
+
+
+def saved_activation_mb(fn):
+    """fn() 构建的计算图中为反向保存的张量大小(按存储去重)"""
+    storages = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage() if hasattr(tensor, 'untyped_storage') else tensor.storage()
+        storages[storage.data_ptr()] = storage.nbytes() if hasattr(storage, 'nbytes') else \
+            storage.size() * tensor.element_size()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        loss = fn()
+    loss.backward()
+    return sum(storages.values()) / 2 ** 20
+
+
+def _current_rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def _peak_rss_child(fn, queue):
+    before = _current_rss_kb()
+    fn()
+    queue.put((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024)
+
+
+def peak_rss_mb(fn):
+    """在fork出的子进程中执行fn，返回执行期间常驻内存比执行前多出的峰值"""
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_peak_rss_child, args=(fn, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
@@ -0,0 +1,105 @@
+import numpy as np
+
+# 按关系的候选实体索引(CSR)：训练集中每个关系出现过的头实体/尾实体，
+# 可以再并上头(尾)实体集合相近的关系的集合；评估和链接预测时只对候选实体打分
+# python -u run.py --dataset=FB15k-237 --model_name=DisenE --evaluate=1 --load=... --candidate_index=1 --candidate_widen=0.3
+
+HEAD, TAIL = 0, 1
+
+
+class CandidateIndex:
+    def __init__(self, offsets, entities, num_entities):
+        """offsets[side]: [num_relations + 1]，entities[side]: 按关系排好的实体id；side 0 为头实体，1 为尾实体"""
+        self.offsets = offsets
+        self.entities = entities
+        self.num_entities = num_entities
+        self.num_relations = len(offsets[HEAD]) - 1
+
+    @classmethod
+    def from_triples(cls, triples, num_entities, num_relations, widen=0.0):
+        """
+        widen : 两个关系的头(尾)实体集合的Jaccard相似度不小于widen时，互相并入对方的候选集合，0表示不扩展
+        """
+        triples = np.asarray(triples, dtype=np.int64).reshape(-1, 3)
+        offsets, entities = [], []
+        for column in (0, 2):
+            pairs = np.unique(triples[:, 1] * num_entities + triples[:, column])
+            relations, ents = np.divmod(pairs, num_entities)
+            if widen > 0:
+                relations, ents = _widen(relations, ents, num_relations, num_entities, widen)
+            offsets.append(np.searchsorted(relations, np.arange(num_relations + 1)))
+            entities.append(ents)
+        return cls(offsets, entities, num_entities)
+
+    def candidates(self, relation, side):
+        offsets = self.offsets[side]
+        return self.entities[side][offsets[relation]:offsets[relation + 1]]
+
+    def sizes(self, side):
+        return np.diff(self.offsets[side])
+
+    def contains(self, triples):
+        """[n, 2] bool：头实体/尾实体是否在该关系的候选集合中"""
+        triples = np.asarray(triples, dtype=np.int64).reshape(-1, 3)
+        result = np.zeros((len(triples), 2), dtype=bool)
+        for side, column in ((HEAD, 0), (TAIL, 2)):
+            # 每个关系内部实体id有序，(关系, 实体) 编码后整体有序
+            keys = np.repeat(np.arange(self.num_relations), self.sizes(side)) * self.num_entities + \
+                self.entities[side]
+            query = triples[:, 1] * self.num_entities + triples[:, column]
+            pos = np.minimum(np.searchsorted(keys, query), max(len(keys) - 1, 0))
+            result[:, side] = keys[pos] == query if len(keys) else False
+        return result
+
+    def report(self, triples=None):
+        """每个关系候选集合的大小，以及 triples 中正确答案落在候选集合之外的比例"""
+        stats = {}
+        for side, name in ((HEAD, 'head'), (TAIL, 'tail')):
+            sizes = self.sizes(side)
+            stats[name] = {'mean': float(sizes.mean()), 'median': float(np.median(sizes)), 'max': int(sizes.max()),
+                           'fraction': float(sizes.mean() / self.num_entities)}
+        if triples is not None and len(triples):
+            triples = np.asarray(triples, dtype=np.int64).reshape(-1, 3)
+            inside = self.contains(triples)
+            for side, name in ((HEAD, 'head'), (TAIL, 'tail')):
+                stats[name]['miss_rate'] = float(1 - inside[:, side].mean())
+                # 按查询加权的候选个数，决定评估时实际要打分的三元组数
+                stats[name]['scored_per_query'] = float(self.sizes(side)[triples[:, 1]].mean())
+
+        for name in ('head', 'tail'):
+            line = "{} candidates per relation: mean {:.1f}, median {:.1f}, max {} ({:.2%} of entities)".format(
+                name, stats[name]['mean'], stats[name]['median'], stats[name]['max'], stats[name]['fraction'])
+            if 'miss_rate' in stats[name]:
+                line += ", answers outside the set {:.2%}, expected speedup {:.1f}x".format(
+                    stats[name]['miss_rate'], self.num_entities / max(stats[name]['scored_per_query'], 1))
+            print(line)
+        return stats
+
+
+def _widen(relations, ents, num_relations, num_entities, threshold):
+    # 关系两两之间共享的实体数：同一个实体的所有关系两两配对后计数
+    order = np.argsort(ents, kind='stable')
+    r_sorted, e_sorted = relations[order], ents[order]
+    starts = np.flatnonzero(np.r_[True, e_sorted[1:] != e_sorted[:-1]])
+    group_sizes = np.diff(np.r_[starts, len(e_sorted)])
+    member_sizes = np.repeat(group_sizes, group_sizes)
+    left = np.repeat(np.arange(len(e_sorted)), member_sizes)
+    within = np.arange(len(left)) - np.repeat(np.cumsum(member_sizes) - member_sizes, member_sizes)
+    right = np.repeat(np.repeat(starts, group_sizes), member_sizes) + within
+    shared = np.bincount(r_sorted[left] * num_relations + r_sorted[right],
+                         minlength=num_relations * num_relations).reshape(num_relations, num_relations)
+
+    set_sizes = np.diag(shared)
+    jaccard = shared / np.maximum(set_sizes[:, None] + set_sizes[None, :] - shared, 1)
+    similar = jaccard >= threshold
+
+    widened_r, widened_e = [relations], [ents]
+    offsets = np.searchsorted(relations, np.arange(num_relations + 1))
+    for r in range(num_relations):
+        for other in np.flatnonzero(similar[r]):
+            if other != r:
+                members = ents[offsets[other]:offsets[other + 1]]
+                widened_r.append(np.full(len(members), r, dtype=np.int64))
+                widened_e.append(members)
+    pairs = np.unique(np.concatenate(widened_r) * num_entities + np.concatenate(widened_e))
+    return np.divmod(pairs, num_entities)
@@ -0,0 +1,196 @@
+import torch
+import numpy as np
+
+import argparse
+import copy
+import os
+import random
+import time
+
+import run
+from dataloader import Corpus, eval_chunk_size, model_device
+from embedding_store import EntityStore
+from process_data import build_data
+
+# 级联链接预测：第一阶段用 TransE / DisenE_Trans 对全部实体打分，取前N个候选；第二阶段用 --model_name(DisenE、ConvKB等)只对这N个重新打分
+# python -u cascade.py --first_load=./results/FB15k-237/trans/trained_final.pth --shortlist=100 --dataset=FB15k-237 --model_name=DisenE --k_factors=6 --embedding_size=200 --load=./results/FB15k-237/model/trained_final.pth
+# --report=1 在测试集上比较不同N的召回损失、MRR/Hits@10和每个查询的延迟：
+# python -u cascade.py --report=1 --shortlist=10,50,100,500 --eval_triples=1000 --first_load=... --dataset=FB15k-237 --model_name=DisenE --load=...
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--first_model", default="DisenE_Trans", choices=("TransE", "DisenE_Trans"))
+parser.add_argument("--first_load", required=True, help="checkpoint of the first-stage model")
+parser.add_argument("--first_entity_store", default="None",
+                    help="entity store of the first-stage model, if it was trained with --entity_store")
+parser.add_argument("--shortlist", default="100", help="candidates kept by the first stage, a list with --report=1")
+parser.add_argument("--topk", type=int, default=10, help="entities returned per link prediction query")
+parser.add_argument("--report", type=int, default=0, help="report recall / MRR / latency per shortlist size")
+parser.add_argument("--eval_triples", type=int, default=0, help="test triples used by --report, 0 for all")
+
+
+def load_stage(args, model_name, path, entity_store='None'):
+    """
+    按checkpoint中参数的形状推出 embedding_size / k_factors(分解的实体表还有 factored_rank)，返回 (模型, 该阶段的参数)
+    entity_store : 用 --entity_store 训练的checkpoint中没有实体表，评估时直接使用该目录下内存映射的表
+    """
+    state_dict = torch.load(path, map_location='cpu')
+    stage_args = copy.copy(args)
+    stage_args.model_name = model_name
+    stage_args.embedding_size = state_dict['relation_embeddings'].shape[1]
+    stage_args.factored_rank = 0
+    store = None
+    if 'entity_embeddings.base' in state_dict:
+        stage_args.factored_rank = state_dict['entity_embeddings.coef'].shape[1]
+        num_entities, dim = len(state_dict['entity_embeddings.base']), state_dict['entity_embeddings.basis'].shape[1]
+    elif 'entity_embeddings' in state_dict:
+        num_entities, dim = state_dict['entity_embeddings'].shape
+    elif entity_store != 'None':
+        store = EntityStore(entity_store, args.cache_rows, args.cache_policy,
+                            'cuda' if torch.cuda.is_available() else 'cpu')
+        # 占位，加载后换成内存映射的表
+        num_entities, dim = 1, store.dim
+    else:
+        raise ValueError("{} has no entity table (trained with --entity_store?), "
+                         "pass the store folder for this stage".format(path))
+    stage_args.k_factors = dim // stage_args.embedding_size
+
+    # 参数由 load_state_dict 覆盖，这里只需要形状
+    model = run.build_model(stage_args, torch.zeros(num_entities, dim), state_dict['relation_embeddings'])
+    model.load_state_dict(state_dict, strict=store is None)
+    if torch.cuda.is_available():
+        model.cuda()
+    if store is not None:
+        store.attach(model, normalize=stage_args.do_normalize and model_name in ('ConvKB', 'DisenE'))
+    return model.eval(), stage_args
+
+
+def scorer(model, model_name):
+    # 与 evaluate 一致：平移类模型用 test 打分，分数越高越好
+    return model.test if model_name in ('TransE', 'DisenE_Trans') else model
+
+
+def rerank(args, model, triple, column, ids):
+    """第二阶段：ids 放到 column 位置上打分，返回按分数从高到低排好的 (ids, 分数)"""
+    chunk_size = eval_chunk_size(args, model)
+    device = model_device(model)
+    scores = []
+    for start in range(0, len(ids), chunk_size):
+        batch = torch.LongTensor(triple.reshape(1, 3)).to(device).repeat(len(ids[start:start + chunk_size]), 1)
+        batch[:, column] = torch.from_numpy(ids[start:start + chunk_size]).to(device)
+        scores.append(model(batch)[0].view(-1))
+    scores = torch.cat(scores).cpu().numpy() if scores else np.zeros(0, dtype=np.float32)
+    order = np.argsort(-scores, kind='stable')
+    return ids[order], scores[order]
+
+
+def link_predict(corpus, first, second, queries, shortlist, topk):
+    """(h, r, -1) / (-1, r, t) 查询：第一阶段取前 shortlist 个，第二阶段重排后返回前 topk 个实体id"""
+    (first_model, first_args), (second_model, second_args) = first, second
+    results = []
+    for query in queries:
+        column = 0 if query[0] == -1 else 2
+        ids = corpus.link_topk(first_args, first_model, query, max(shortlist, topk))
+        ids, _ = rerank(second_args, scorer(second_model, second_args.model_name), query, column, ids)
+        results.append(ids[:topk])
+    return results
+
+
+def report(corpus, first, second, triples, shortlists):
+    """
+    过滤设定下的级联评估：正确答案不在前N个候选中时记为最后一名
+    每个N输出召回(答案在候选中的比例)、MRR、Hits@10，以及两个阶段每个查询的平均延迟
+    """
+    (first_model, first_args), (second_model, second_args) = first, second
+    second_scorer = scorer(second_model, second_args.model_name)
+    max_n = max(shortlists)
+    ranks = {n: [] for n in shortlists}
+    first_ranks = []
+    first_time, second_time = 0.0, {n: 0.0 for n in shortlists}
+
+    for triple in triples:
+        for column in (0, 2):
+            answer = triple[column]
+            query = triple.copy()
+            query[column] = -1
+            start = time.time()
+            short = corpus.link_topk(first_args, first_model, query, max_n, answer=answer)
+            first_time += time.time() - start
+            hit = np.flatnonzero(short == answer)
+            first_ranks.append(hit[0] + 1 if len(hit) else corpus.num_entities)
+
+            for n in shortlists:
+                start = time.time()
+                if len(hit) and hit[0] < n:
+                    # 候选已经去掉了其它已知三元组，直接数分数更高的个数
+                    ids, scores = rerank(second_args, second_scorer, triple, column, short[:n])
+                    rank = int((scores > scores[ids == answer][0]).sum()) + 1
+                else:
+                    rank = corpus.num_entities
+                second_time[n] += time.time() - start
+                ranks[n].append(rank)
+
+    num_queries = max(len(first_ranks), 1)
+    first_ranks = np.array(first_ranks)
+    print("{:<10}{:>10}{:>10}{:>10}{:>12}{:>12}{:>12}".format(
+        "N", "recall", "MRR", "Hits@10", "stage1 ms", "stage2 ms", "total ms"))
+    stats = {}
+    for n in shortlists:
+        r = np.array(ranks[n])
+        stats[n] = {'recall': float(np.mean(first_ranks <= n)), 'MRR': float(np.mean(1.0 / r)),
+                    'Hits@10': float(np.mean(r <= 10)), 'stage1_ms': 1000 * first_time / num_queries,
+                    'stage2_ms': 1000 * second_time[n] / num_queries}
+        stats[n]['total_ms'] = stats[n]['stage1_ms'] + stats[n]['stage2_ms']
+        print("{:<10}{:>10.4f}{:>10.4f}{:>10.4f}{:>12.2f}{:>12.2f}{:>12.2f}".format(
+            n, stats[n]['recall'], stats[n]['MRR'], stats[n]['Hits@10'], stats[n]['stage1_ms'],
+            stats[n]['stage2_ms'], stats[n]['total_ms']))
+    print("first stage alone (within top {}): MRR {:.4f}, Hits@10 {:.4f}".format(
+        max_n, np.mean(1.0 / first_ranks), np.mean(first_ranks <= 10)))
+
+    # 不级联：第二阶段对全部实体打分
+    start = time.time()
+    full = np.array([corpus.rank_triple(second_args, second_scorer, triple) for triple in triples]).reshape(-1)
+    full_ms = 1000 * (time.time() - start) / num_queries
+    stats['all'] = {'recall': 1.0, 'MRR': float(np.mean(1.0 / full)), 'Hits@10': float(np.mean(full <= 10)),
+                    'stage1_ms': 0.0, 'stage2_ms': full_ms, 'total_ms': full_ms}
+    print("{:<10}{:>10.4f}{:>10.4f}{:>10.4f}{:>12.2f}{:>12.2f}{:>12.2f}".format(
+        "all", 1.0, stats['all']['MRR'], stats['all']['Hits@10'], 0.0, full_ms, full_ms))
+    return stats
+
+
+def main():
+    cascade_args, run_argv = parser.parse_known_args()
+    args = run.parser.parse_args(run_argv)
+    if args.load == 'None':
+        raise ValueError("--load is required: the second-stage checkpoint")
+    args.data_dir = os.path.join(args.data_dir, args.dataset)
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    print("args = ", args, cascade_args)
+
+    train_data, validation_data, test_data, link_data, entity2id, relation2id = build_data(
+        args.data_dir, streaming=args.stream_data, num_workers=args.load_workers)
+    corpus = Corpus(args, train_data, validation_data, test_data, link_data, entity2id, relation2id,
+                    args.batch_size, args.valid_invalid_ratio)
+    run.use_candidate_index(args, corpus)
+
+    first = load_stage(args, cascade_args.first_model, cascade_args.first_load, cascade_args.first_entity_store)
+    second = load_stage(args, args.model_name, args.load, args.entity_store)
+    shortlists = sorted(int(n) for n in cascade_args.shortlist.split(','))
+
+    with torch.no_grad():
+        if cascade_args.report:
+            triples = corpus.test_indices
+            if cascade_args.eval_triples:
+                triples = triples[:cascade_args.eval_triples]
+            report(corpus, first, second, triples, shortlists)
+        else:
+            start = time.time()
+            sort_list = link_predict(corpus, first, second, corpus.link_indices, shortlists[0], cascade_args.topk)
+            print("链接预测总共用的时间:{}".format(time.time() - start))
+            run.write_link_results(corpus, sort_list)
+
+
+if __name__ == '__main__':
+    main()
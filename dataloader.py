@@ -1,8 +1,31 @@
 import torch
+import torch.nn.functional as F
 import numpy as np
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
 import time
 
 
+def to_indices(triples):
+    return np.asarray(triples, dtype=np.int32).reshape(-1, 3)
+
+
+def triple_keys(triples, num_entities, num_relations):
+    # (h, r, t) 编码成一个int64，用于向量化地判断三元组是否存在
+    triples = np.asarray(triples, dtype=np.int64).reshape(-1, 3)
+    return (triples[:, 0] * num_relations + triples[:, 1]) * num_entities + triples[:, 2]
+
+
+def to_tuples(triples):
+    if isinstance(triples, np.ndarray):
+        return map(tuple, triples.tolist())
+    return triples
+
+
 class Corpus:
     def __init__(self, args, train_data, validation_data, test_data, link_data, entity2id, relation2id,
                  batch_size, valid_to_invalid_samples_ratio):
@@ -12,36 +35,53 @@ class Corpus:
         self.link_triples = link_data
 
         self.entity2id = entity2id
-        self.id2entity = {v: k for k, v in self.entity2id.items()}
         self.relation2id = relation2id
-        self.id2relation = {v: k for k, v in self.relation2id.items()}
+        # id2entity / id2relation 用到时才构建；大图上用 vocab.Vocab 做批量映射
+        self._id2entity = None
+        self._id2relation = None
         self.batch_size = batch_size
         # ratio of valid to invalid samples per batch  40
         self.invalid_valid_ratio = int(valid_to_invalid_samples_ratio)
 
-        self.train_indices = np.array(
-            list(self.train_triples)).astype(np.int32)
+        # 三元组可以是tuple列表(load_data)，也可以是int32数组(load_data_stream)
+        self.train_indices = to_indices(self.train_triples)
         # These are valid triples, hence all have value 1
-        self.train_values = np.array(
-            [[1]] * len(self.train_triples)).astype(np.float32)
+        self.train_values = np.ones((len(self.train_indices), 1), dtype=np.float32)
 
-        self.validation_indices = np.array(
-            list(self.validation_triples)).astype(np.int32)
-        self.validation_values = np.array(
-            [[1]] * len(self.validation_triples)).astype(np.float32)
+        self.validation_indices = to_indices(self.validation_triples)
+        self.validation_values = np.ones((len(self.validation_indices), 1), dtype=np.float32)
 
         # 测试文件
-        self.link_indices = np.array(list(self.link_triples)).astype(np.int32)
+        self.link_indices = to_indices(self.link_triples)
 
-        self.test_indices = np.array(list(self.test_triples)).astype(np.int32)
-        self.test_values = np.array(
-            [[1]] * len(self.test_triples)).astype(np.float32)
+        self.test_indices = to_indices(self.test_triples)
+        self.test_values = np.ones((len(self.test_indices), 1), dtype=np.float32)
 
-        self.valid_triples_dict = {j: i for i, j in enumerate(
-            self.train_triples + self.validation_triples + self.test_triples)}
+        self.valid_triples_dict = None
+        if not isinstance(self.train_triples, np.ndarray):
+            # 流式读入(int32数组)时不建这个字典，负采样和过滤只用下面的 valid_keys
+            self.valid_triples_dict = {j: i for i, j in enumerate(itertools.chain(
+                to_tuples(self.train_triples), to_tuples(self.validation_triples), to_tuples(self.test_triples)))}
+
+        # 与 valid_triples_dict 内容相同的有序int64键，供批量过滤使用
+        self.num_entities = len(self.entity2id)
+        if isinstance(self.entity2id, dict):
+            self.entity_list = np.array([j for i, j in self.entity2id.items()], dtype=np.int64)
+        else:
+            # vocab.Vocab：id 就是 0..n-1
+            self.entity_list = np.arange(self.num_entities, dtype=np.int64)
+        self.num_relations = len(self.relation2id)
+        self.valid_keys = np.unique(np.concatenate([
+            triple_keys(indices, self.num_entities, self.num_relations)
+            for indices in (self.train_indices, self.validation_indices, self.test_indices)]))
+
+        # candidates.CandidateIndex，设置后评估/链接预测只对该关系的候选实体打分
+        self.candidate_index = None
+        # link_cache.LinkCache，设置后 get_validation_pred2 先查缓存
+        self.link_cache = None
 
         print("Total triples count {}, training triples {}, validation_triples {}, test_triples {}".format(
-            len(self.valid_triples_dict), len(self.train_indices),
+            len(self.valid_keys), len(self.train_indices),
             len(self.validation_indices), len(self.test_indices)))
         # For training purpose
         self.batch_triples = np.empty(
@@ -49,6 +89,26 @@ class Corpus:
         self.batch_labels = np.empty(
             (self.batch_size * (self.invalid_valid_ratio + 1), 1)).astype(np.float32)
 
+    @property
+    def id2entity(self):
+        if self._id2entity is None:
+            self._id2entity = {v: k for k, v in self.entity2id.items()}
+        return self._id2entity
+
+    def entity_names(self, ids):
+        """id数组 -> 实体名列表：vocab.Vocab 批量映射，字典词表用 id2entity"""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        if isinstance(self.entity2id, dict):
+            id2entity = self.id2entity
+            return [id2entity[i] for i in ids.tolist()]
+        return self.entity2id.names(ids)
+
+    @property
+    def id2relation(self):
+        if self._id2relation is None:
+            self._id2relation = {v: k for k, v in self.relation2id.items()}
+        return self._id2relation
+
     def get_iteration_batch(self, iter_num):
 
         self.tmp_size = self.batch_size
@@ -97,8 +157,9 @@ class Corpus:
                     current_index = i * (self.invalid_valid_ratio // 2) + j
 
                     # 破坏头实体，并且判断破坏后的三元组是否是有效三元组【训练集和验证集、测试集】
-                    while (random_entities[current_index], self.batch_triples[last_index + current_index, 1],
-                           self.batch_triples[last_index + current_index, 2]) in self.valid_triples_dict.keys():
+                    while self.is_known(random_entities[current_index],
+                                        self.batch_triples[last_index + current_index, 1],
+                                        self.batch_triples[last_index + current_index, 2]):
                         random_entities[current_index] = np.random.randint(
                             0, len(self.entity2id))
                     # 对破坏的头实体进行赋值
@@ -110,9 +171,9 @@ class Corpus:
                     current_index = last_index * (self.invalid_valid_ratio // 2) + (
                             i * (self.invalid_valid_ratio // 2) + j)
 
-                    while (self.batch_triples[last_index + current_index, 0],
-                           self.batch_triples[last_index + current_index, 1],
-                           random_entities[current_index]) in self.valid_triples_dict.keys():
+                    while self.is_known(self.batch_triples[last_index + current_index, 0],
+                                        self.batch_triples[last_index + current_index, 1],
+                                        random_entities[current_index]):
                         random_entities[current_index] = np.random.randint(
                             0, len(self.entity2id))
                     self.batch_triples[last_index + current_index,
@@ -123,6 +184,94 @@ class Corpus:
 
         return self.batch_triples, self.batch_labels
 
+    def is_known(self, head, relation, tail):
+        """单个三元组是否在训练集/验证集/测试集中"""
+        if self.valid_triples_dict is not None:
+            return (head, relation, tail) in self.valid_triples_dict
+        key = (int(head) * self.num_relations + int(relation)) * self.num_entities + int(tail)
+        return _sorted_contains(self.valid_keys, key)
+
+    def is_valid(self, triples):
+        return self.is_valid_keys(triple_keys(triples, self.num_entities, self.num_relations))
+
+    def add_entities(self, names):
+        """新实体的id接在已有id之后，返回names对应的id(已有的实体返回原来的id)"""
+        ids = _grow_vocab(self.entity2id, names)
+        if len(self.entity2id) != self.num_entities:
+            self._resize_keys(len(self.entity2id), self.num_relations)
+            self.entity_list = np.arange(self.num_entities, dtype=np.int64)
+            self._id2entity = None
+        return ids
+
+    def add_relations(self, names):
+        ids = _grow_vocab(self.relation2id, names)
+        if len(self.relation2id) != self.num_relations:
+            self._resize_keys(self.num_entities, len(self.relation2id))
+            self._id2relation = None
+        return ids
+
+    def _resize_keys(self, num_entities, num_relations):
+        # 实体/关系数变了，已有的键按新的编码重算；(h, r, t) 的字典序不变，不需要重新排序
+        keys = self.valid_keys
+        tails = keys % self.num_entities
+        heads, relations = np.divmod(keys // self.num_entities, self.num_relations)
+        self.valid_keys = (heads * num_relations + relations) * num_entities + tails
+        self.num_entities = num_entities
+        self.num_relations = num_relations
+
+    def add_triples(self, train=None, validation=None, test=None):
+        """
+        增量加入新的三元组(id形式，新实体/关系要先用 add_entities / add_relations 分配id)，
+        就地更新训练集和过滤用的 valid_triples_dict(有的话) / valid_keys，不重新构建
+        """
+        added = []
+        for name, triples in (('train', train), ('validation', validation), ('test', test)):
+            if triples is None or len(triples) == 0:
+                continue
+            indices = to_indices(triples)
+            old = getattr(self, name + '_triples')
+            if isinstance(old, np.ndarray):
+                setattr(self, name + '_triples', np.concatenate([old, indices.astype(old.dtype)]))
+            else:
+                old.extend(to_tuples(indices))
+            setattr(self, name + '_indices', np.concatenate([getattr(self, name + '_indices'), indices]))
+            setattr(self, name + '_values', np.ones((len(getattr(self, name + '_indices')), 1), dtype=np.float32))
+            added.append(indices)
+        if not added:
+            return
+
+        if self.valid_triples_dict is not None:
+            start = len(self.valid_triples_dict)
+            for i, triple in enumerate(to_tuples(np.concatenate(added))):
+                self.valid_triples_dict.setdefault(triple, start + i)
+        keys = np.unique(triple_keys(np.concatenate(added), self.num_entities, self.num_relations))
+        keys = keys[~self.is_valid_keys(keys)]
+        self.valid_keys = np.insert(self.valid_keys, np.searchsorted(self.valid_keys, keys), keys)
+
+    def is_valid_keys(self, keys):
+        if len(self.valid_keys) == 0:
+            return np.zeros(len(keys), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.valid_keys, keys), len(self.valid_keys) - 1)
+        return self.valid_keys[pos] == keys
+
+    def get_pool_batch(self, iter_num, pool_size):
+        """
+        共享负样本池：返回本批次的正样本 [b, 3]，全批次共用的 pool_size 个随机实体，
+        以及 [2, b, pool_size] 的假负样本掩码(0: 替换头实体, 1: 替换尾实体)
+        """
+        start = self.batch_size * iter_num
+        batch_triples = self.train_indices[start:min(start + self.batch_size, len(self.train_indices))]
+        pool = np.random.randint(0, self.num_entities, pool_size)
+
+        b, n = len(batch_triples), len(pool)
+        corrupted = np.repeat(batch_triples[:, None, :], n, axis=1)  # [b, n, 3]
+        pool_mask = np.empty((2, b, n), dtype=bool)
+        for side, column in enumerate((0, 2)):
+            corrupted[:, :, column] = pool[None, :]
+            pool_mask[side] = self.is_valid(corrupted.reshape(-1, 3)).reshape(b, n)
+            corrupted[:, :, column] = batch_triples[:, None, column]
+        return batch_triples, pool, pool_mask
+
     def transe_scoring(self, batch_inputs, entity_embeddings, relation_embeddings):
         source_embeds = entity_embeddings[batch_inputs[:, 0]]
         relation_embeds = relation_embeddings[batch_inputs[:, 1]]
@@ -131,277 +280,334 @@ class Corpus:
         x = torch.norm(x, p=1, dim=1)
         return x
 
-    def get_validation_pred(self, args, model):
-        average_hits_at_100_head, average_hits_at_100_tail = [], []
-        average_hits_at_ten_head, average_hits_at_ten_tail = [], []
-        average_hits_at_three_head, average_hits_at_three_tail = [], []
-        average_hits_at_one_head, average_hits_at_one_tail = [], []
-        average_mean_rank_head, average_mean_rank_tail = [], []
-        average_mean_recip_rank_head, average_mean_recip_rank_tail = [], []
-
-        for iters in range(1):
-            start_time = time.time()
-
-            indices = [i for i in range(len(self.test_indices))]
-            batch_triples = self.test_indices[indices, :]
-            print("Sampled indices")
-            print("test set length ", len(self.test_indices))
-            entity_list = [j for i, j in self.entity2id.items()]
-
-            ranks_head, ranks_tail = [], []
-            reciprocal_ranks_head, reciprocal_ranks_tail = [], []
-            hits_at_100_head, hits_at_100_tail = 0, 0
-            hits_at_ten_head, hits_at_ten_tail = 0, 0
-            hits_at_three_head, hits_at_three_tail = 0, 0
-            hits_at_one_head, hits_at_one_tail = 0, 0
-
-            for i in range(batch_triples.shape[0]):
-                # print("triple index:", i)
-                start_time_it = time.time()
-                new_x_batch_head = np.tile(
-                    batch_triples[i, :], (len(self.entity2id), 1))
-                new_x_batch_tail = np.tile(
-                    batch_triples[i, :], (len(self.entity2id), 1))
-
-                new_x_batch_head[:, 0] = entity_list
-                new_x_batch_tail[:, 2] = entity_list
-
-                last_index_head = []  # array of already existing triples
-                last_index_tail = []
-                for tmp_index in range(len(new_x_batch_head)):
-                    temp_triple_head = (new_x_batch_head[tmp_index][0], new_x_batch_head[tmp_index][1],
-                                        new_x_batch_head[tmp_index][2])
-                    if temp_triple_head in self.valid_triples_dict.keys():
-                        last_index_head.append(tmp_index)
-
-                    temp_triple_tail = (new_x_batch_tail[tmp_index][0], new_x_batch_tail[tmp_index][1],
-                                        new_x_batch_tail[tmp_index][2])
-                    if temp_triple_tail in self.valid_triples_dict.keys():
-                        last_index_tail.append(tmp_index)
+    def get_validation_pred(self, args, model, triples=None):
+        '''
+        triples : 要评估的三元组，默认是测试集(sweep.py 用验证集的子集)
+        '''
+        start_time = time.time()
+        if triples is None:
+            triples = self.test_indices
+        print("Sampled indices")
+        print("test set length ", len(triples))
 
+        if getattr(args, 'eval_workers', 0) > 1:
+            ranks = run_parallel(self, args, model, _rank_shard, triples, args.eval_workers)
+        else:
+            ranks = [self.rank_triple(args, model, triples[i]) for i in range(len(triples))]
+
+        ranks_head = [rank_head for rank_head, _ in ranks]
+        ranks_tail = [rank_tail for _, rank_tail in ranks]
+        print("here {}".format(len(ranks_head)))
+        print("\nCurrent iteration time {}".format(time.time() - start_time))
+        return self.report_ranks(ranks_head, ranks_tail)
+
+    def candidates(self, relation, side):
+        """side 0: 替换头实体，1: 替换尾实体；没有候选索引(或该关系没有候选)时为全部实体"""
+        if self.candidate_index is not None:
+            candidates = self.candidate_index.candidates(relation, side)
+            if len(candidates):
+                return candidates
+        return self.entity_list
+
+    def rank_triple(self, args, model, triple):
+        """
+        过滤后的头实体/尾实体排名：rank = 1 + 分数严格高于正确三元组的候选个数
+        候选实体按 eval_chunk_size 分块送入模型，只保留累计的计数
+        """
+        chunk_size = eval_chunk_size(args, model)
+        device = model_device(model)
+        true_score = model(torch.LongTensor(triple.reshape(1, 3)).to(device))[0].view(-1)[0]
+
+        ranks = []
+        for side, column in enumerate((0, 2)):
+            candidates = self.candidates(triple[1], side)
+            if candidates is not self.entity_list and not _sorted_contains(candidates, triple[column]):
+                # 正确答案不在候选集合中：只对候选打分时不可能被预测到，记为最后一名
+                ranks.append(self.num_entities)
+                continue
+            num_greater = 0
+            for start in range(0, len(candidates), chunk_size):
+                new_x_batch = np.tile(triple, (len(candidates[start:start + chunk_size]), 1))
+                new_x_batch[:, column] = candidates[start:start + chunk_size]
                 # Deleting already existing triples, leftover triples are invalid, according
                 # to train, validation and test data
-                # Note, all of them maynot be actually invalid
-                new_x_batch_head = np.delete(
-                    new_x_batch_head, last_index_head, axis=0)
-                new_x_batch_tail = np.delete(
-                    new_x_batch_tail, last_index_tail, axis=0)
-
-                # adding the current valid triples to the top, i.e, index 0
-                new_x_batch_head = np.insert(
-                    new_x_batch_head, 0, batch_triples[i], axis=0)
-                new_x_batch_tail = np.insert(
-                    new_x_batch_tail, 0, batch_triples[i], axis=0)
-
-                import math
-                # Have to do this, because it doesn't fit in memory
-
-                if 'WN' in args.dataset:
-                    num_triples_each_shot = int(
-                        math.ceil(new_x_batch_head.shape[0] / 4))
-
-                    scores1_head, _ = model(torch.LongTensor(
-                        new_x_batch_head[:num_triples_each_shot, :]).cuda())
-                    scores2_head, _ = model(torch.LongTensor(
-                        new_x_batch_head[num_triples_each_shot: 2 * num_triples_each_shot, :]).cuda())
-                    scores3_head, _ = model(torch.LongTensor(
-                        new_x_batch_head[2 * num_triples_each_shot: 3 * num_triples_each_shot, :]).cuda())
-                    scores4_head, _ = model(torch.LongTensor(
-                        new_x_batch_head[3 * num_triples_each_shot: 4 * num_triples_each_shot, :]).cuda())
-
-                    scores_head = torch.cat(
-                        [scores1_head, scores2_head, scores3_head, scores4_head], dim=0)
-
-                else:
-                    scores_head, _ = model(new_x_batch_head)
-
-                sorted_scores_head, sorted_indices_head = torch.sort(
-                    scores_head.view(-1), dim=-1, descending=True)
-                # Just search for zeroth index in the sorted scores, we appended valid triple at top
-                ranks_head.append(
-                    np.where(sorted_indices_head.cpu().numpy() == 0)[0][0] + 1)
-                reciprocal_ranks_head.append(1.0 / ranks_head[-1])
-
-                # Tail part here
-
-                if 'WN' in args.dataset:
-                    num_triples_each_shot = int(
-                        math.ceil(new_x_batch_tail.shape[0] / 4))
-
-                    scores1_tail, _ = model(torch.LongTensor(
-                        new_x_batch_tail[:num_triples_each_shot, :]).cuda())
-                    scores2_tail, _ = model(torch.LongTensor(
-                        new_x_batch_tail[num_triples_each_shot: 2 * num_triples_each_shot, :]).cuda())
-                    scores3_tail, _ = model(torch.LongTensor(
-                        new_x_batch_tail[2 * num_triples_each_shot: 3 * num_triples_each_shot, :]).cuda())
-                    scores4_tail, _ = model(torch.LongTensor(
-                        new_x_batch_tail[3 * num_triples_each_shot: 4 * num_triples_each_shot, :]).cuda())
-
-                    scores_tail = torch.cat(
-                        [scores1_tail, scores2_tail, scores3_tail, scores4_tail], dim=0)
-
-
-                else:
-                    scores_tail, _ = model(new_x_batch_tail)
-
-                sorted_scores_tail, sorted_indices_tail = torch.sort(
-                    scores_tail.view(-1), dim=-1, descending=True)
-
-                # Just search for zeroth index in the sorted scores, we appended valid triple at top
-                ranks_tail.append(
-                    np.where(sorted_indices_tail.cpu().numpy() == 0)[0][0] + 1)
-                reciprocal_ranks_tail.append(1.0 / ranks_tail[-1])
-                # print("ranks_head - ", ranks_head[-1], "    ranks_tail - ", ranks_tail[-1])
-
-            for i in range(len(ranks_head)):
-                if ranks_head[i] <= 100:
-                    hits_at_100_head = hits_at_100_head + 1
-                if ranks_head[i] <= 10:
-                    hits_at_ten_head = hits_at_ten_head + 1
-                if ranks_head[i] <= 3:
-                    hits_at_three_head = hits_at_three_head + 1
-                if ranks_head[i] == 1:
-                    hits_at_one_head = hits_at_one_head + 1
-
-            for i in range(len(ranks_tail)):
-                if ranks_tail[i] <= 100:
-                    hits_at_100_tail = hits_at_100_tail + 1
-                if ranks_tail[i] <= 10:
-                    hits_at_ten_tail = hits_at_ten_tail + 1
-                if ranks_tail[i] <= 3:
-                    hits_at_three_tail = hits_at_three_tail + 1
-                if ranks_tail[i] == 1:
-                    hits_at_one_tail = hits_at_one_tail + 1
-
-            assert len(ranks_head) == len(reciprocal_ranks_head)
-            assert len(ranks_tail) == len(reciprocal_ranks_tail)
-            print("here {}".format(len(ranks_head)))
-            print("\nCurrent iteration time {}".format(time.time() - start_time))
-
-            average_hits_at_100_head.append(
-                hits_at_100_head / len(ranks_head))
-            average_hits_at_ten_head.append(
-                hits_at_ten_head / len(ranks_head))
-            average_hits_at_three_head.append(
-                hits_at_three_head / len(ranks_head))
-            average_hits_at_one_head.append(
-                hits_at_one_head / len(ranks_head))
-            average_mean_rank_head.append(sum(ranks_head) / len(ranks_head))
-            average_mean_recip_rank_head.append(
-                sum(reciprocal_ranks_head) / len(reciprocal_ranks_head))
-
-            average_hits_at_100_tail.append(
-                hits_at_100_tail / len(ranks_head))
-            average_hits_at_ten_tail.append(
-                hits_at_ten_tail / len(ranks_head))
-            average_hits_at_three_tail.append(
-                hits_at_three_tail / len(ranks_head))
-            average_hits_at_one_tail.append(
-                hits_at_one_tail / len(ranks_head))
-            average_mean_rank_tail.append(sum(ranks_tail) / len(ranks_tail))
-            average_mean_recip_rank_tail.append(
-                sum(reciprocal_ranks_tail) / len(reciprocal_ranks_tail))
-
-        print("\nAveraged stats for replacing head are -> ")
-        print("Hits@100 are {}".format(
-            sum(average_hits_at_100_head) / len(average_hits_at_100_head)))
-        print("Hits@10 are {}".format(
-            sum(average_hits_at_ten_head) / len(average_hits_at_ten_head)))
-        print("Hits@3 are {}".format(
-            sum(average_hits_at_three_head) / len(average_hits_at_three_head)))
-        print("Hits@1 are {}".format(
-            sum(average_hits_at_one_head) / len(average_hits_at_one_head)))
-        print("Mean rank {}".format(
-            sum(average_mean_rank_head) / len(average_mean_rank_head)))
-        print("Mean Reciprocal Rank {}".format(
-            sum(average_mean_recip_rank_head) / len(average_mean_recip_rank_head)))
-
-        print("\nAveraged stats for replacing tail are -> ")
-        print("Hits@100 are {}".format(
-            sum(average_hits_at_100_tail) / len(average_hits_at_100_tail)))
-        print("Hits@10 are {}".format(
-            sum(average_hits_at_ten_tail) / len(average_hits_at_ten_tail)))
-        print("Hits@3 are {}".format(
-            sum(average_hits_at_three_tail) / len(average_hits_at_three_tail)))
-        print("Hits@1 are {}".format(
-            sum(average_hits_at_one_tail) / len(average_hits_at_one_tail)))
-        print("Mean rank {}".format(
-            sum(average_mean_rank_tail) / len(average_mean_rank_tail)))
-        print("Mean Reciprocal Rank {}".format(
-            sum(average_mean_recip_rank_tail) / len(average_mean_recip_rank_tail)))
-
-        cumulative_hits_100 = (sum(average_hits_at_100_head) / len(average_hits_at_100_head)
-                               + sum(average_hits_at_100_tail) / len(average_hits_at_100_tail)) / 2
-        cumulative_hits_ten = (sum(average_hits_at_ten_head) / len(average_hits_at_ten_head)
-                               + sum(average_hits_at_ten_tail) / len(average_hits_at_ten_tail)) / 2
-        cumulative_hits_three = (sum(average_hits_at_three_head) / len(average_hits_at_three_head)
-                                 + sum(average_hits_at_three_tail) / len(average_hits_at_three_tail)) / 2
-        cumulative_hits_one = (sum(average_hits_at_one_head) / len(average_hits_at_one_head)
-                               + sum(average_hits_at_one_tail) / len(average_hits_at_one_tail)) / 2
-        cumulative_mean_rank = (sum(average_mean_rank_head) / len(average_mean_rank_head)
-                                + sum(average_mean_rank_tail) / len(average_mean_rank_tail)) / 2
-        cumulative_mean_recip_rank = (sum(average_mean_recip_rank_head) / len(average_mean_recip_rank_head) + sum(
-            average_mean_recip_rank_tail) / len(average_mean_recip_rank_tail)) / 2
-
+                new_x_batch = new_x_batch[~self.is_valid(new_x_batch)]
+                if len(new_x_batch) == 0:
+                    continue
+                scores, _ = model(torch.LongTensor(new_x_batch).to(device))
+                num_greater += int((scores.view(-1) > true_score).sum())
+            ranks.append(num_greater + 1)
+        return ranks[0], ranks[1]
+
+    def report_ranks(self, ranks_head, ranks_tail):
+        assert len(ranks_head) == len(ranks_tail)
+        stats = {}
+        for side, ranks in (('head', np.array(ranks_head)), ('tail', np.array(ranks_tail))):
+            stats[side] = {
+                'Hits@100': float(np.mean(ranks <= 100)),
+                'Hits@10': float(np.mean(ranks <= 10)),
+                'Hits@3': float(np.mean(ranks <= 3)),
+                'Hits@1': float(np.mean(ranks == 1)),
+                'Mean rank': float(np.mean(ranks)),
+                'Mean Reciprocal Rank': float(np.mean(1.0 / ranks)),
+            }
+
+        for side in ('head', 'tail'):
+            print("\nAveraged stats for replacing {} are -> ".format(side))
+            print("Hits@100 are {}".format(stats[side]['Hits@100']))
+            print("Hits@10 are {}".format(stats[side]['Hits@10']))
+            print("Hits@3 are {}".format(stats[side]['Hits@3']))
+            print("Hits@1 are {}".format(stats[side]['Hits@1']))
+            print("Mean rank {}".format(stats[side]['Mean rank']))
+            print("Mean Reciprocal Rank {}".format(stats[side]['Mean Reciprocal Rank']))
+
+        cumulative = {key: (stats['head'][key] + stats['tail'][key]) / 2 for key in stats['head']}
         print("\nCumulative stats are -> ")
-        print("Hits@100 are {}".format(cumulative_hits_100))
-        print("Hits@10 are {}".format(cumulative_hits_ten))
-        print("Hits@3 are {}".format(cumulative_hits_three))
-        print("Hits@1 are {}".format(cumulative_hits_one))
-        print("Mean rank {}".format(cumulative_mean_rank))
-        print("Mean Reciprocal Rank {}".format(cumulative_mean_recip_rank))
+        print("Hits@100 are {}".format(cumulative['Hits@100']))
+        print("Hits@10 are {}".format(cumulative['Hits@10']))
+        print("Hits@3 are {}".format(cumulative['Hits@3']))
+        print("Hits@1 are {}".format(cumulative['Hits@1']))
+        print("Mean rank {}".format(cumulative['Mean rank']))
+        print("Mean Reciprocal Rank {}".format(cumulative['Mean Reciprocal Rank']))
 
-        return cumulative_mean_recip_rank, cumulative_mean_rank, cumulative_hits_one, cumulative_hits_three, cumulative_hits_ten
+        return cumulative['Mean Reciprocal Rank'], cumulative['Mean rank'], cumulative['Hits@1'], \
+            cumulative['Hits@3'], cumulative['Hits@10']
 
     def get_validation_pred2(self, args, model):
 
         start_time = time.time()
 
-        indices = [i for i in range(len(self.link_indices))]
-
-        batch_triples = self.link_indices[indices, :]  # (64705, 3)
-
         print("link set length : ", len(self.link_indices))
 
-        entity_list = [j for i, j in self.entity2id.items()]
-
-        sort_list = []
-
-        for i in range(batch_triples.shape[0]):
-            start_time_it = time.time()
-            # batch_triples [[38814     6    -1],..]
-            # 扩展当前要预测的三元组(74085, 3)
-            new_x_batch_head = np.tile(
-                batch_triples[i, :], (len(self.entity2id), 1))
-
-            if new_x_batch_head[0][0] == -1:
-                new_x_batch_head[:, 0] = entity_list
-            elif new_x_batch_head[0][2] == -1:
-                new_x_batch_head[:, 2] = entity_list
-
-            # 删除训练集中已有的三元组
-            # last_index_head = []  # array of already existing triples
-            #
-            # for tmp_index in range(len(new_x_batch_head)):
-            #     temp_triple_head = (new_x_batch_head[tmp_index][0], new_x_batch_head[tmp_index][1],
-            #                         new_x_batch_head[tmp_index][2])
-            #     if temp_triple_head in self.valid_triples_dict.keys():
-            #         last_index_head.append(tmp_index)
-            #
-            # new_x_batch_head = np.delete(
-            #     new_x_batch_head, last_index_head, axis=0)
+        # 相同的 (实体, 关系, 方向) 只打分一次，再按输入顺序展开
+        queries, inverse = np.unique(np.asarray(self.link_indices).reshape(-1, 3), axis=0, return_inverse=True)
+        results = [None] * len(queries)
+        if self.link_cache is not None:
+            results = [self.link_cache.get(query) for query in queries]
+        todo = [i for i, result in enumerate(results) if result is None]
+        print("distinct queries : {}, to score : {}".format(len(queries), len(todo)))
 
-            # head part here
-            scores_head, _ = model.test(new_x_batch_head)
-
-            sorted_scores_head, sorted_indices_head = torch.sort(
-                scores_head.view(-1), dim=-1, descending=True)
-
-            sorted_indices = sorted_indices_head[:10].cpu().numpy()
-
-            sort_list.append(sorted_indices)
-            print("it:{},time:{}".format(i, time.time() - start_time_it))
+        if getattr(args, 'eval_workers', 0) > 1:
+            scored = run_parallel(self, args, model, _link_shard, queries[todo], args.eval_workers)
+        else:
+            scored = []
+            for i in todo:
+                start_time_it = time.time()
+                scored.append(self.link_topk(args, model, queries[i]))
+                print("it:{},time:{}".format(i, time.time() - start_time_it))
+        for i, result in zip(todo, scored):
+            results[i] = result
+            if self.link_cache is not None:
+                self.link_cache.put(queries[i], result)
+        if self.link_cache is not None and todo:
+            self.link_cache.save()
 
         print("链接预测总共用的时间:{}".format(time.time() - start_time))
 
-        return sort_list
+        return [results[i] for i in inverse.reshape(-1)]
+
+    def link_topk(self, args, model, triple, topk=10, answer=None):
+        """
+        (h, r, -1) 或 (-1, r, t)：分块打分，只保留当前的前topk个实体id
+        answer : 给定时去掉其它已知的三元组(过滤设定，answer本身保留)，级联评估的第一阶段用
+        """
+        chunk_size = eval_chunk_size(args, model)
+        device = model_device(model)
+        column = 0 if triple[0] == -1 else 2
+        entities = self.candidates(triple[1], column // 2)
+        if len(entities) < topk:
+            entities = self.entity_list
+
+        best_scores = torch.empty(0, device=device)
+        best_ids = torch.empty(0, dtype=torch.long, device=device)
+        for start in range(0, len(entities), chunk_size):
+            ids = entities[start:start + chunk_size]
+            if answer is not None:
+                known = np.tile(triple, (len(ids), 1))
+                known[:, column] = ids
+                ids = ids[~self.is_valid(known) | (ids == answer)]
+                if len(ids) == 0:
+                    continue
+            candidates = torch.from_numpy(ids).to(device)
+            new_x_batch = torch.LongTensor(triple.reshape(1, 3)).to(device).repeat(len(candidates), 1)
+            new_x_batch[:, column] = candidates
+            # TransE / DisenE_Trans 用 test 打分，ConvKB / DisenE 直接调用模块
+            scores, _ = getattr(model, 'test', model)(new_x_batch)
+
+            best_scores = torch.cat([best_scores, scores.view(-1)])
+            best_ids = torch.cat([best_ids, candidates])
+            if len(best_scores) > topk:
+                best_scores, keep = torch.topk(best_scores, topk)
+                best_ids = best_ids[keep]
+
+        order = torch.argsort(best_scores, descending=True)
+        return best_ids[order].cpu().numpy()
+
+
+def train_fingerprint(train_indices):
+    return hashlib.sha1(np.ascontiguousarray(train_indices, dtype=np.int32).tobytes()).hexdigest()
+
+
+class NegativeShards:
+    def __init__(self, folder, train_indices, batch_size, ratio, num_entities):
+        """
+        neg_shards.py 生成的批次
+        train_indices : 按数据文件顺序的训练三元组(与生成时相同)
+        num_entities : 当前词表的实体数，负样本的实体id必须在这个范围内
+        """
+        with open(os.path.join(folder, 'meta.json')) as f:
+            self.meta = json.load(f)
+        expected = {'batch_size': batch_size, 'valid_invalid_ratio': ratio, 'num_train': len(train_indices),
+                    'num_entities': num_entities, 'train_sha1': train_fingerprint(train_indices)}
+        for key, value in expected.items():
+            if self.meta.get(key) != value:
+                raise ValueError("negative shards in {} were generated with {}={}, not {}".format(
+                    folder, key, self.meta.get(key), value))
+        self.folder = folder
+        self.train = np.array(train_indices, dtype=np.int32)
+        self.batch_size = batch_size
+        self.half = ratio // 2
+        self.ratio = ratio
+        self.train_indices = None
+        self.negatives = None
+
+    def start_epoch(self, epoch):
+        """返回这个epoch的正样本顺序；超过生成的epoch数时循环使用"""
+        epoch = epoch % self.meta['epochs']
+        order = np.load(os.path.join(self.folder, 'order_{:04d}.npy'.format(epoch)), mmap_mode='r')
+        self.negatives = np.load(os.path.join(self.folder, 'negatives_{:04d}.npy'.format(epoch)), mmap_mode='r')
+        # 文件被截断或来自别的生成时，get_batch 会静默地取到错位的负样本
+        if order.shape != (len(self.train),) or self.negatives.shape != (len(self.train) * 2 * self.half,):
+            raise ValueError("negative shard {} in {} has {} positives and {} negatives, expected {} and {}".format(
+                epoch, self.folder, len(order), len(self.negatives), len(self.train),
+                len(self.train) * 2 * self.half))
+        self.train_indices = self.train[order]
+        return self.train_indices
+
+    def get_batch(self, iter_num):
+        """与 Corpus.get_iteration_batch 相同的 (batch_triples, batch_labels)"""
+        start = iter_num * self.batch_size
+        positives = self.train_indices[start:start + self.batch_size]
+        tmp_size = len(positives)
+        batch_triples = np.empty((tmp_size * (self.ratio + 1), 3), dtype=np.int32)
+        batch_labels = np.ones((tmp_size * (self.ratio + 1), 1), dtype=np.float32)
+        batch_triples[:tmp_size] = positives
+        if self.ratio > 0:
+            batch_triples[tmp_size:] = np.tile(positives, (self.ratio, 1))
+            entities = self.negatives[start * 2 * self.half:(start + tmp_size) * 2 * self.half]
+            num_half = tmp_size * self.half
+            batch_triples[tmp_size:tmp_size + num_half, 0] = entities[:num_half]
+            batch_triples[tmp_size + num_half:tmp_size + 2 * num_half, 2] = entities[num_half:]
+            batch_labels[tmp_size:tmp_size + 2 * num_half] = -1
+        return batch_triples, batch_labels
+
+
+def _sorted_contains(array, value):
+    pos = np.searchsorted(array, value)
+    return pos < len(array) and array[pos] == value
+
+
+def _grow_vocab(name2id, names):
+    ids = []
+    for name in names:
+        if name not in name2id:
+            name2id[name] = len(name2id)
+        ids.append(name2id[name])
+    return np.array(ids, dtype=np.int64)
+
+
+def eval_chunk_size(args, model):
+    """
+    根据内存预算(--eval_memory_mb，每个评估进程)和模型的中间张量大小，计算每次送入模型的候选三元组个数
+    """
+    model_name = getattr(args, 'model_name', None) or type(getattr(model, '__self__', model)).__name__
+    K = getattr(args, 'k_factors', 1)
+    D = getattr(args, 'embedding_size', 100)
+    C = getattr(args, 'out_channels', 50)
+
+    # 每个候选三元组需要的float个数(gather、cat、卷积输出等中间结果)
+    if model_name == 'TransE':
+        floats = 5 * D
+    elif model_name == 'DisenE_Trans':
+        floats = 8 * K * D + 2 * K
+    elif model_name == 'ConvKB':
+        floats = 9 * D + 2 * C * D
+    elif model_name == 'DisenE':
+        floats = 8 * K * D + 3 * C * K * D + 2 * K
+    else:
+        floats = 8 * K * D + 3 * C * K * D
+    # float32，外加索引/过滤用的int64数组
+    bytes_per_triple = 4 * floats + 64
+
+    budget = getattr(args, 'eval_memory_mb', 1024) * 2 ** 20
+    return max(1, int(budget // bytes_per_triple))
+
+
+def model_device(model):
+    # model 可能是 nn.Module、model.test 这样的绑定方法，或 inference.ScriptedScorer
+    owner = getattr(model, '__self__', model)
+    if isinstance(owner, torch.nn.Module):
+        return next(owner.parameters()).device
+    return getattr(owner, 'device', torch.device('cpu'))
+
+
+# 多进程评估：fork出的子进程直接继承这里的状态，模型参数和过滤用的键放在共享内存中
+_eval_state = {}
+
+
+def _init_eval_worker(num_threads):
+    torch.set_num_threads(num_threads)
+
+
+def _rank_shard(shard):
+    corpus, args, model, triples = [_eval_state[key] for key in ('corpus', 'args', 'model', 'triples')]
+    with torch.no_grad():
+        return [corpus.rank_triple(args, model, triples[i]) for i in shard]
+
+
+def _link_shard(shard):
+    corpus, args, model, triples = [_eval_state[key] for key in ('corpus', 'args', 'model', 'triples')]
+    with torch.no_grad():
+        return [corpus.link_topk(args, model, triples[i]) for i in shard]
+
+
+def _shared(array):
+    return torch.from_numpy(np.ascontiguousarray(array)).share_memory_().numpy()
+
+
+def run_parallel(corpus, args, model, shard_fn, triples, num_workers):
+    """把三元组切成若干片分给进程池，按输入顺序合并结果"""
+    owner = getattr(model, '__self__', model)
+    if model_device(model).type != 'cpu':
+        raise ValueError("parallel evaluation runs on CPU, move the model to CPU first")
+    # ScriptedScorer 的参数在 .module 里
+    module = getattr(owner, 'module', owner)
+    # ConvKB/DisenE 每次前向都会重新归一化整张实体表(每个子进程会各自分配一份新表)，
+    # 这里在父进程中归一化一次，子进程中关掉(与 EntityStore.attach 相同)；用 .test 打分的模型不归一化
+    do_normalize = 0
+    if model is module and not hasattr(module, 'test'):
+        do_normalize = getattr(module, 'do_normalize', 0)
+    if do_normalize:
+        module.entity_embeddings.data = F.normalize(module.entity_embeddings.data, p=2, dim=1)
+        module.do_normalize = 0
+    if isinstance(module, torch.nn.Module):
+        module.share_memory()
+    for name in ('valid_keys', 'entity_list'):
+        # 换成共享内存中的数组，子进程不会各自复制一份
+        setattr(corpus, name, _shared(getattr(corpus, name)))
+    triples = _shared(triples)
+    num_items = len(triples)
+
+    num_threads = max(1, multiprocessing.cpu_count() // num_workers)
+    shard_size = max(1, int(math.ceil(num_items / (num_workers * 4))))
+    shards = [range(start, min(start + shard_size, num_items)) for start in range(0, num_items, shard_size)]
+
+    _eval_state.update(corpus=corpus, args=args, model=model, triples=triples)
+    try:
+        with multiprocessing.get_context('fork').Pool(num_workers, _init_eval_worker, (num_threads,)) as pool:
+            results = pool.map(shard_fn, shards, chunksize=1)
+    finally:
+        _eval_state.clear()
+        if do_normalize:
+            module.do_normalize = do_normalize
+    return [item for shard_result in results for item in shard_result]
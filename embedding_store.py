@@ -0,0 +1,218 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import numpy as np
+
+import json
+import os
+
+# 实体表及其Adam动量放在内存映射文件中，内存里只缓存访问频繁的行(LRU或LFU淘汰)，被淘汰的脏行写回文件
+# 训练时每个批次把用到的行换成模型的局部 entity_embeddings，更新后再写回缓存
+# python -u run.py --dataset=FB15k-237 --model_name=DisenE_Trans --entity_store=./results/FB15k-237/entity_store --cache_rows=200000
+
+STORE_FILES = ('entity.npy', 'exp_avg.npy', 'exp_avg_sq.npy')
+
+
+@torch.no_grad()
+def adam_update(param, exp_avg, exp_avg_sq, step, lr, weight_decay, betas=(0.9, 0.999), eps=1e-8):
+    """与 torch.optim.Adam 相同的更新，动量由调用方保存(分区或缓存)，换入换出时不用重建优化器"""
+    grad = param.grad
+    if grad is None:
+        return
+    if weight_decay != 0:
+        grad = grad.add(param, alpha=weight_decay)
+    exp_avg.mul_(betas[0]).add_(grad, alpha=1 - betas[0])
+    exp_avg_sq.mul_(betas[1]).addcmul_(grad, grad, value=1 - betas[1])
+    bias_correction1 = 1 - betas[0] ** step
+    bias_correction2 = 1 - betas[1] ** step
+    denom = (exp_avg_sq / bias_correction2).sqrt_().add_(eps)
+    param.addcdiv_(exp_avg, denom, value=-lr / bias_correction1)
+
+
+class EntityStore:
+    def __init__(self, folder, cache_rows=100000, policy='lru', device='cpu'):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError("cache policy must be lru or lfu, got {}".format(policy))
+        with open(os.path.join(folder, 'meta.json')) as f:
+            meta = json.load(f)
+        self.folder = folder
+        self.step_count = meta['step']
+        self.table, self.exp_avg, self.exp_avg_sq = [
+            np.load(os.path.join(folder, name), mmap_mode='r+') for name in STORE_FILES]
+        self.num_rows, self.dim = self.table.shape
+        self.policy = policy
+        self.device = torch.device(device)
+
+        self.cache_rows = min(cache_rows, self.num_rows)
+        # 每个缓存槽保存 [嵌入, 一阶动量, 二阶动量]
+        self.cache = torch.zeros(3, self.cache_rows, self.dim, device=self.device)
+        self.slot_of = np.full(self.num_rows, -1, dtype=np.int64)
+        self.row_of_slot = np.full(self.cache_rows, -1, dtype=np.int64)
+        self.dirty = np.zeros(self.cache_rows, dtype=bool)
+        self.last_used = np.zeros(self.cache_rows, dtype=np.int64)
+        self.counts = np.zeros(self.num_rows, dtype=np.int64)
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+        self._slots = None
+
+    @staticmethod
+    def exists(folder):
+        return os.path.exists(os.path.join(folder, 'meta.json'))
+
+    @staticmethod
+    def create(folder, num_rows, dim, make_rows, chunk_rows=65536):
+        """make_rows(start, end) 返回这些实体的初始嵌入，按块写入，不需要整张表放进内存"""
+        os.makedirs(folder, exist_ok=True)
+        files = [np.lib.format.open_memmap(os.path.join(folder, name), mode='w+', dtype=np.float32,
+                                           shape=(num_rows, dim)) for name in STORE_FILES]
+        for start in range(0, num_rows, chunk_rows):
+            end = min(start + chunk_rows, num_rows)
+            files[0][start:end] = make_rows(start, end)
+        for f in files:
+            f.flush()
+        with open(os.path.join(folder, 'meta.json'), 'w') as f:
+            json.dump({'num_rows': num_rows, 'dim': dim, 'step': 0}, f)
+
+    def fetch(self, ids):
+        """把ids用到的行读入缓存，返回 (每个不同id所在的缓存槽, ids在不同id中的位置)"""
+        unique, inverse = np.unique(ids, return_inverse=True)
+        if len(unique) > self.cache_rows:
+            raise ValueError("a batch uses {} entities but --cache_rows is {}".format(len(unique), self.cache_rows))
+        self.clock += 1
+        slots = self.slot_of[unique]
+        miss = slots < 0
+        num_miss = int(miss.sum())
+        self.hits += len(unique) - num_miss
+        self.misses += num_miss
+
+        if num_miss:
+            # 空槽优先，其次淘汰最久未用(lru)或访问次数最少(lfu)的行，本批次命中的行不能淘汰
+            if self.policy == 'lru':
+                priority = self.last_used.astype(np.float64)
+            else:
+                priority = self.counts[np.maximum(self.row_of_slot, 0)].astype(np.float64)
+            priority[self.row_of_slot < 0] = -1
+            priority[slots[~miss]] = np.inf
+            chosen = np.argpartition(priority, num_miss - 1)[:num_miss]
+            self._write_back(chosen)
+
+            evicted = self.row_of_slot[chosen]
+            self.slot_of[evicted[evicted >= 0]] = -1
+            rows = unique[miss]  # np.unique 已排序，按顺序读文件
+            loaded = np.stack([self.table[rows], self.exp_avg[rows], self.exp_avg_sq[rows]])
+            self.cache[:, torch.from_numpy(chosen).to(self.device)] = torch.from_numpy(loaded).to(self.device)
+            self.slot_of[rows] = chosen
+            self.row_of_slot[chosen] = rows
+            self.dirty[chosen] = False
+            slots[miss] = chosen
+
+        self.last_used[slots] = self.clock
+        self.counts[unique] += 1
+        return slots, inverse
+
+    def _write_back(self, slots):
+        slots = slots[self.dirty[slots] & (self.row_of_slot[slots] >= 0)]
+        if len(slots) == 0:
+            return
+        rows = self.row_of_slot[slots]
+        values = self.cache[:, torch.from_numpy(slots).to(self.device)].cpu().numpy()
+        self.table[rows], self.exp_avg[rows], self.exp_avg_sq[rows] = values
+        self.dirty[slots] = False
+
+    def swap_in(self, model, *id_arrays):
+        """
+        把批次中用到的实体行换成 model.entity_embeddings(局部参数)，
+        返回把全局实体id换成局部行号之后的数组；三元组只替换第0和第2列
+        """
+        arrays = [np.asarray(a) for a in id_arrays]
+        parts = [a[:, [0, 2]] if a.ndim == 2 else a for a in arrays]
+        slots, inverse = self.fetch(np.concatenate([p.reshape(-1) for p in parts]))
+        self._slots = torch.from_numpy(slots).to(self.device)
+        model.entity_embeddings = nn.Parameter(self.cache[0, self._slots].clone())
+
+        remapped, offset = [], 0
+        for a, p in zip(arrays, parts):
+            local = inverse[offset:offset + p.size].reshape(p.shape)
+            offset += p.size
+            if a.ndim == 2:
+                out = a.astype(np.int64)
+                out[:, [0, 2]] = local
+                remapped.append(out)
+            else:
+                remapped.append(local)
+        return remapped
+
+    def step(self, model, lr, weight_decay):
+        """对本批次用到的行做Adam更新(只更新出现的行，类似SparseAdam)，结果写回缓存"""
+        self.step_count += 1
+        param = model.entity_embeddings
+        exp_avg = self.cache[1, self._slots]
+        exp_avg_sq = self.cache[2, self._slots]
+        adam_update(param, exp_avg, exp_avg_sq, self.step_count, lr, weight_decay)
+        self.cache[0, self._slots] = param.data
+        self.cache[1, self._slots] = exp_avg
+        self.cache[2, self._slots] = exp_avg_sq
+        self.dirty[self._slots.cpu().numpy()] = True
+
+    def flush(self):
+        self._write_back(np.nonzero(self.dirty)[0])
+        for f in (self.table, self.exp_avg, self.exp_avg_sq):
+            f.flush()
+        with open(os.path.join(self.folder, 'meta.json'), 'w') as f:
+            json.dump({'num_rows': self.num_rows, 'dim': self.dim, 'step': self.step_count}, f)
+
+    def attach(self, model, normalize=False):
+        """
+        评估用：把内存映射的整张表包成 MappedEntityTable 作为 model.entity_embeddings(不复制进内存，也不搬到GPU)
+        normalize : ConvKB/DisenE 打分前会归一化整张表，这里改为读出行时归一化，并关掉模型里的归一化；文件不变
+        """
+        self.flush()
+        device = next(model.parameters()).device
+        # 参数不能直接换成子模块，先删掉占位参数
+        del model.entity_embeddings
+        model.entity_embeddings = MappedEntityTable(self.table, normalize, device)
+        if normalize:
+            model.do_normalize = 0
+
+
+class MappedEntityTable(nn.Module):
+    '''
+    内存映射的实体表：整张表留在CPU上的文件中，用 table[idx, :] 取行时只把这些行读出来再搬到模型所在的设备
+    normalize : 对读出的行做L2归一化(代替 do_normalize 对整张表的原地归一化)
+    '''
+
+    def __init__(self, table, normalize=False, device='cpu'):
+        super(MappedEntityTable, self).__init__()
+        self.table = table
+        self.normalize = normalize
+        # 空的占位张量，随 model.cuda() / model.cpu() 移动，记录取出的行要放到哪个设备
+        self.register_buffer('anchor', torch.empty(0, device=device), persistent=False)
+
+    @property
+    def shape(self):
+        return torch.Size(self.table.shape)
+
+    @property
+    def device(self):
+        return self.anchor.device
+
+    def forward(self, idx):
+        idx = torch.as_tensor(idx).cpu().numpy()
+        rows = torch.from_numpy(np.asarray(self.table[idx])).to(self.device)
+        if self.normalize:
+            rows = F.normalize(rows, p=2, dim=1)
+        return rows
+
+    def __getitem__(self, key):
+        # 与参数表相同的 table[idx, :] / table[idx] 写法
+        if isinstance(key, tuple):
+            key = key[0]
+        return self(key)
+
+    def full(self, chunk_rows=65536):
+        """读出完整的 [E, dim] 表(导出/量化用)"""
+        num_rows = self.table.shape[0]
+        with torch.no_grad():
+            return torch.cat([self(torch.arange(start, min(start + chunk_rows, num_rows)))
+                              for start in range(0, num_rows, chunk_rows)])
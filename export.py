@@ -0,0 +1,76 @@
+import torch
+import numpy as np
+
+import argparse
+import json
+import os
+
+from vocab import Vocab
+
+# python export.py --load=./results/FB15k-237/model/trained_best.pth --model_name=DisenE_Trans --dataset=FB15k-237 --dtype=float16
+
+EXPORT_MODELS = ('TransE', 'DisenE_Trans')
+
+
+def export_model(state_dict, model_name, entity_vocab, relation_vocab, export_dir, dtype='float32'):
+    if model_name not in EXPORT_MODELS:
+        raise ValueError("export only supports {}, got {}".format(EXPORT_MODELS, model_name))
+    if 'entity_embeddings' not in state_dict:
+        raise ValueError("checkpoint has a factored entity table (--factored_rank), use --export_scripted instead")
+    os.makedirs(export_dir, exist_ok=True)
+
+    entity_emb = state_dict['entity_embeddings'].detach().cpu().numpy()
+    relation_emb = state_dict['relation_embeddings'].detach().cpu().numpy()
+    emb_s = relation_emb.shape[1]
+
+    # 实体/关系表可以用float16存储，fc1这种小的稠密权重始终保留float32
+    np.save(os.path.join(export_dir, 'entity.npy'), entity_emb.astype(dtype))
+    np.save(os.path.join(export_dir, 'relation.npy'), relation_emb.astype(dtype))
+
+    meta = {
+        'model_name': model_name,
+        'dtype': dtype,
+        'num_entities': int(entity_emb.shape[0]),
+        'num_relations': int(relation_emb.shape[0]),
+        'emb_s': int(emb_s),
+        'k_factors': int(entity_emb.shape[1] // emb_s),
+    }
+    if model_name == 'DisenE_Trans':
+        np.save(os.path.join(export_dir, 'fc1_weight.npy'),
+                state_dict['fc1.weight'].detach().cpu().numpy().astype(np.float32).reshape(-1))
+        np.save(os.path.join(export_dir, 'fc1_bias.npy'),
+                state_dict['fc1.bias'].detach().cpu().numpy().astype(np.float32).reshape(-1))
+
+    entity_vocab.save(os.path.join(export_dir, 'entity_vocab'))
+    relation_vocab.save(os.path.join(export_dir, 'relation_vocab'))
+
+    with open(os.path.join(export_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="./data/")
+    parser.add_argument("--dataset", default="Medical")
+    parser.add_argument("--model_name", default="DisenE_Trans")
+    parser.add_argument("--load", required=True, help="checkpoint saved by run.py")
+    parser.add_argument("--export_dir", default="None", help="defaults to ./export/<dataset>/<model_name>")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    args = parser.parse_args()
+
+    data_dir = os.path.join(args.data_dir, args.dataset)
+    export_dir = args.export_dir
+    if export_dir == 'None':
+        export_dir = os.path.join("./export", args.dataset, args.model_name)
+
+    entity_vocab = Vocab.from_file(os.path.join(data_dir, 'entity2id.txt'))
+    relation_vocab = Vocab.from_file(os.path.join(data_dir, 'relation2id.txt'))
+    state_dict = torch.load(args.load, map_location='cpu')
+
+    meta = export_model(state_dict, args.model_name, entity_vocab, relation_vocab, export_dir, args.dtype)
+    print("exported {} to {}: {}".format(args.model_name, export_dir, meta))
+
+
+if __name__ == '__main__':
+    main()
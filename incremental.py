@@ -0,0 +1,228 @@
+import torch
+import numpy as np
+
+import argparse
+import os
+import random
+
+import run
+from dataloader import Corpus
+from process_data import build_data, load_entity, load_relation, load_vectors, tile_vectors
+
+# 增量训练：在已有模型上加入新到的三元组(可以包含新实体/新关系)，扩展嵌入表后，用新三元组加上回放的旧三元组微调几个epoch
+# python -u incremental.py --delta_dir=./data/FB15k-237/delta_20201020 --load=./results/FB15k-237/model/trained_final.pth --dataset=FB15k-237 --model_name=DisenE --k_factors=6 --embedding_size=200 --epochs=5
+#
+# delta_dir/train.txt 与 train.txt 格式相同；如果 delta_dir 中有 entity2id.txt + entity2vec.txt(关系同理)，其中列出的新实体用预训练向量初始化
+# 更新后的 entity2id.txt / relation2id.txt 和累计的训练三元组 train.npy 与模型一起写到 <output_dir>/<dataset>/incremental/
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--delta_dir", required=True, help="folder with the new train.txt")
+parser.add_argument("--replay_ratio", type=float, default=1.0, help="old triples replayed per new triple")
+parser.add_argument("--vocab_dir", default="None",
+                    help="entity2id.txt / relation2id.txt (and train.npy) matching --load, "
+                         "defaults to the dataset folder")
+
+
+def read_names(filename):
+    with open(filename) as f:
+        return [tuple(line.strip().split()[:3]) for line in f if line.strip()]
+
+
+def load_new_vectors(folder, name, mapping, new_ids, emb_size, k=1):
+    """delta_dir 中 <name>2id.txt + <name>2vec.txt 给出的新实体/关系的预训练向量，返回 {新id: 向量}"""
+    id_file, vec_file = os.path.join(folder, name + '2id.txt'), os.path.join(folder, name + '2vec.txt')
+    if not (os.path.exists(id_file) and os.path.exists(vec_file)):
+        return {}
+    loader = load_entity if name == 'entity' else load_relation
+    line_of = loader(id_file)
+    vectors = tile_vectors(load_vectors(vec_file), emb_size, k)
+    new_ids = set(int(i) for i in new_ids)
+    return {mapping[key]: vectors[line] for key, line in line_of.items() if key in mapping and mapping[key] in new_ids}
+
+
+def grow_embeddings(entity_emb, relation_emb, delta, num_entities, num_relations,
+                    entity_vectors=None, relation_vectors=None, rounds=3):
+    """
+    把实体/关系表扩展到 num_entities / num_relations 行，新行的初始化顺序：
+    1. entity_vectors / relation_vectors 中给出的预训练向量
+    2. 新关系：新三元组中两端都已知时 t - h 的均值(对K个因子取平均)
+    3. 新实体：由已知的邻居按平移推算(h ≈ t - r, t ≈ h + r)取均值，重复几轮以覆盖由新实体连起来的链
+    4. 剩下的按已有行的标准差随机初始化
+    """
+    num_old_entities, ent_dim = entity_emb.shape
+    num_old_relations, emb_s = relation_emb.shape
+    K = ent_dim // emb_s
+
+    ent = np.zeros((num_entities, ent_dim), dtype=np.float32)
+    ent[:num_old_entities] = entity_emb
+    rel = np.zeros((num_relations, emb_s), dtype=np.float32)
+    rel[:num_old_relations] = relation_emb
+    known_ent = np.arange(num_entities) < num_old_entities
+    known_rel = np.arange(num_relations) < num_old_relations
+    for table, known, vectors in ((ent, known_ent, entity_vectors), (rel, known_rel, relation_vectors)):
+        for idx, vector in (vectors or {}).items():
+            table[idx] = vector
+            known[idx] = True
+
+    heads, relations, tails = [np.asarray(col, dtype=np.int64) for col in delta.T]
+
+    sel = ~known_rel[relations] & known_ent[heads] & known_ent[tails]
+    if sel.any():
+        diff = (ent[tails[sel]] - ent[heads[sel]]).reshape(-1, K, emb_s).mean(1)
+        _average_into(rel, known_rel, relations[sel], diff)
+
+    for _ in range(rounds):
+        # 头实体是新的：h ≈ t - r；尾实体是新的：t ≈ h + r
+        new_head = ~known_ent[heads] & known_ent[tails] & known_rel[relations]
+        new_tail = known_ent[heads] & ~known_ent[tails] & known_rel[relations]
+        if not (new_head.any() or new_tail.any()):
+            break
+        targets = np.concatenate([heads[new_head], tails[new_tail]])
+        estimates = np.concatenate([
+            ent[tails[new_head]] - np.tile(rel[relations[new_head]], (1, K)),
+            ent[heads[new_tail]] + np.tile(rel[relations[new_tail]], (1, K))])
+        _average_into(ent, known_ent, targets, estimates)
+
+    for table, known, num_old in ((ent, known_ent, num_old_entities), (rel, known_rel, num_old_relations)):
+        missing = np.nonzero(~known)[0]
+        if len(missing):
+            std = table[:num_old].std() if num_old else 1.0
+            table[missing] = np.random.randn(len(missing), table.shape[1]) * std
+    return torch.from_numpy(ent), torch.from_numpy(rel), int((~known_ent).sum())
+
+
+def _average_into(table, known, targets, values):
+    sums = np.zeros((len(table), table.shape[1]), dtype=np.float64)
+    np.add.at(sums, targets, values)
+    counts = np.bincount(targets, minlength=len(table))
+    fill = (counts > 0) & ~known
+    table[fill] = sums[fill] / counts[fill, None]
+    known[fill] = True
+
+
+def factored_rows(state_dict):
+    """--factored_rank 训练的检查点：组合出完整的 [E, K * D] 实体表(未归一化)"""
+    base, coef, basis = [state_dict['entity_embeddings.' + name] for name in ('base', 'coef', 'basis')]
+    return base.repeat(1, basis.size(1) // base.size(1)) + torch.matmul(coef, basis)
+
+
+def factor_new_rows(state_dict, entity_emb):
+    """
+    扩展后的实体表中新增的行分解回 base + coef @ basis：base 取K个因子的均值，coef 是残差在 basis 上的最小二乘解，
+    旧实体的参数和 basis 保持不变
+    """
+    base, coef, basis = [state_dict['entity_embeddings.' + name] for name in ('base', 'coef', 'basis')]
+    K = basis.size(1) // base.size(1)
+    new_rows = entity_emb[len(base):]
+    new_base = new_rows.view(len(new_rows), K, -1).mean(1)
+    new_coef = torch.matmul(new_rows - new_base.repeat(1, K), torch.linalg.pinv(basis))
+    state_dict['entity_embeddings.base'] = torch.cat([base, new_base])
+    state_dict['entity_embeddings.coef'] = torch.cat([coef, new_coef])
+
+
+def write_vocab(filename, name2id):
+    with open(filename, 'w') as f:
+        f.write("{}\n".format(len(name2id)))
+        for name, idx in sorted(name2id.items(), key=lambda item: item[1]):
+            f.write("{}\t{}\n".format(name, idx))
+
+
+def main():
+    inc_args, run_argv = parser.parse_known_args()
+    args = run.parser.parse_args(run_argv)
+    if args.load == 'None':
+        raise ValueError("--load is required: the checkpoint to update")
+    args.data_dir = os.path.join(args.data_dir, args.dataset)
+    model_path = os.path.join(args.output_dir, args.dataset, "incremental")
+    os.makedirs(model_path, exist_ok=True)
+
+    CUDA = torch.cuda.is_available()
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    print("args = ", args, inc_args)
+
+    state_dict = torch.load(args.load, map_location='cpu')
+    factored = 'entity_embeddings.base' in state_dict
+    if not factored and 'entity_embeddings' not in state_dict:
+        raise ValueError("{} has no entity table (trained with --entity_store?); incremental updates need a "
+                         "checkpoint with the full or factored (--factored_rank) table".format(args.load))
+    if factored:
+        # 秩由检查点决定
+        args.factored_rank = state_dict['entity_embeddings.coef'].size(1)
+
+    train_data, validation_data, test_data, link_data, entity2id, relation2id = build_data(
+        args.data_dir, streaming=args.stream_data, num_workers=args.load_workers)
+    # 新实体/关系要加入词表，这里总是用字典(--stream_data 时 build_data 返回的是只读的 vocab.Vocab)
+    # --vocab_dir 是上一次增量更新后的词表，已经包含了之前加入的实体/关系
+    vocab_dir = inc_args.vocab_dir if inc_args.vocab_dir != 'None' else args.data_dir
+    entity2id = load_entity(os.path.join(vocab_dir, 'entity2id.txt'))
+    relation2id = load_relation(os.path.join(vocab_dir, 'relation2id.txt'))
+    if inc_args.vocab_dir != 'None':
+        # 之前的增量更新加入的三元组不在 data_dir 的 train.txt 里，用上一次保存的累计训练集(过滤和回放都要用)
+        train_file = os.path.join(vocab_dir, 'train.npy')
+        if not os.path.exists(train_file):
+            raise ValueError("{} not found: --vocab_dir must be the output folder of an earlier "
+                             "incremental update".format(train_file))
+        train_data = np.load(train_file)
+    corpus = Corpus(args, train_data, validation_data, test_data, link_data, entity2id, relation2id,
+                    args.batch_size, args.valid_invalid_ratio)
+    num_old_entities, num_old_relations = corpus.num_entities, corpus.num_relations
+    old_train = corpus.train_indices
+
+    # 新三元组：新实体/关系分配新id，就地更新过滤用的索引
+    names = read_names(os.path.join(inc_args.delta_dir, 'train.txt'))
+    heads, relations, tails = [list(col) for col in zip(*names)] if names else ([], [], [])
+    relation_ids = corpus.add_relations(relations)
+    head_ids, tail_ids = corpus.add_entities(heads), corpus.add_entities(tails)
+    delta = np.stack([head_ids, relation_ids, tail_ids], axis=1).reshape(-1, 3)
+    delta = np.unique(delta[~corpus.is_valid(delta)], axis=0)  # 已经有的三元组不再加入
+    corpus.add_triples(train=delta)
+    print("{} new triples, {} new entities, {} new relations".format(
+        len(delta), corpus.num_entities - num_old_entities, corpus.num_relations - num_old_relations))
+    if len(delta) == 0:
+        # 没有新三元组(也就没有新实体/关系)，checkpoint不用更新
+        print("nothing to update, checkpoint {} left as is".format(args.load))
+        return
+
+    entity_vectors = load_new_vectors(inc_args.delta_dir, 'entity', corpus.entity2id,
+                                      range(num_old_entities, corpus.num_entities),
+                                      args.embedding_size, args.k_factors)
+    relation_vectors = load_new_vectors(inc_args.delta_dir, 'relation', corpus.relation2id,
+                                        range(num_old_relations, corpus.num_relations), args.embedding_size)
+    old_entity_emb = factored_rows(state_dict) if factored else state_dict['entity_embeddings']
+    entity_emb, relation_emb, num_random = grow_embeddings(
+        old_entity_emb.numpy(), state_dict['relation_embeddings'].numpy(), delta,
+        corpus.num_entities, corpus.num_relations, entity_vectors, relation_vectors)
+    print("{} new entities could not be placed from neighbors and were initialised randomly".format(num_random))
+    state_dict['relation_embeddings'] = relation_emb
+    if factored:
+        factor_new_rows(state_dict, entity_emb)
+    else:
+        state_dict['entity_embeddings'] = entity_emb
+
+    model = run.build_model(args, entity_emb, relation_emb)
+    model.load_state_dict(state_dict)
+    if CUDA:
+        model.cuda()
+
+    # 微调用的训练集：新三元组 + 按比例回放的旧三元组；过滤仍然使用全部三元组
+    num_replay = min(len(old_train), int(inc_args.replay_ratio * len(delta)))
+    replay = old_train[np.random.choice(len(old_train), num_replay, replace=False)]
+    full_train = corpus.train_triples
+    corpus.train_triples = np.concatenate([delta.astype(np.int32), replay])
+    corpus.train_indices = corpus.train_triples
+    print("fine-tuning on {} new + {} replayed triples".format(len(delta), num_replay))
+    run.train(args, corpus, model, CUDA, model_path)
+    corpus.train_triples = full_train
+    corpus.train_indices = np.asarray(corpus.train_triples, dtype=np.int32).reshape(-1, 3)
+
+    write_vocab(os.path.join(model_path, 'entity2id.txt'), corpus.entity2id)
+    write_vocab(os.path.join(model_path, 'relation2id.txt'), corpus.relation2id)
+    # 累计的训练三元组(原始 + 各次加入的)，下一次以本目录为 --vocab_dir 时读入
+    np.save(os.path.join(model_path, 'train.npy'), corpus.train_indices)
+    print("updated model and vocabularies written to {}".format(model_path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import numpy as np
+
+import copy
+import os
+
+from models import FactoredEntityTable, pruned_factor_sum
+from embedding_store import MappedEntityTable
+
+# 只用于推理的打分模块：没有dropout，也没有 do_normalize 对参数的修改，可以 torch.jit.script + freeze 导出
+# 分数与 evaluate / get_validation_pred2 中使用的一致：TransE/DisenE_Trans 对应 model.test，ConvKB/DisenE 对应 model(...)
+
+
+class EntityTable(nn.Module):
+    def __init__(self, table):
+        super(EntityTable, self).__init__()
+        self.register_buffer('table', table)
+
+    def forward(self, idx):
+        return self.table[idx]
+
+
+class QuantizedEntityTable(nn.Module):
+    """int8 实体表，每行(groups=1)或每个因子(groups=K)一个缩放系数，gather之后再反量化"""
+
+    def __init__(self, table, groups=1):
+        super(QuantizedEntityTable, self).__init__()
+        self.groups = groups
+        q, scale = quantize_table(table, groups)
+        self.register_buffer('q', q)
+        self.register_buffer('scale', scale)
+
+    def forward(self, idx):
+        q = self.q[idx].view(idx.size(0), self.groups, -1).to(self.scale.dtype)
+        return (q * self.scale[idx].unsqueeze(-1)).view(idx.size(0), -1)
+
+
+def quantize_table(table, groups=1):
+    grouped = table.detach().view(table.size(0), groups, -1)
+    scale = grouped.abs().max(dim=-1)[0] / 127.0
+    scale = torch.where(scale > 0, scale, torch.ones_like(scale))
+    q = torch.round(grouped / scale.unsqueeze(-1)).clamp(-127, 127).to(torch.int8)
+    return q.view(table.size(0), -1), scale.float()
+
+
+def _entity_table(table, quantize='none', k_factors=1):
+    if quantize == 'row':
+        return QuantizedEntityTable(table, 1)
+    if quantize == 'factor':
+        return QuantizedEntityTable(table, k_factors)
+    return EntityTable(table)
+
+
+def _weights(model):
+    # FactoredEntityTable / MappedEntityTable 先组合或读出完整的表(已按需归一化)
+    if isinstance(model.entity_embeddings, (FactoredEntityTable, MappedEntityTable)):
+        return model.entity_embeddings.full()
+    return model.entity_embeddings.detach().clone()
+
+
+def _table(model):
+    # 训练时每次forward都会先归一化实体表，这里导出时做一次
+    entity = _weights(model)
+    if model.do_normalize:
+        entity = F.normalize(entity, p=2, dim=1)
+    return entity
+
+
+class TransEScorer(nn.Module):
+    def __init__(self, model, quantize='none'):
+        super(TransEScorer, self).__init__()
+        self.entities = _entity_table(_weights(model), quantize)
+        self.register_buffer('relation_embeddings', model.relation_embeddings.detach().clone())
+
+    def forward(self, batch_inputs):
+        head = self.entities(batch_inputs[:, 0])
+        rel = self.relation_embeddings[batch_inputs[:, 1]]
+        tail = self.entities(batch_inputs[:, 2])
+        return -torch.norm(head + rel - tail, p=1, dim=1)
+
+
+class DisenETransScorer(nn.Module):
+    def __init__(self, model, quantize='none'):
+        super(DisenETransScorer, self).__init__()
+        self.K = model.K
+        self.emb_s = model.emb_s
+        self.entities = _entity_table(_weights(model), quantize, self.K)
+        self.register_buffer('relation_embeddings', model.relation_embeddings.detach().clone())
+        # fc1([h, r, t]) = h.w_h + r.w_r + t.w_t + b
+        w_h, w_r, w_t = model.fc1.weight.detach().clone().view(3, self.emb_s)
+        self.register_buffer('w_h', w_h.contiguous())
+        self.register_buffer('w_r', w_r.contiguous())
+        self.register_buffer('w_t', w_t.contiguous())
+        self.register_buffer('b', model.fc1.bias.detach().clone())
+
+    def forward(self, batch_inputs):
+        head = self.entities(batch_inputs[:, 0]).view(-1, self.K, self.emb_s)
+        rel = self.relation_embeddings[batch_inputs[:, 1]]
+        tail = self.entities(batch_inputs[:, 2]).view(-1, self.K, self.emb_s)
+
+        tmp = torch.matmul(head, self.w_h) + torch.matmul(tail, self.w_t) + \
+            (torch.matmul(rel, self.w_r) + self.b).unsqueeze(1)
+        att = torch.softmax(F.relu(tmp), dim=1)
+        x = torch.sum(att.unsqueeze(-1) * (head + rel.unsqueeze(1) - tail), 1)
+        return -torch.norm(x, p=1, dim=1)
+
+
+class ConvKBScorer(nn.Module):
+    def __init__(self, model, quantize='none'):
+        super(ConvKBScorer, self).__init__()
+        self.entities = _entity_table(_table(model), quantize)
+        self.register_buffer('relation_embeddings', model.relation_embeddings.detach().clone())
+        self.conv_layer = copy.deepcopy(model.conv_layer)
+        self.fc_layer = copy.deepcopy(model.fc_layer)
+
+    def forward(self, batch_inputs):
+        conv_input = torch.stack([self.entities(batch_inputs[:, 0]),
+                                  self.relation_embeddings[batch_inputs[:, 1]],
+                                  self.entities(batch_inputs[:, 2])], dim=2).unsqueeze(1)
+        out_conv = F.relu(self.conv_layer(conv_input))
+        return self.fc_layer(out_conv.reshape(conv_input.size(0), -1)).view(-1)
+
+
+class DisenEScorer(nn.Module):
+    def __init__(self, model, quantize='none'):
+        super(DisenEScorer, self).__init__()
+        self.K = model.K
+        self.emb_s = model.emb_s
+        self.entities = _entity_table(_table(model), quantize, self.K)
+        self.register_buffer('relation_embeddings', model.relation_embeddings.detach().clone())
+        self.fc1 = copy.deepcopy(model.fc1)
+        self.conv_layer = copy.deepcopy(model.conv_layer)
+        self.fc3 = copy.deepcopy(model.fc3)
+        # 与 DisenE.pruned_scores 相同的因子剪枝，导出时固定下来
+        self.prune_factors = int(model.prune_factors)
+        self.prune_mass = float(model.prune_mass)
+
+    def forward(self, batch_inputs):
+        e1 = self.entities(batch_inputs[:, 0]).view(-1, self.K, self.emb_s)
+        e2 = self.entities(batch_inputs[:, 2]).view(-1, self.K, self.emb_s)
+        if self.prune_factors > 0 or self.prune_mass > 0:
+            conv_bias = self.conv_layer.bias
+            assert conv_bias is not None  # TorchScript 中 Conv2d.bias 的类型是 Optional[Tensor]
+            x4, att = pruned_factor_sum(e1, self.relation_embeddings[batch_inputs[:, 1]], e2,
+                                        self.fc1.weight, self.fc1.bias, self.conv_layer.weight,
+                                        conv_bias, self.prune_factors, self.prune_mass)
+            return self.fc3(x4).view(-1)
+        rel = self.relation_embeddings[batch_inputs[:, 1]].unsqueeze(1).expand(-1, self.K, self.emb_s)
+
+        e1_rel_e2 = torch.cat([e1, rel, e2], 2)  # [b_s, k, emb_s * 3]
+        att = torch.softmax(F.relu(self.fc1(e1_rel_e2).squeeze(-1)), dim=1)
+
+        conv_input = e1_rel_e2.view(-1, 3, self.emb_s).transpose(1, 2).unsqueeze(1)
+        x = F.relu(self.conv_layer(conv_input)).view(e1_rel_e2.size(0), self.K, -1)
+        x = torch.sum(att.unsqueeze(-1) * x, 1)
+        return self.fc3(x).view(-1)
+
+
+SCORERS = {
+    'TransE': TransEScorer,
+    'DisenE_Trans': DisenETransScorer,
+    'ConvKB': ConvKBScorer,
+    'DisenE': DisenEScorer,
+}
+
+
+def build_scorer(model, model_name, quantize='none'):
+    """quantize: none / row (每行一个缩放系数) / factor (每个因子一个缩放系数)"""
+    return SCORERS[model_name](model, quantize).eval()
+
+
+def export_scorer(model, model_name, path, method='script', quantize='none'):
+    """把训练好的模型导出为冻结的TorchScript打分模块"""
+    scorer = build_scorer(model, model_name, quantize)
+    if method == 'trace':
+        example = torch.zeros(2, 3, dtype=torch.long, device=scorer.relation_embeddings.device)
+        module = torch.jit.trace(scorer, example)
+    else:
+        module = torch.jit.script(scorer)
+    module = torch.jit.freeze(module)
+
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    torch.jit.save(module, path)
+    return module
+
+
+class ScriptedScorer:
+    """包装打分模块(导出的或 build_scorer 构建的)，使其与 model(...) / model.test(...) 的调用方式一致：返回 (scores, 0)"""
+
+    def __init__(self, module, device):
+        self.module = module
+        self.device = device
+
+    def __call__(self, batch_inputs):
+        if isinstance(batch_inputs, np.ndarray):
+            batch_inputs = torch.from_numpy(batch_inputs)
+        return self.module(batch_inputs.to(self.device, torch.long)), 0
+
+    test = __call__
+
+    def eval(self):
+        return self
+
+
+def load_scorer(path, device=None):
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    return ScriptedScorer(torch.jit.load(path, map_location=device), device)
@@ -0,0 +1,78 @@
+import torch
+import numpy as np
+
+import collections
+import hashlib
+import os
+
+# 链接预测的前topk结果缓存：按查询 (h, r, -1) / (-1, r, t) 保存，容量有上限(LRU淘汰)，
+# 以模型参数和打分设置的哈希为文件名保存在磁盘上，模型不变时重新运行可以跳过打分
+# python -u run.py --evaluate=1 --load=... --link_cache_dir=./results/FB15k-237/link_cache --link_cache_size=1000000
+
+
+def model_fingerprint(model, settings=()):
+    """
+    模型参数(按 state_dict 顺序)加上影响打分的设置的sha1
+    model 可以是 nn.Module、model.test 这样的绑定方法或 inference.ScriptedScorer
+    """
+    owner = getattr(model, '__self__', model)
+    owner = getattr(owner, 'module', owner)
+    digest = hashlib.sha1(type(owner).__name__.encode())
+    for name, tensor in owner.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    graph = getattr(owner, 'graph', None)
+    if graph is not None:
+        # 冻结的TorchScript打分器 state_dict 为空，参数已经成为图中的常量：对代码和常量取哈希
+        digest.update(str(owner.code).encode())
+        for node in graph.findAllNodes('prim::Constant'):
+            value = node.output().toIValue()
+            if isinstance(value, torch.Tensor):
+                digest.update(value.detach().cpu().contiguous().numpy().tobytes())
+            else:
+                digest.update(repr(value).encode())
+    digest.update(repr(tuple(settings)).encode())
+    return digest.hexdigest()
+
+
+class LinkCache:
+    def __init__(self, folder, fingerprint, max_entries=1000000):
+        self.path = os.path.join(folder, fingerprint + '.npz')
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(self.path):
+            with np.load(self.path) as data:
+                for key, value in zip(data['keys'], data['values']):
+                    self.entries[tuple(key.tolist())] = value[value >= 0]
+            print("link cache {}: {} entries loaded".format(self.path, len(self.entries)))
+
+    def get(self, query):
+        key = tuple(int(x) for x in query)
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, query, result):
+        key = tuple(int(x) for x in query)
+        self.entries[key] = np.asarray(result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        width = max([len(value) for value in self.entries.values()] + [0])
+        keys = np.array(list(self.entries.keys()), dtype=np.int64).reshape(-1, 3)
+        # 结果不足topk个时用-1补齐
+        values = np.full((len(self.entries), width), -1, dtype=np.int64)
+        for i, value in enumerate(self.entries.values()):
+            values[i, :len(value)] = value
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path, keys=keys, values=values)
+        os.replace(tmp_path, self.path)
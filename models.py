@@ -2,8 +2,19 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
+import inspect
+from torch.utils.checkpoint import checkpoint
 
 CUDA = torch.cuda.is_available()  # checking cuda availability
+# 旧版本(1.6)的 checkpoint 没有 use_reentrant 参数
+_CHECKPOINT_KWARGS = {'use_reentrant': False} if 'use_reentrant' in inspect.signature(checkpoint).parameters else {}
+
+
+def pool_margin_loss(pos_norm, neg_norm, pool_mask, margin):
+    # max(0, pos - neg + margin)，去掉池中的假负样本后取平均
+    sep_loss = F.relu(pos_norm.view(1, -1, 1) - neg_norm + margin)
+    keep = (~pool_mask).to(sep_loss.dtype)
+    return torch.sum(sep_loss * keep) / torch.clamp(keep.sum(), min=1.0)
 
 
 class ConvKB(nn.Module):
@@ -107,7 +118,7 @@ class TransE(nn.Module):
         pos_norm = torch.norm(pos_x, p=1, dim=1)
         neg_norm = torch.norm(neg_x, p=1, dim=1)
 
-        y = -torch.ones(int(self.valid_invalid_ratio) * len_pos_triples).cuda()
+        y = -torch.ones(int(self.valid_invalid_ratio) * len_pos_triples, device=pos_norm.device)
         output = (pos_norm, neg_norm, y)
 
         if batch_labels is not None:
@@ -120,6 +131,28 @@ class TransE(nn.Module):
 
         return output, 0
 
+    def forward_pool(self, batch_inputs, pool, pool_mask):
+        """
+        共享负样本池：batch_inputs [b, 3] 只有正样本，pool [n] 是整个批次共用的替换实体，
+        pool_mask [2, b, n] 为True的位置(替换头/尾后是有效三元组)不算作负样本
+        """
+        if self.do_normalize:
+            self.entity_embeddings.data = F.normalize(
+                self.entity_embeddings.data, p=2, dim=1).detach()
+
+        head = self.entity_embeddings[batch_inputs[:, 0], :]
+        rel = self.relation_embeddings[batch_inputs[:, 1], :]
+        tail = self.entity_embeddings[batch_inputs[:, 2], :]
+        cand = self.entity_embeddings[pool, :]
+
+        pos_norm = torch.norm(head + rel - tail, p=1, dim=1)
+        # ||p + r - t|| = ||p - (t - r)||,  ||h + r - p||
+        neg_head = torch.cdist(tail - rel, cand, p=1)  # [b, n]
+        neg_tail = torch.cdist(head + rel, cand, p=1)
+
+        loss = pool_margin_loss(pos_norm, torch.stack([neg_head, neg_tail]), pool_mask, self.margin)
+        return loss, 0
+
     def test(self, batch_inputs):
         head = self.entity_embeddings[batch_inputs[:, 0], :]
         rel = self.relation_embeddings[batch_inputs[:, 1], :]
@@ -134,6 +167,76 @@ class TransE(nn.Module):
         return score, 0
 
 
+class FactoredEntityTable(nn.Module):
+    '''
+    紧凑的实体表：第e个实体第k个因子 = base[e] + coef[e] @ basis[:, k]，
+    参数量 E * (D + rank) + rank * K * D，代替 E * K * D；用 table[idx, :] 取行时现场组合成 [n, K * D]
+    normalize : 对组合后的行做L2归一化(代替 do_normalize 对整张表的原地归一化)
+    '''
+
+    def __init__(self, entity_emb, k_factors, rank, normalize=False):
+        super(FactoredEntityTable, self).__init__()
+        self.K = k_factors
+        self.rank = rank
+        self.normalize = normalize
+        num_nodes, ent_emb_s = entity_emb.shape
+        self.emb_s = ent_emb_s // k_factors
+
+        # 初始值：K个因子的均值作为base，剩下的部分取秩为rank的近似(预训练向量复制K份时为0)
+        factors = entity_emb.view(num_nodes, k_factors, self.emb_s)
+        base = factors.mean(1)
+        residual = (factors - base.unsqueeze(1)).view(num_nodes, -1)
+        if residual.abs().max() > 0:
+            u, s, v = torch.svd_lowrank(residual, q=min(rank, num_nodes, ent_emb_s))
+            coef = torch.zeros(num_nodes, rank)
+            basis = torch.zeros(rank, ent_emb_s)
+            coef[:, :u.size(1)] = u * s
+            basis[:u.size(1)] = v.t()
+        else:
+            coef = torch.zeros(num_nodes, rank)
+            basis = torch.randn(rank, ent_emb_s) * (1.0 / ent_emb_s ** 0.5)
+        self.base = nn.Parameter(base.contiguous())
+        self.coef = nn.Parameter(coef)
+        self.basis = nn.Parameter(basis)
+
+    @property
+    def shape(self):
+        return torch.Size([self.base.size(0), self.K * self.emb_s])
+
+    @property
+    def device(self):
+        return self.base.device
+
+    def forward(self, idx):
+        rows = self.base[idx].repeat(1, self.K) + torch.matmul(self.coef[idx], self.basis)  # [n, K * D]
+        if self.normalize:
+            rows = F.normalize(rows, p=2, dim=1)
+        return rows
+
+    def __getitem__(self, key):
+        # 与参数表相同的 table[idx, :] / table[idx] 写法
+        if isinstance(key, tuple):
+            key = key[0]
+        return self(key)
+
+    def full(self, chunk_rows=65536):
+        """组合出完整的 [E, K * D] 表(导出/量化用)"""
+        with torch.no_grad():
+            return torch.cat([self(torch.arange(start, min(start + chunk_rows, self.base.size(0)),
+                                                device=self.device))
+                              for start in range(0, self.base.size(0), chunk_rows)])
+
+
+def entity_table(entity_emb, config, do_normalize):
+    '''
+    config.factored_rank > 0 时用 FactoredEntityTable，并在gather中归一化；返回 (实体表, 模型的 do_normalize)
+    '''
+    rank = getattr(config, 'factored_rank', 0)
+    if rank:
+        return FactoredEntityTable(entity_emb, config.k_factors, rank, normalize=bool(do_normalize)), 0
+    return nn.Parameter(entity_emb), do_normalize
+
+
 class DisenE(nn.Module):
     def __init__(self, entity_emb, relation_emb, config=None):
 
@@ -141,7 +244,7 @@ class DisenE(nn.Module):
         self.do_normalize = config.do_normalize  # 0
         self.K = config.k_factors  # 6
 
-        self.entity_embeddings = nn.Parameter(entity_emb)  # 可训练
+        self.entity_embeddings, self.do_normalize = entity_table(entity_emb, config, self.do_normalize)  # 可训练
         self.relation_embeddings = nn.Parameter(relation_emb)
 
         self.num_nodes = entity_emb.shape[0]  # 实体总数
@@ -164,6 +267,16 @@ class DisenE(nn.Module):
         nn.init.xavier_uniform_(self.fc1.weight, gain=1.414)
         nn.init.xavier_uniform_(self.fc3.weight, gain=1.414)
 
+        # 不拼接 [b_s, k, emb_s * 3] 的前向计算，结果与原来的一致
+        self.fused_forward = getattr(config, 'fused_forward', 0)
+        # 推理时只对注意力最大的几个因子算卷积：前 prune_factors 个，或累计注意力达到 prune_mass 的最少因子
+        self.prune_factors = getattr(config, 'prune_factors', 0)
+        self.prune_mass = getattr(config, 'prune_mass', 0.0)
+        # 训练时反向重新计算激活，不保存：block 为注意力块和整个卷积块，factor 为每个因子的卷积分别重算
+        self.grad_checkpoint = getattr(config, 'grad_checkpoint', 'none')
+        if self.grad_checkpoint not in ('none', 'block', 'factor'):
+            raise ValueError("grad_checkpoint must be none, block or factor, got {}".format(self.grad_checkpoint))
+
         # loss function
         self.loss = torch.nn.SoftMarginLoss()
 
@@ -172,6 +285,21 @@ class DisenE(nn.Module):
             self.entity_embeddings.data = F.normalize(
                 self.entity_embeddings.data, p=2, dim=1).detach()
 
+        if not self.training and (self.prune_factors or self.prune_mass):
+            return self.pruned_scores(batch_inputs)
+
+        if self.training and self.grad_checkpoint != 'none' and torch.is_grad_enabled():
+            output, att_e1_e2 = self.checkpointed_scores(batch_inputs)
+            if batch_labels is not None:
+                return self.loss(output.view(-1), batch_labels.view(-1)), att_e1_e2
+            return output, att_e1_e2
+
+        if self.fused_forward:
+            output, att_e1_e2 = self.fused_scores(batch_inputs)
+            if batch_labels is not None:
+                return self.loss(output.view(-1), batch_labels.view(-1)), att_e1_e2
+            return output, att_e1_e2
+
         e1_embedded = self.entity_embeddings[batch_inputs[:, 0], :].view(-1, self.K, self.emb_s)
         rel_embedded = self.relation_embeddings[batch_inputs[:, 1]].unsqueeze(1)
 
@@ -201,6 +329,182 @@ class DisenE(nn.Module):
 
         return output, att_e1_e2
 
+    def fused_scores(self, batch_inputs):
+        '''
+        fc1([e1, r, e2]) 拆成三个投影；(3, 3) 的卷积按 e1 / r / e2 拆开，每个输入上的卷积就是对相邻3个位置的线性组合，
+        关系部分每个三元组只算一次再加到K个因子上，不复制关系嵌入
+        '''
+        e1_embedded = self.entity_embeddings[batch_inputs[:, 0], :].view(-1, self.emb_s)  # [b_s * k, emb_s]
+        rel_embedded = self.relation_embeddings[batch_inputs[:, 1]]  # [b_s, emb_s]
+        e2_embedded = self.entity_embeddings[batch_inputs[:, 2], :].view(-1, self.emb_s)
+        b_s = rel_embedded.size(0)
+
+        # calculate k attention
+        w_e1, w_rel, w_e2 = self.fc1.weight.view(3, self.emb_s)
+        tmp = (torch.mv(e1_embedded, w_e1) + torch.mv(e2_embedded, w_e2)).view(b_s, self.K) + \
+            (torch.mv(rel_embedded, w_rel) + self.fc1.bias).unsqueeze(1)
+        att_e1_e2 = self.softmax(self.non_linearity(tmp))  # [b_s, k]
+
+        # inside calculation, conv_layer.weight: [channel, 1, 3, 3]，最后一维对应 e1 / r / e2
+        weight = self.conv_layer.weight.squeeze(1)  # [channel, 3, 3]
+        # 每个位置前后各一个位置的窗口(unfold是视图)，e1 和 e2 的窗口放在一起做一次矩阵乘
+        windows = torch.cat([_windows(e1_embedded), _windows(e2_embedded)], 1)  # [b_s * k, 6, emb_s]
+        x = torch.matmul(torch.cat([weight[:, :, 0], weight[:, :, 2]], 1), windows)  # [b_s * k, channel, emb_s]
+        conv_rel = torch.matmul(weight[:, :, 1], _windows(rel_embedded)) + \
+            self.conv_layer.bias.view(-1, 1)  # [b_s, channel, emb_s]
+        x = x.view(b_s, self.K, -1, self.emb_s).add_(conv_rel.unsqueeze(1)).view(b_s, self.K, -1)
+
+        keep = None
+        if self.training and self.dropout_conv.p > 0:
+            # 与 dropout_conv 相同的随机数序列，只保存bool掩码
+            keep = F.dropout(torch.ones_like(x), self.dropout_conv.p, True) != 0
+        scale = 1.0 / (1 - self.dropout_conv.p) if keep is not None else 1.0
+        x4 = _AttendedReluDropout.apply(x, att_e1_e2, keep, scale)  # [b_s, channel * emb_s]
+        output = self.fc3(x4)
+        return output, att_e1_e2
+
+
+    def checkpointed_scores(self, batch_inputs):
+        '''
+        与默认前向相同的计算，只为反向保存嵌入和注意力，注意力块和卷积块在反向时重新计算
+        dropout 掩码在这里一次画出(与默认前向的 dropout_conv 相同的随机数序列)，按因子切片传给各块，重算时直接复用
+        '''
+        e1_embedded = self.entity_embeddings[batch_inputs[:, 0], :].view(-1, self.K, self.emb_s)
+        rel_embedded = self.relation_embeddings[batch_inputs[:, 1]]  # [b_s, emb_s]
+        e2_embedded = self.entity_embeddings[batch_inputs[:, 2], :].view(-1, self.K, self.emb_s)
+
+        keep = None
+        if self.dropout_conv.p > 0:
+            # 与 fused_scores 相同，只保存bool掩码 [b_s, k, channel * emb_s]
+            keep = F.dropout(e1_embedded.new_ones(e1_embedded.size(0), self.K, self.fc3.in_features),
+                             self.dropout_conv.p, True) != 0
+
+        att_e1_e2 = checkpoint(self._attention_block, e1_embedded, rel_embedded, e2_embedded, **_CHECKPOINT_KWARGS)
+        if self.grad_checkpoint == 'factor':
+            # 每次只有一个因子的卷积激活
+            x4 = 0
+            for k in range(self.K):
+                x4 = x4 + checkpoint(self._factor_block, e1_embedded[:, k], rel_embedded, e2_embedded[:, k],
+                                     att_e1_e2[:, k:k + 1], None if keep is None else keep[:, k],
+                                     **_CHECKPOINT_KWARGS)
+        else:
+            x4 = checkpoint(self._conv_block, e1_embedded, rel_embedded, e2_embedded, att_e1_e2, keep,
+                            **_CHECKPOINT_KWARGS)
+        output = self.fc3(x4)
+        return output, att_e1_e2
+
+    def _attention_block(self, e1_embedded, rel_embedded, e2_embedded):
+        ex_rel_emb = rel_embedded.unsqueeze(1).expand(-1, self.K, self.emb_s)
+        e1_rel_e2 = torch.cat([e1_embedded, ex_rel_emb, e2_embedded], 2)  # [b_s, k, emb_s * 3]
+        return self.softmax(self.non_linearity(self.fc1(e1_rel_e2).squeeze(-1)))  # [b_s, k]
+
+    def _masked(self, x, keep):
+        # 用 checkpointed_scores 画好的掩码代替 dropout_conv
+        if keep is None:
+            return x
+        return x * keep * (1.0 / (1 - self.dropout_conv.p))
+
+    def _conv_block(self, e1_embedded, rel_embedded, e2_embedded, att_e1_e2, keep):
+        ex_rel_emb = rel_embedded.unsqueeze(1).expand(-1, self.K, self.emb_s)
+        x = torch.cat([e1_embedded, ex_rel_emb, e2_embedded], 2).view(-1, 3, self.emb_s)  # [b_s * k, 3, emb_s]
+        x = self.non_linearity(self.conv_layer(x.transpose(1, 2).unsqueeze(1)))
+        x = self._masked(x.view(e1_embedded.size(0), self.K, -1), keep)  # [b_s, k, emb_s * channel]
+        return torch.sum(torch.mul(att_e1_e2.unsqueeze(-1), x), 1)
+
+    def _factor_block(self, e1_factor, rel_embedded, e2_factor, att_factor, keep):
+        x = torch.stack([e1_factor, rel_embedded, e2_factor], 1)  # [b_s, 3, emb_s]
+        x = self.non_linearity(self.conv_layer(x.transpose(1, 2).unsqueeze(1)))
+        return att_factor * self._masked(x.view(x.size(0), -1), keep)  # [b_s, emb_s * channel]
+
+    def pruned_scores(self, batch_inputs):
+        '''
+        先用拆开的 fc1 算出K个因子的注意力，只对选中的因子算卷积和 fc3，选中因子的注意力重新归一化
+        返回的注意力是完整的 [b_s, k]
+        '''
+        e1_embedded = self.entity_embeddings[batch_inputs[:, 0], :].view(-1, self.K, self.emb_s)
+        rel_embedded = self.relation_embeddings[batch_inputs[:, 1]]  # [b_s, emb_s]
+        e2_embedded = self.entity_embeddings[batch_inputs[:, 2], :].view(-1, self.K, self.emb_s)
+        x4, att_e1_e2 = pruned_factor_sum(e1_embedded, rel_embedded, e2_embedded, self.fc1.weight, self.fc1.bias,
+                                          self.conv_layer.weight, self.conv_layer.bias,
+                                          self.prune_factors, self.prune_mass)
+        output = self.fc3(x4)
+        return output, att_e1_e2
+
+
+class _AttendedReluDropout(torch.autograd.Function):
+    '''
+    sum_k att[:, k] * dropout(relu(x[:, k]))，x: [b_s, k, channel * emb_s]
+    只为反向保存 x 和dropout的bool掩码，激活值在反向时重新计算，不保存 relu / dropout 的输出
+    '''
+
+    @staticmethod
+    def forward(ctx, x, att, keep, scale):
+        # dropout的缩放系数乘到注意力上
+        ctx.scale = scale
+        ctx.save_for_backward(x, att, keep)
+        return torch.bmm(att.unsqueeze(1) * scale, _masked_relu(x, keep)).squeeze(1)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        x, att, keep = ctx.saved_tensors
+        grad_att = torch.bmm(_masked_relu(x, keep), grad_output.unsqueeze(-1)).squeeze(-1) * ctx.scale
+        mask = x > 0
+        if keep is not None:
+            mask &= keep
+        grad_x = (att.unsqueeze(-1) * ctx.scale) * grad_output.unsqueeze(1)
+        return grad_x.mul_(mask), grad_att, None, None
+
+
+def _masked_relu(x, keep):
+    y = x.clamp(min=0)
+    return y if keep is None else y.mul_(keep)
+
+
+def _windows(x):
+    # [n, emb_s] -> [n, 3, emb_s]，第o行是位置 d+o-1 的值(两端补0)，与 padding=1 的卷积对应
+    return F.pad(x, (1, 1)).unfold(-1, 3, 1).transpose(1, 2)
+
+
+def pruned_factor_sum(e1_embedded, rel_embedded, e2_embedded, fc1_weight, fc1_bias, conv_weight, conv_bias,
+                      prune_factors: int, prune_mass: float):
+    '''
+    DisenE.pruned_scores 与 inference.DisenEScorer 共用(可以被TorchScript编译)：
+    e1/e2 [b_s, k, emb_s]，rel [b_s, emb_s]；返回选中因子的卷积按重新归一化的注意力加权之和 [b_s, channel * emb_s]
+    和完整的注意力 [b_s, k]
+    '''
+    b_s, num_factors, emb_s = e1_embedded.size(0), e1_embedded.size(1), e1_embedded.size(2)
+    w = fc1_weight.view(3, emb_s)
+    tmp = torch.matmul(e1_embedded, w[0]) + torch.matmul(e2_embedded, w[2]) + \
+        (torch.mv(rel_embedded, w[1]) + fc1_bias).unsqueeze(1)
+    att_e1_e2 = torch.softmax(F.relu(tmp), dim=1)  # [b_s, k]
+
+    att_sorted, order = torch.sort(att_e1_e2, dim=1, descending=True)
+    # 每个三元组保留的因子个数
+    needed = torch.full((b_s,), prune_factors if prune_factors > 0 else num_factors, dtype=torch.long,
+                        device=tmp.device)
+    if prune_mass > 0:
+        needed = torch.min(needed, (torch.cumsum(att_sorted, 1) < prune_mass).sum(1) + 1)
+    keep = torch.zeros_like(att_e1_e2, dtype=torch.bool).scatter_(
+        1, order, torch.arange(num_factors, device=tmp.device) < needed.unsqueeze(1))
+    att_kept = att_e1_e2 * keep
+    att_kept = att_kept / att_kept.sum(1, keepdim=True)
+
+    # 选中的 (三元组, 因子) 排成一列，只对它们算卷积，加权后按三元组累加
+    kept = keep.nonzero()
+    rows, factors = kept[:, 0], kept[:, 1]
+    e1_kept = e1_embedded[rows, factors]  # [m, emb_s]
+    e2_kept = e2_embedded[rows, factors]
+
+    # 与 fused_scores 相同的卷积拆分
+    weight = conv_weight.squeeze(1)  # [channel, 3, 3]
+    windows = torch.cat([_windows(e1_kept), _windows(e2_kept)], 1)  # [m, 6, emb_s]
+    x = torch.matmul(torch.cat([weight[:, :, 0], weight[:, :, 2]], 1), windows)  # [m, channel, emb_s]
+    conv_rel = torch.matmul(weight[:, :, 1], _windows(rel_embedded)) + conv_bias.view(-1, 1)  # [b_s, channel, emb_s]
+    x = F.relu(x.add_(conv_rel[rows])).view(rows.size(0), -1)
+    x4 = torch.zeros(b_s, x.size(1), dtype=x.dtype, device=x.device).index_add_(
+        0, rows, x.mul_(att_kept[rows, factors].unsqueeze(1)))  # [b_s, channel * emb_s]
+    return x4, att_e1_e2
+
 
 class DisenE_Trans(nn.Module):
     def __init__(self, entity_emb, relation_emb, config=None):
@@ -213,8 +517,9 @@ class DisenE_Trans(nn.Module):
         self.do_normalize = config.do_normalize  # 归一化参数
         self.K = config.k_factors  # 划分的因子数
         self.valid_invalid_ratio = config.valid_invalid_ratio  # 正样本对应负样本的比例
+        self.debug = getattr(config, 'debug', 0)  # 每一步打印调试信息(会引起设备到主机的同步)
 
-        self.entity_embeddings = nn.Parameter(entity_emb)
+        self.entity_embeddings, self.do_normalize = entity_table(entity_emb, config, self.do_normalize)
         self.relation_embeddings = nn.Parameter(relation_emb)
 
         self.emb_s = relation_emb.shape[1]  # 关系的嵌入维度 100
@@ -240,7 +545,8 @@ class DisenE_Trans(nn.Module):
 
         # [128*(40+1), 6, 100]
         head = self.entity_embeddings[batch_inputs[:, 0], :].view(-1, self.K, self.emb_s)
-        print(head[0][0] == head[0][1])
+        if self.debug:
+            print(head[0][0] == head[0][1])
 
         # [5248, 100] -> [5248, 1, 100] -> [5248, 6, 100]
         rel = self.relation_embeddings[batch_inputs[:, 1]]
@@ -277,7 +583,7 @@ class DisenE_Trans(nn.Module):
         pos_norm = torch.norm(pos_x, p=1, dim=1)
         neg_norm = torch.norm(neg_x, p=1, dim=1)
 
-        y = -torch.ones(int(self.valid_invalid_ratio) * len_pos_triples).cuda()
+        y = -torch.ones(int(self.valid_invalid_ratio) * len_pos_triples, device=pos_norm.device)
         output = (pos_norm, neg_norm, y)
 
         if batch_labels is not None:
@@ -287,6 +593,42 @@ class DisenE_Trans(nn.Module):
             return loss, att
         return output, att
 
+    def forward_pool(self, batch_inputs, pool, pool_mask):
+        """与 TransE.forward_pool 相同的共享负样本池，注意力按(候选实体, 关系, 实体)逐对计算"""
+        if self.do_normalize:
+            self.entity_embeddings.data = F.normalize(
+                self.entity_embeddings.data, p=2, dim=1).detach()
+
+        head = self.entity_embeddings[batch_inputs[:, 0], :].view(-1, self.K, self.emb_s)  # [b, k, emb_s]
+        rel = self.relation_embeddings[batch_inputs[:, 1]]  # [b, emb_s]
+        tail = self.entity_embeddings[batch_inputs[:, 2], :].view(-1, self.K, self.emb_s)
+        cand = self.entity_embeddings[pool, :].view(-1, self.K, self.emb_s)  # [n, k, emb_s]
+
+        # fc1([h, r, t]) 拆成三部分: h.w_h + r.w_r + t.w_t + b
+        w_h, w_r, w_t = self.fc1.weight.view(3, self.emb_s)
+        head_logit = torch.matmul(head, w_h)  # [b, k]
+        tail_logit = torch.matmul(tail, w_t)
+        rel_logit = torch.matmul(rel, w_r).unsqueeze(1) + self.fc1.bias  # [b, 1]
+
+        att = self.softmax(self.non_linearity(head_logit + rel_logit + tail_logit))
+        pos_x = torch.sum(att.unsqueeze(-1) * (head + rel.unsqueeze(1) - tail), 1)
+        pos_norm = torch.norm(pos_x, p=1, dim=1)
+
+        # 替换头实体: (p, r, t)  [b, n, k]
+        att_head = torch.softmax(self.non_linearity(
+            torch.matmul(cand, w_h).unsqueeze(0) + (rel_logit + tail_logit).unsqueeze(1)), dim=-1)
+        neg_head = torch.einsum('bnk,nkd->bnd', att_head, cand) + \
+            torch.einsum('bnk,bkd->bnd', att_head, rel.unsqueeze(1) - tail)
+        # 替换尾实体: (h, r, p)
+        att_tail = torch.softmax(self.non_linearity(
+            torch.matmul(cand, w_t).unsqueeze(0) + (head_logit + rel_logit).unsqueeze(1)), dim=-1)
+        neg_tail = torch.einsum('bnk,bkd->bnd', att_tail, head + rel.unsqueeze(1)) - \
+            torch.einsum('bnk,nkd->bnd', att_tail, cand)
+
+        neg_norm = torch.stack([neg_head.abs().sum(-1), neg_tail.abs().sum(-1)])
+        loss = pool_margin_loss(pos_norm, neg_norm, pool_mask, self.margin)
+        return loss, att
+
     def test(self, batch_inputs):
         head_ori = self.entity_embeddings[batch_inputs[:, 0], :].view(-1, self.K, self.emb_s)
         rel = self.relation_embeddings[batch_inputs[:, 1], :]
@@ -0,0 +1,110 @@
+import numpy as np
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+
+import run
+from dataloader import Corpus, train_fingerprint
+from process_data import build_data
+
+# 预先生成N个epoch的训练批次(正样本顺序 + 过滤后的负样本实体)，每个epoch两个int32文件，多进程并行生成
+# run.py --neg_shards=<目录> 时从内存映射的文件中直接组装批次，同一份文件在不同运行、不同机器上得到完全相同的批次
+# python -u neg_shards.py --neg_dir=./results/FB15k-237/neg_shards --neg_epochs=50 --neg_workers=8 --dataset=FB15k-237 --batch_size=128 --valid_invalid_ratio=40
+# python -u run.py --neg_shards=./results/FB15k-237/neg_shards --dataset=FB15k-237 --model_name=DisenE ...
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--neg_dir", required=True, help="output folder of the shards")
+parser.add_argument("--neg_epochs", type=int, default=10, help="epochs to generate; training cycles through them")
+parser.add_argument("--neg_workers", type=int, default=0, help="processes, 0 for one per core")
+
+
+def corrupt_epoch(corpus, train_indices, batch_size, ratio, rng):
+    """
+    一个epoch的 (正样本顺序, 负样本实体)
+    负样本按 get_iteration_batch 的布局：每个批次先是 tmp_size * (ratio // 2) 个替换头实体的，再是同样多替换尾实体的
+    """
+    order = rng.permutation(len(train_indices)).astype(np.int32)
+    half = ratio // 2
+    negatives = np.empty(len(train_indices) * 2 * half, dtype=np.int32)
+    for start in range(0, len(order), batch_size):
+        positives = train_indices[order[start:start + batch_size]]
+        rows = np.tile(positives, (2 * half, 1)).astype(np.int64)
+        columns = np.repeat([0, 2], len(positives) * half)
+        entities = rng.randint(0, corpus.num_entities, len(rows))
+        while True:
+            # 替换后仍是训练集/验证集/测试集中的三元组时重新采样
+            rows[np.arange(len(rows)), columns] = entities
+            bad = np.flatnonzero(corpus.is_valid(rows))
+            if len(bad) == 0:
+                break
+            entities[bad] = rng.randint(0, corpus.num_entities, len(bad))
+        negatives[start * 2 * half:(start + len(positives)) * 2 * half] = entities
+    return order, negatives
+
+
+# fork出的子进程直接继承 corpus 和参数
+_shard_state = {}
+
+
+def _write_epoch(epoch):
+    corpus, train_indices, folder, batch_size, ratio, seed = [_shard_state[key] for key in (
+        'corpus', 'train_indices', 'folder', 'batch_size', 'ratio', 'seed')]
+    rng = np.random.RandomState([seed, epoch])
+    order, negatives = corrupt_epoch(corpus, train_indices, batch_size, ratio, rng)
+    for name, array in (('order', order), ('negatives', negatives)):
+        tmp_path = os.path.join(folder, '{}_{:04d}.tmp.npy'.format(name, epoch))
+        np.save(tmp_path, array)
+        os.replace(tmp_path, os.path.join(folder, '{}_{:04d}.npy'.format(name, epoch)))
+    return epoch
+
+
+def write_shards(corpus, folder, epochs, batch_size, ratio, seed, num_workers=0):
+    os.makedirs(folder, exist_ok=True)
+    train_indices = np.asarray(corpus.train_indices, dtype=np.int32)
+    _shard_state.update(corpus=corpus, train_indices=train_indices, folder=folder, batch_size=batch_size,
+                        ratio=ratio, seed=seed)
+    num_workers = min(num_workers or os.cpu_count() or 1, epochs)
+    try:
+        if num_workers > 1:
+            with multiprocessing.get_context('fork').Pool(num_workers) as pool:
+                for epoch in pool.imap_unordered(_write_epoch, range(epochs)):
+                    print("negative shard for epoch {} written".format(epoch))
+        else:
+            for epoch in range(epochs):
+                _write_epoch(epoch)
+                print("negative shard for epoch {} written".format(epoch))
+    finally:
+        _shard_state.clear()
+
+    with open(os.path.join(folder, 'meta.json'), 'w') as f:
+        json.dump({'epochs': epochs, 'batch_size': batch_size, 'valid_invalid_ratio': ratio, 'seed': seed,
+                   'num_train': len(train_indices), 'num_entities': corpus.num_entities,
+                   'train_sha1': train_fingerprint(train_indices)}, f)
+
+
+def main():
+    shard_args, run_argv = parser.parse_known_args()
+    args = run.parser.parse_args(run_argv)
+    args.data_dir = os.path.join(args.data_dir, args.dataset)
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    print("args = ", args, shard_args)
+
+    train_data, validation_data, test_data, link_data, entity2id, relation2id = build_data(
+        args.data_dir, streaming=args.stream_data, num_workers=args.load_workers)
+    corpus = Corpus(args, train_data, validation_data, test_data, link_data, entity2id, relation2id,
+                    args.batch_size, args.valid_invalid_ratio)
+
+    start_time = time.time()
+    write_shards(corpus, shard_args.neg_dir, shard_args.neg_epochs, args.batch_size, args.valid_invalid_ratio,
+                 args.seed, shard_args.neg_workers)
+    print("{} epochs of negatives written to {} in {:.1f}s".format(
+        shard_args.neg_epochs, shard_args.neg_dir, time.time() - start_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import numpy as np
+
+import argparse
+import json
+import os
+import time
+
+from vocab import Vocab
+
+# 不依赖torch的打分器，读取export.py导出的目录(np.load mmap)，多个进程可共享同一份page cache
+# python np_scorer.py --export_dir=./export/FB15k-237/DisenE_Trans --query_file=./data/FB15k-237/link_prediction1.txt
+
+
+class NumpyScorer:
+    def __init__(self, export_dir, mmap=True):
+        with open(os.path.join(export_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+
+        self.model_name = self.meta['model_name']
+        self.K = self.meta['k_factors']
+        self.emb_s = self.meta['emb_s']
+
+        self.entity_embeddings = np.load(os.path.join(export_dir, 'entity.npy'), mmap_mode=mmap_mode)
+        self.relation_embeddings = np.load(os.path.join(export_dir, 'relation.npy'), mmap_mode=mmap_mode)
+        self.num_entities = self.entity_embeddings.shape[0]
+
+        if self.model_name == 'DisenE_Trans':
+            # fc1([h, r, t]) = h.w_h + r.w_r + t.w_t + b
+            fc1_weight = np.load(os.path.join(export_dir, 'fc1_weight.npy'))
+            self.w_h = fc1_weight[:self.emb_s]
+            self.w_r = fc1_weight[self.emb_s:2 * self.emb_s]
+            self.w_t = fc1_weight[2 * self.emb_s:]
+            self.b = float(np.load(os.path.join(export_dir, 'fc1_bias.npy'))[0])
+
+        self.entity_vocab = Vocab.load(os.path.join(export_dir, 'entity_vocab'), mmap=mmap)
+        self.relation_vocab = Vocab.load(os.path.join(export_dir, 'relation_vocab'), mmap=mmap)
+
+    def _entities(self, ids):
+        return np.asarray(self.entity_embeddings[ids], dtype=np.float32)
+
+    def _relations(self, ids):
+        return np.asarray(self.relation_embeddings[ids], dtype=np.float32)
+
+    def score(self, batch_inputs):
+        """与model.test相同的分数(越大越好)，batch_inputs: [n, 3]"""
+        batch_inputs = np.asarray(batch_inputs)
+        head = self._entities(batch_inputs[:, 0])
+        rel = self._relations(batch_inputs[:, 1])
+        tail = self._entities(batch_inputs[:, 2])
+
+        if self.model_name == 'TransE':
+            return -np.abs(head + rel - tail).sum(1)
+
+        head = head.reshape(-1, self.K, self.emb_s)
+        tail = tail.reshape(-1, self.K, self.emb_s)
+        tmp = head @ self.w_h + (rel @ self.w_r)[:, None] + tail @ self.w_t + self.b  # [n, k]
+        att = _softmax(np.maximum(tmp, 0))
+        x = head + rel[:, None, :] - tail
+        x = np.einsum('nk,nkd->nd', att, x)
+        return -np.abs(x).sum(1)
+
+    def _score_candidates(self, fixed, rel, candidates, replace_head):
+        """固定一个实体和关系，对一块候选实体打分"""
+        cand = self._entities(candidates)
+        if self.model_name == 'TransE':
+            if replace_head:
+                x = cand + (rel - fixed)
+            else:
+                x = (fixed + rel) - cand
+            return -np.abs(x).sum(1)
+
+        fixed = fixed.reshape(self.K, self.emb_s)
+        cand = cand.reshape(-1, self.K, self.emb_s)
+        if replace_head:
+            # (?, r, t)
+            tmp = cand @ self.w_h + (rel @ self.w_r + fixed @ self.w_t + self.b)
+            att = _softmax(np.maximum(tmp, 0))
+            x = np.einsum('ck,ckd->cd', att, cand) + att @ (rel - fixed)
+        else:
+            # (h, r, ?)
+            tmp = cand @ self.w_t + (fixed @ self.w_h + rel @ self.w_r + self.b)
+            att = _softmax(np.maximum(tmp, 0))
+            x = att @ (fixed + rel) - np.einsum('ck,ckd->cd', att, cand)
+        return -np.abs(x).sum(1)
+
+    def topk(self, query, k=10, chunk_size=65536):
+        """query: (h, r, t)，待预测的位置为-1，返回分数最高的k个实体id"""
+        h, r, t = [int(v) for v in query]
+        replace_head = h == -1
+        fixed = self._entities(t if replace_head else h)
+        rel = self._relations(r)
+
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, self.num_entities, chunk_size):
+            candidates = np.arange(start, min(start + chunk_size, self.num_entities))
+            scores = self._score_candidates(fixed, rel, candidates, replace_head)
+            best_ids = np.concatenate([best_ids, candidates])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_ids) > k:
+                keep = np.argpartition(-best_scores, k)[:k]
+                best_ids, best_scores = best_ids[keep], best_scores[keep]
+
+        order = np.argsort(-best_scores, kind='stable')
+        return best_ids[order], best_scores[order]
+
+    def parse_queries(self, lines):
+        """link_prediction1.txt 格式的行 -> [n, 3] id数组，"?" 记为 -1"""
+        fields = [line.strip().split()[:3] for line in lines if line.strip()]
+        heads, relations, tails = [list(col) for col in zip(*fields)] if fields else ([], [], [])
+        queries = np.stack([self.entity_vocab.lookup(heads), self.relation_vocab.lookup(relations),
+                            self.entity_vocab.lookup(tails)], axis=1)
+        is_query = np.array([[h == "?", False, t == "?"] for h, t in zip(heads, tails)], dtype=bool).reshape(-1, 3)
+        unknown = (queries < 0) & ~is_query
+        if unknown.any():
+            row = int(np.nonzero(unknown.any(1))[0][0])
+            raise KeyError("unknown entity or relation in query: {}".format(" ".join(fields[row])))
+        return queries
+
+
+def _softmax(x):
+    x = x - x.max(-1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(-1, keepdims=True)
+    return x
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--export_dir", required=True)
+    parser.add_argument("--query_file", required=True, help="same format as link_prediction1.txt")
+    parser.add_argument("--output", default="result.json")
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument("--chunk_size", type=int, default=65536)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    scorer = NumpyScorer(args.export_dir)
+    print("scorer loaded in {:.3f}s".format(time.time() - start_time))
+
+    with open(args.query_file) as f:
+        queries = scorer.parse_queries(f)
+
+    result = []
+    for query in queries:
+        ids, _ = scorer.topk(query, args.topk, args.chunk_size)
+        result.append(scorer.entity_vocab.names(ids))
+
+    with open(args.output, 'w') as f:
+        json.dump({"results": result}, f)
+    print("{} queries, total time {:.3f}s".format(len(result), time.time() - start_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import numpy as np
+
+import argparse
+import json
+import os
+import random
+import time
+
+import run
+from dataloader import Corpus
+from embedding_store import adam_update
+from process_data import build_data, load_vectors, tile_vectors
+
+# 分区训练(类似PyTorch-BigGraph)：实体表和Adam状态按实体id切成P个分区存在磁盘上，
+# 训练三元组按(头实体分区, 尾实体分区)分桶，内存中同时最多只有两个分区
+# python -u partitioned.py --num_partitions=4 --dataset=FB15k-237 --model_name=DisenE_Trans --epochs=100
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--num_partitions", type=int, default=4)
+parser.add_argument("--partition_dir", default="None", help="defaults to <output_dir>/<dataset>/partitions")
+parser.add_argument("--assemble", type=int, default=0,
+                    help="also write a full trained_final.pth for run.py --evaluate "
+                         "(the table is assembled in a memory-mapped file, not in RAM)")
+
+
+class PartitionStore:
+    """磁盘上的实体分区：part_p.npy 为嵌入，part_p_m.npy / part_p_v.npy 为Adam的一阶/二阶动量"""
+
+    def __init__(self, folder, num_entities, num_partitions):
+        self.folder = folder
+        self.num_entities = num_entities
+        self.num_partitions = num_partitions
+        self.part_size = (num_entities + num_partitions - 1) // num_partitions
+        self.steps = [0] * num_partitions
+
+    def bounds(self, p):
+        return p * self.part_size, min((p + 1) * self.part_size, self.num_entities)
+
+    def partition_of(self, entity_ids):
+        return entity_ids // self.part_size
+
+    def _path(self, p, suffix=''):
+        return os.path.join(self.folder, "part_{}{}.npy".format(p, suffix))
+
+    def init(self, make_rows):
+        """make_rows(start, end) 返回这些实体的初始嵌入，一次只生成一个分区"""
+        os.makedirs(self.folder, exist_ok=True)
+        for p in range(self.num_partitions):
+            start, end = self.bounds(p)
+            rows = np.asarray(make_rows(start, end), dtype=np.float32)
+            np.save(self._path(p), rows)
+            np.save(self._path(p, '_m'), np.zeros_like(rows))
+            np.save(self._path(p, '_v'), np.zeros_like(rows))
+        self.save_meta()
+
+    @property
+    def dim(self):
+        return np.load(self._path(0), mmap_mode='r').shape[1]
+
+    def load_into(self, p, tensors):
+        """分区p的嵌入和动量直接读入 tensors(预分配缓冲区中的槽位)，不另建副本"""
+        for suffix, tensor in zip(('', '_m', '_v'), tensors):
+            rows = np.load(self._path(p, suffix), mmap_mode='r')
+            if tensor.is_cuda:
+                tensor.copy_(torch.from_numpy(np.array(rows)))
+            else:
+                tensor.numpy()[:] = rows
+
+    def save(self, p, tensors):
+        for suffix, tensor in zip(('', '_m', '_v'), tensors):
+            np.save(self._path(p, suffix), tensor.detach().cpu().numpy())
+
+    def save_meta(self):
+        with open(os.path.join(self.folder, 'meta.json'), 'w') as f:
+            json.dump({'num_entities': self.num_entities, 'num_partitions': self.num_partitions,
+                       'part_size': self.part_size, 'steps': self.steps}, f)
+
+    def full_table(self, path):
+        """逐个分区写入 path(.npy，内存映射)，整张表不会同时在内存中"""
+        table = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                          shape=(self.num_entities, self.dim))
+        for p in range(self.num_partitions):
+            start, end = self.bounds(p)
+            table[start:end] = np.load(self._path(p), mmap_mode='r')
+        table.flush()
+        return table
+
+
+def bucket_triples(train_indices, store):
+    """按 (头实体分区, 尾实体分区) 分桶，返回 {(i, j): 三元组数组}"""
+    P = store.num_partitions
+    bucket_ids = store.partition_of(train_indices[:, 0]) * P + store.partition_of(train_indices[:, 2])
+    order = np.argsort(bucket_ids, kind='stable')
+    offsets = np.searchsorted(bucket_ids[order], np.arange(P * P + 1))
+    return {(b // P, b % P): train_indices[order[offsets[b]:offsets[b + 1]]]
+            for b in range(P * P) if offsets[b + 1] > offsets[b]}
+
+
+def bucket_order(buckets, num_partitions):
+    # 外层分区固定、内层分区轮换，相邻的桶至少共享一个分区，减少换入换出
+    outer = list(range(num_partitions))
+    random.shuffle(outer)
+    order = []
+    for i in outer:
+        inner = [j for j in range(num_partitions) if (i, j) in buckets or (j, i) in buckets]
+        random.shuffle(inner)
+        for j in inner:
+            for key in ((i, j), (j, i)):
+                if key in buckets and key not in order:
+                    order.append(key)
+    return order
+
+
+def sample_bucket_batch(corpus, store, positives, head_part, tail_part, ratio):
+    """
+    与 Corpus.get_iteration_batch 相同的布局(正样本在前，前一半负样本替换头实体，后一半替换尾实体)，
+    但替换的实体只从本桶的两个分区中采样，并过滤掉已知的有效三元组；
+    ratio为奇数时多出的一份保持为正样本，和 get_iteration_batch 一样
+    """
+    n = len(positives)
+    batch_triples = np.tile(positives, (ratio + 1, 1)).astype(np.int64)
+    batch_labels = np.ones((n * (ratio + 1), 1), dtype=np.float32)
+    half = n * (ratio // 2)
+    if half == 0:
+        return batch_triples, batch_labels
+
+    batch_labels[n:n + 2 * half] = -1
+    for rows, column, p in ((slice(n, n + half), 0, head_part), (slice(n + half, n + 2 * half), 2, tail_part)):
+        start, end = store.bounds(p)
+        negatives = batch_triples[rows]
+        negatives[:, column] = np.random.randint(start, end, len(negatives))
+        for _ in range(10):
+            invalid = corpus.is_valid(negatives)
+            if not invalid.any():
+                break
+            negatives[invalid, column] = np.random.randint(start, end, int(invalid.sum()))
+        batch_triples[rows] = negatives
+    return batch_triples, batch_labels
+
+
+def to_local(batch_triples, store, offsets):
+    # 全局id -> 局部实体表中的行号，offsets: {分区: 该分区在局部表中的起始行}
+    local = batch_triples.copy()
+    for column in (0, 2):
+        ids = batch_triples[:, column]
+        for p, offset in offsets.items():
+            start, end = store.bounds(p)
+            in_part = (ids >= start) & (ids < end)
+            local[in_part, column] = ids[in_part] - start + offset
+    return local
+
+
+def train_partitioned(args, corpus, model, store, CUDA, model_path):
+    print("partitioned training, {} partitions of {} entities".format(store.num_partitions, store.part_size))
+    device = torch.device('cuda' if CUDA else 'cpu')
+
+    dense_params = [param for name, param in model.named_parameters() if name != 'entity_embeddings']
+    optimizer = torch.optim.Adam(dense_params, lr=args.lr, weight_decay=args.weight_decay)
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=args.step_size, gamma=args.gamma, last_epoch=-1)
+
+    buckets = bucket_triples(corpus.train_indices, store)
+    print("{} non-empty buckets".format(len(buckets)))
+
+    # 两个分区槽位的预分配缓冲区(嵌入、一阶动量、二阶动量)，分区直接读入/写出槽位，不做拼接
+    part_size = store.part_size
+    buffers = [torch.zeros(2 * part_size, store.dim, device=device) for _ in range(3)]
+    # 由这里原地归一化，模型里的 do_normalize 会把 .data 换成新张量，脱离缓冲区
+    do_normalize, model.do_normalize = model.do_normalize, 0
+
+    def slot_rows(slot, p):
+        size = store.bounds(p)[1] - store.bounds(p)[0]
+        return [tensor[slot * part_size:slot * part_size + size] for tensor in buffers]
+
+    slot_of = {}
+    start_time = time.time()
+    for epoch in range(args.epochs):
+        print("\nepoch-> ", epoch)
+        model.train()
+        epoch_loss = []
+        for head_part, tail_part in bucket_order(buckets, store.num_partitions):
+            parts = [head_part] if head_part == tail_part else [head_part, tail_part]
+            # 换出不需要的分区，换入本桶的分区
+            for p in [p for p in slot_of if p not in parts]:
+                store.save(p, slot_rows(slot_of.pop(p), p))
+            for p in parts:
+                if p not in slot_of:
+                    slot_of[p] = min({0, 1} - set(slot_of.values()))
+                    store.load_into(p, slot_rows(slot_of[p], p))
+
+            # 局部实体表是缓冲区中本桶用到的那一段(的视图)，更新直接落在槽位里
+            first = min(slot_of.values())
+            last = max(slot_of[p] * part_size + store.bounds(p)[1] - store.bounds(p)[0] for p in parts)
+            table, exp_avg, exp_avg_sq = [tensor[first * part_size:last] for tensor in buffers]
+            entity_param = nn.Parameter(table)
+            model.entity_embeddings = entity_param
+            offsets = {p: (slot_of[p] - first) * part_size for p in parts}
+            step = max(store.steps[p] for p in parts)
+
+            triples = buckets[(head_part, tail_part)]
+            triples = triples[np.random.permutation(len(triples))]
+            for start in range(0, len(triples), args.batch_size):
+                positives = triples[start:start + args.batch_size]
+                batch_triples, batch_labels = sample_bucket_batch(corpus, store, positives, head_part, tail_part,
+                                                                  args.valid_invalid_ratio)
+                batch_triples = torch.LongTensor(to_local(batch_triples, store, offsets)).to(device)
+                batch_labels = torch.FloatTensor(batch_labels).to(device)
+
+                if do_normalize:
+                    F.normalize(entity_param.data, p=2, dim=1, out=entity_param.data)
+                pred_loss, batch_atten = model(batch_triples, batch_labels)
+                loss = pred_loss
+                if args.w1 != 0:
+                    sorted_att, _ = torch.sort(batch_atten, dim=-1, descending=True)
+                    loss = loss + args.w1 * torch.mean(1 - torch.sum(sorted_att[:, :args.top_n], 1))
+                if args.w2 != 0:
+                    loss = loss + args.w2 * run.cal_atten_loss(args, batch_atten, batch_triples,
+                                                               batch_labels.view(-1), 0, positives)
+
+                optimizer.zero_grad()
+                entity_param.grad = None
+                loss.backward()
+                optimizer.step()
+                step += 1
+                adam_update(entity_param, exp_avg, exp_avg_sq, step, optimizer.param_groups[0]['lr'],
+                            args.weight_decay)
+                epoch_loss.append(loss.detach())
+
+            for p in parts:
+                store.steps[p] = step
+
+        scheduler.step()
+        avg_loss = torch.stack(epoch_loss).mean().item() if epoch_loss else 0.0
+        print("Epoch {} , average loss {} , tot_time {}, learning rate {}".format(
+            epoch, avg_loss, (time.time() - start_time) / 60 / 60, optimizer.param_groups[0]['lr']))
+
+    for p in list(slot_of):
+        store.save(p, slot_rows(slot_of.pop(p), p))
+    store.save_meta()
+    model.do_normalize = do_normalize
+
+    dense_state = {name: value for name, value in model.state_dict().items() if name != 'entity_embeddings'}
+    torch.save(dense_state, os.path.join(model_path, "trained_dense.pth"))
+    print("dense weights saved, entity partitions in {}".format(store.folder))
+    return dense_state
+
+
+def main():
+    part_args, run_argv = parser.parse_known_args()
+    args = run.parser.parse_args(run_argv)
+    args.data_dir = os.path.join(args.data_dir, args.dataset)
+    args.output_dir = os.path.join(args.output_dir, args.dataset)
+    model_path = os.path.join(args.output_dir, "model")
+    os.makedirs(model_path, exist_ok=True)
+    partition_dir = part_args.partition_dir
+    if partition_dir == 'None':
+        partition_dir = os.path.join(args.output_dir, "partitions")
+
+    CUDA = torch.cuda.is_available()
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    print("args = ", args, part_args)
+
+    train_data, validation_data, test_data, link_data, entity2id, relation2id = build_data(
+        args.data_dir, streaming=args.stream_data, num_workers=args.load_workers)
+    corpus = Corpus(args, train_data, validation_data, test_data, link_data, entity2id, relation2id,
+                    args.batch_size, args.valid_invalid_ratio)
+
+    store = PartitionStore(partition_dir, len(entity2id), part_args.num_partitions)
+    if args.pretrained_emb:
+        entity_vectors = load_vectors(os.path.join(args.data_dir, 'entity2vec.txt'))
+        relation_embeddings = tile_vectors(load_vectors(os.path.join(args.data_dir, 'relation2vec.txt')),
+                                           args.embedding_size)
+        store.init(lambda start, end: tile_vectors(entity_vectors[start:end], args.embedding_size, args.k_factors))
+    else:
+        relation_embeddings = np.random.randn(len(relation2id), args.embedding_size)
+        store.init(lambda start, end: np.random.randn(end - start, args.embedding_size * args.k_factors))
+
+    # 先用一个很小的实体表构建模型，训练时每个桶替换成对应的局部实体表
+    model = run.build_model(args, torch.zeros(1, args.embedding_size * args.k_factors),
+                            torch.FloatTensor(relation_embeddings))
+    if CUDA:
+        model.cuda()
+
+    dense_state = train_partitioned(args, corpus, model, store, CUDA, model_path)
+    if part_args.assemble:
+        table_path = os.path.join(store.folder, 'full_table.npy')
+        dense_state['entity_embeddings'] = torch.from_numpy(store.full_table(table_path))
+        torch.save(dense_state, os.path.join(model_path, "trained_final.pth"))
+        os.remove(table_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,29 @@
 import os
+import gzip
+import multiprocessing
 import numpy as np
 
+from vocab import load_vocab
 
-def init_embeddings(entity_file, relation_file, k, emb_size):
-    entity_emb, relation_emb = [], []
+# 流式读取时每次读入的字节数
+STREAM_CHUNK_BYTES = 1 << 24
 
-    with open(entity_file) as f:
-        for line in f:
-            ent_vec = []
-            tmp = [float(val) for val in line.strip().split()]  # 一个实体的向量
-            emb_k = int(emb_size / len(tmp))
-            tot_k = int(emb_k * k)
-            for i in range(tot_k):
-                ent_vec += tmp
-            entity_emb.append(ent_vec)
-
-    with open(relation_file) as f:
-        for line in f:
-            rel_vec = []
-            tmp = [float(val) for val in line.strip().split()]
-            emb_k = int(emb_size / len(tmp))
-            for i in range(emb_k):
-                rel_vec += tmp
-            relation_emb.append(rel_vec)
-    return np.array(entity_emb, dtype=np.float32), np.array(relation_emb, dtype=np.float32)
+
+def load_vectors(filename):
+    # 每行一个预训练向量
+    with open(filename) as f:
+        return np.array([[float(val) for val in line.strip().split()] for line in f], dtype=np.float32)
+
+
+def tile_vectors(vectors, emb_size, k=1):
+    # 把预训练向量重复拼接到 emb_size * k 维
+    emb_k = int(emb_size / vectors.shape[1])
+    return np.tile(vectors, (1, emb_k * k))
+
+
+def init_embeddings(entity_file, relation_file, k, emb_size):
+    entity_vectors, relation_vectors = load_vectors(entity_file), load_vectors(relation_file)
+    return tile_vectors(entity_vectors, emb_size, k), tile_vectors(relation_vectors, emb_size)
 
 
 def load_entity(filename):
@@ -82,7 +82,172 @@ def load_data2(filename, entity2id, relation2id):
     return triples_data
 
 
-def build_data(path='./data/WN18RR/'):
+def _open_binary(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def _find_file(filename):
+    # 允许 train.txt 以 train.txt.gz 的形式存放
+    if not os.path.exists(filename) and os.path.exists(filename + '.gz'):
+        return filename + '.gz'
+    return filename
+
+
+def _iter_blocks(f, chunk_bytes, length=None):
+    # 按块读取，每块都在换行处截断，不完整的最后一行留给下一块
+    rest = b''
+    remaining = length
+    while True:
+        size = chunk_bytes if remaining is None else min(chunk_bytes, remaining)
+        data = f.read(size) if size > 0 else b''
+        if remaining is not None:
+            remaining -= len(data)
+        if not data:
+            if rest:
+                yield rest
+            return
+        data = rest + data
+        cut = data.rfind(b'\n') + 1
+        if cut == 0:
+            rest = data
+            continue
+        rest = data[cut:]
+        yield data[:cut]
+
+
+def _count_lines(filename, chunk_bytes=STREAM_CHUNK_BYTES, start=0, length=None):
+    with _open_binary(filename) as f:
+        f.seek(start)
+        return sum(block.count(b'\n') + (not block.endswith(b'\n'))
+                   for block in _iter_blocks(f, chunk_bytes, length))
+
+
+# bytes.split() 认为是空白的字节
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[[9, 10, 11, 12, 13, 32]] = True
+
+
+def _parse_block(block, entity_vocab, relation_vocab, allow_query):
+    """
+    块内按行取前三列(与 load_data 相同，多余的列如分数、时间戳忽略)，
+    直接在字节数组上找出每个字段的位置，再用 vocab.Vocab 批量映射为id，不构建字符串
+    """
+    data = np.frombuffer(block, dtype=np.uint8)
+    space = _WHITESPACE[data]
+    # 字段的起止位置：前一个字节是空白(或块首)的非空白字节 / 后一个字节是空白(或块尾)的非空白字节
+    boundary = np.ones(len(data) + 1, dtype=bool)
+    boundary[1:-1] = space[:-1] != space[1:]
+    edges = np.flatnonzero(boundary)
+    if len(data) and space[0]:
+        edges = edges[1:]
+    if len(edges) % 2:
+        edges = edges[:-1]
+    starts, ends = edges[0::2], edges[1::2]
+
+    # 每个字段所在的行，以及它是该行的第几个字段
+    line_of = np.searchsorted(np.flatnonzero(data == 10), starts)
+    counts = np.bincount(line_of)
+    field = np.arange(len(starts)) - np.repeat(np.cumsum(counts) - counts, counts)
+    short = np.flatnonzero((counts > 0) & (counts < 3))
+    if len(short):
+        line = bytes(block).split(b'\n')[short[0]]
+        raise ValueError("triple line with fewer than 3 columns: {}".format(line.decode('utf-8').strip()))
+    keep = field < 3
+    starts, lengths = starts[keep].reshape(-1, 3), (ends - starts)[keep].reshape(-1, 3)
+
+    block_triples = np.empty((len(starts), 3), dtype=np.int32)
+    for column, vocab in ((0, entity_vocab), (1, relation_vocab), (2, entity_vocab)):
+        block_triples[:, column] = _lookup_ids(vocab, data, starts[:, column], lengths[:, column],
+                                               allow_query and column != 1)
+    return block_triples
+
+
+def _lookup_ids(vocab, data, starts, lengths, allow_query):
+    # allow_query 时 "?" 映射为 -1，其余不存在的名字与 load_data 一样报 KeyError
+    ids = vocab.lookup_spans(data, starts, lengths)
+    missing = ids < 0
+    if allow_query:
+        missing &= ~((lengths == 1) & (data[starts] == ord('?')))
+    if missing.any():
+        i = int(np.flatnonzero(missing)[0])
+        raise KeyError(bytes(data[starts[i]:starts[i] + lengths[i]]).decode('utf-8'))
+    return ids
+
+
+def _load_range(filename, entity_vocab, relation_vocab, allow_query, chunk_bytes, start=0, length=None):
+    # 先数行数，预分配int32数组，再逐块填充
+    triples = np.empty((_count_lines(filename, chunk_bytes, start, length), 3), dtype=np.int32)
+    filled = 0
+    with _open_binary(filename) as f:
+        f.seek(start)
+        for block in _iter_blocks(f, chunk_bytes, length):
+            block_triples = _parse_block(block, entity_vocab, relation_vocab, allow_query)
+            triples[filled:filled + len(block_triples)] = block_triples
+            filled += len(block_triples)
+    return triples[:filled]
+
+
+# fork出来的子进程直接继承这里的词表，不需要pickle传递
+_worker_vocab = {}
+
+
+def _load_range_worker(task):
+    filename, start, end, allow_query, chunk_bytes = task
+    return _load_range(filename, _worker_vocab['entity'], _worker_vocab['relation'],
+                       allow_query, chunk_bytes, start, end - start)
+
+
+def _split_offsets(filename, num_parts):
+    size = os.path.getsize(filename)
+    offsets = [0]
+    with open(filename, 'rb') as f:
+        for i in range(1, num_parts):
+            f.seek(max(size * i // num_parts, offsets[-1]))
+            f.readline()
+            offsets.append(min(f.tell(), size))
+    offsets.append(size)
+    return offsets
+
+
+def load_data_stream(filename, entity_vocab, relation_vocab, allow_query=False, num_workers=1,
+                     chunk_bytes=STREAM_CHUNK_BYTES):
+    '''
+    load_data / load_data2 的流式版本，返回 [n, 3] 的int32数组
+    entity_vocab / relation_vocab : vocab.Vocab，名字按块批量映射为id
+    filename 可以是gzip压缩文件(.gz)；num_workers > 1 时把未压缩的大文件按字节切分给多个进程解析
+    allow_query : 为True时 "?" 映射为 -1 (link_prediction 文件)
+    '''
+    filename = _find_file(filename)
+    if num_workers <= 1 or filename.endswith('.gz') or os.path.getsize(filename) < 2 * chunk_bytes:
+        return _load_range(filename, entity_vocab, relation_vocab, allow_query, chunk_bytes)
+
+    offsets = _split_offsets(filename, num_workers)
+    tasks = [(filename, offsets[i], offsets[i + 1], allow_query, chunk_bytes)
+             for i in range(num_workers) if offsets[i + 1] > offsets[i]]
+
+    _worker_vocab['entity'], _worker_vocab['relation'] = entity_vocab, relation_vocab
+    try:
+        with multiprocessing.get_context('fork').Pool(len(tasks)) as pool:
+            parts = pool.map(_load_range_worker, tasks)
+    finally:
+        _worker_vocab.clear()
+    return np.concatenate(parts, axis=0)
+
+
+def build_data(path='./data/WN18RR/', streaming=False, num_workers=1):
+    if streaming:
+        # 词表用 vocab.Vocab(缓存在 <path>/cache/ 下并mmap加载)代替字典，返回int32数组而不是tuple列表
+        entity_vocab = load_vocab(os.path.join(path, 'entity2id.txt'))
+        relation_vocab = load_vocab(os.path.join(path, 'relation2id.txt'))
+        train_triples, validation_triples, test_triples = [
+            load_data_stream(os.path.join(path, name), entity_vocab, relation_vocab, num_workers=num_workers)
+            for name in ('train.txt', 'valid.txt', 'test.txt')]
+        link_triples = load_data_stream(os.path.join(path, 'link_prediction1.txt'), entity_vocab, relation_vocab,
+                                        allow_query=True, num_workers=num_workers)
+        return train_triples, validation_triples, test_triples, link_triples, entity_vocab, relation_vocab
+
     entity2id = load_entity(os.path.join(path, 'entity2id.txt'))
     relation2id = load_relation(os.path.join(path, 'relation2id.txt'))
 
@@ -7,8 +7,12 @@ import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 
-from process_data import init_embeddings, build_data
-from dataloader import Corpus
+from process_data import build_data, load_vectors, tile_vectors
+from dataloader import Corpus, NegativeShards
+from inference import ScriptedScorer, build_scorer, export_scorer, load_scorer
+from embedding_store import EntityStore
+from candidates import CandidateIndex
+from link_cache import LinkCache, model_fingerprint
 
 import random
 import argparse
@@ -59,18 +63,58 @@ parser.add_argument("--w2", type=float, default=0.1, help="loss_3 wight, attenti
 parser.add_argument("--top_n", type=int, default=2, help="top_n")
 parser.add_argument("--margin", type=float, default=5, help="Margin used in hinge loss")
 parser.add_argument("--test", action='store_true')
-
-args = parser.parse_args()
-
-
-def save_model(model, name, folder_name):
+parser.add_argument("--neg_mode", default="per_positive", choices=["per_positive", "shared_pool"],
+                    help="shared_pool: one pool of corrupting entities per batch (TransE / DisenE_Trans only)")
+parser.add_argument("--pool_size", type=int, default=256, help="entities in the shared negative pool")
+parser.add_argument("--export_scripted", default="None", help="save a frozen TorchScript scorer to this path")
+parser.add_argument("--script_method", default="script", choices=["script", "trace"])
+parser.add_argument("--scripted", default="None", help="evaluate with a TorchScript scorer from --export_scripted")
+parser.add_argument("--quantize", default="none", choices=["none", "row", "factor"],
+                    help="score with an int8 entity table (per-row or per-factor scales)")
+parser.add_argument("--eval_memory_mb", type=float, default=1024,
+                    help="memory budget per evaluation process, used to size the candidate chunks")
+parser.add_argument("--eval_workers", type=int, default=0, help="processes for CPU evaluation / link prediction")
+parser.add_argument("--stream_data", type=int, default=0, help="chunked loader, supports *.txt.gz")
+parser.add_argument("--load_workers", type=int, default=1, help="processes used by the chunked loader")
+parser.add_argument("--entity_store", default="None",
+                    help="keep the entity table and its Adam state in memory-mapped files in this folder")
+parser.add_argument("--cache_rows", type=int, default=100000, help="entity rows cached in memory for --entity_store")
+parser.add_argument("--cache_policy", default="lru", choices=["lru", "lfu"])
+parser.add_argument("--fused_forward", type=int, default=0,
+                    help="DisenE forward without the [b_s, k, emb_s * 3] concatenation")
+parser.add_argument("--debug", type=int, default=0, help="print debug tensors every step")
+parser.add_argument("--neg_shards", default="None",
+                    help="folder written by neg_shards.py: replay its batches instead of sampling negatives")
+parser.add_argument("--link_cache_dir", default="None",
+                    help="cache link prediction top-k results on disk, keyed by the model's hash")
+parser.add_argument("--link_cache_size", type=int, default=1000000, help="max cached queries (LRU)")
+parser.add_argument("--factored_rank", type=int, default=0,
+                    help="DisenE/DisenE_Trans: entity = base vector + rank-r per-factor offset, 0 for the full table")
+parser.add_argument("--grad_checkpoint", default="none", choices=("none", "block", "factor"),
+                    help="DisenE training: recompute attention/conv activations in backward instead of storing them")
+parser.add_argument("--prune_factors", type=int, default=0,
+                    help="DisenE inference: run the conv branch only for the top-n attention factors, 0 for all")
+parser.add_argument("--prune_mass", type=float, default=0.0,
+                    help="DisenE inference: keep the fewest factors whose attention reaches this mass, 0 to disable")
+parser.add_argument("--candidate_index", type=int, default=0,
+                    help="evaluation / link prediction only score entities seen with the relation in training")
+parser.add_argument("--candidate_widen", type=float, default=0.0,
+                    help="also take the candidates of relations whose entity sets have Jaccard >= this")
+parser.add_argument("--log_every", type=int, default=50, help="iterations between loss logs")
+
+def save_model(model, name, folder_name, store=None):
     print("Saving Model")
-    torch.save(model.state_dict(),
+    state_dict = model.state_dict()
+    if store is not None:
+        # 实体表保存在 --entity_store 中，这里只保存其余参数
+        store.flush()
+        state_dict = {key: value for key, value in state_dict.items() if key != 'entity_embeddings'}
+    torch.save(state_dict,
                (os.path.join(folder_name, "trained_" + name + ".pth")))
     print("Done saving Model")
 
 
-def main():
+def main(args):
     args.data_dir = os.path.join(args.data_dir, args.dataset)
     args.output_dir = os.path.join(args.output_dir, args.dataset)
 
@@ -87,30 +131,23 @@ def main():
     torch.cuda.manual_seed(args.seed)
     print("args = ", args)
 
-    train_data, validation_data, test_data, link_data, entity2id, relation2id = build_data(args.data_dir)
+    train_data, validation_data, test_data, link_data, entity2id, relation2id = build_data(
+        args.data_dir, streaming=args.stream_data, num_workers=args.load_workers)
 
-    if args.pretrained_emb:
-        # 从预训练向量中加载实体和关系表示
-        # 实体: 600维  关系: 100维
-        entity_embeddings, relation_embeddings = init_embeddings(os.path.join(args.data_dir, 'entity2vec.txt'),
-                                                                 os.path.join(args.data_dir, 'relation2vec.txt'),
-                                                                 args.k_factors, args.embedding_size)
+    if args.factored_rank and (args.entity_store != 'None' or args.model_name not in ('DisenE', 'DisenE_Trans')):
+        raise ValueError("--factored_rank is only supported for DisenE / DisenE_Trans with an in-memory table")
 
-        print("Initialised relations and entities from TransE")
+    if args.scripted != 'None' and (args.prune_factors or args.prune_mass):
+        raise ValueError("factor pruning is fixed when the scorer is exported, "
+                         "pass --prune_factors / --prune_mass together with --export_scripted")
 
+    store = None
+    if args.entity_store != 'None':
+        store, relation_embeddings = init_entity_store(args, entity2id, relation2id, CUDA)
+        # 占位，训练时每个批次换成缓存中用到的行
+        entity_embeddings = torch.zeros(1, store.dim)
     else:
-        # 随机初始化实体和关系的嵌入
-        # 实体： [len(entity2id.txt), 100*6个部分]
-        # 关系： [len(relation2id.txt), 100]
-        entity_embeddings = np.random.randn(
-            len(entity2id), args.embedding_size * args.k_factors)
-        relation_embeddings = np.random.randn(
-            len(relation2id), args.embedding_size)
-        print("Initialised relations and entities randomly")
-
-    # 转为tensor
-    entity_embeddings = torch.FloatTensor(entity_embeddings)
-    relation_embeddings = torch.FloatTensor(relation_embeddings)
+        entity_embeddings, relation_embeddings = init_model_embeddings(args, entity2id, relation2id)
     # entity:[74085, 600]   relation:[14, 100]
     print("Initial entity dimensions {} , relation dimensions {}".format(entity_embeddings.size(),
                                                                          relation_embeddings.size()))
@@ -133,6 +170,108 @@ def main():
     if not os.path.exists(model_path):
         os.makedirs(model_path)
 
+    model = build_model(args, entity_embeddings, relation_embeddings)
+
+    if args.neg_mode == 'shared_pool' and args.model_name not in ('TransE', 'DisenE_Trans'):
+        raise ValueError("--neg_mode=shared_pool is only supported for TransE and DisenE_Trans")
+
+    shards = None
+    if args.neg_shards != 'None':
+        if args.neg_mode == 'shared_pool':
+            raise ValueError("--neg_shards replays per-positive negatives, "
+                             "it can't be used with --neg_mode=shared_pool")
+        # 训练三元组此时还是数据文件中的顺序，与生成时一致
+        shards = NegativeShards(args.neg_shards, train_loader.train_indices, args.batch_size,
+                                args.valid_invalid_ratio, train_loader.num_entities)
+        print("replaying {} epochs of negatives from {}".format(shards.meta['epochs'], args.neg_shards))
+
+    if args.load != 'None':
+        state_dict = torch.load(args.load)
+        if store is not None and 'entity_embeddings' in state_dict:
+            # 完整的checkpoint：实体表以 --entity_store 中的为准，忽略checkpoint中的
+            del state_dict['entity_embeddings']
+            print("entity table in {} ignored, using {}".format(args.load, args.entity_store))
+        model.load_state_dict(state_dict, strict=store is None)
+        print("model loaded")
+
+    # 只评估且多进程评估时在CPU上进行，不必先搬到GPU
+    if CUDA and not (args.evaluate and args.eval_workers > 1):
+        print("using CUDA")
+        model.cuda()
+
+    best_epoch = 0
+    if args.evaluate == 0:
+        # 开始训练
+        best_epoch = train(args, train_loader, model, CUDA, model_path, store=store, shards=shards)
+
+    if store is not None:
+        store.attach(model, normalize=args.do_normalize and args.model_name in ('ConvKB', 'DisenE'))
+
+    if args.export_scripted != 'None':
+        export_scorer(model, args.model_name, args.export_scripted, args.script_method, args.quantize)
+        print("scripted scorer saved to {}".format(args.export_scripted))
+    if args.evaluate:
+        # 测试集上的过滤指标写到 output_file，再对 link_prediction1.txt 中的查询做链接预测
+        evaluate(args, model, model_path, train_loader, output_file, best_epoch=best_epoch, best_or_final='final')
+        if len(train_loader.link_indices):
+            Disen_evaluate(args, model, train_loader)
+
+
+def init_model_embeddings(args, entity2id, relation2id, vectors=None):
+    '''
+    vectors : 已经读入的 (entity2vec, relation2vec)，sweep.py 中多个试验共享同一份
+    '''
+    if args.pretrained_emb:
+        # 从预训练向量中加载实体和关系表示
+        # 实体: 600维  关系: 100维
+        if vectors is None:
+            vectors = (load_vectors(os.path.join(args.data_dir, 'entity2vec.txt')),
+                       load_vectors(os.path.join(args.data_dir, 'relation2vec.txt')))
+        entity_embeddings = tile_vectors(vectors[0], args.embedding_size, args.k_factors)
+        relation_embeddings = tile_vectors(vectors[1], args.embedding_size)
+
+        print("Initialised relations and entities from TransE")
+
+    else:
+        # 随机初始化实体和关系的嵌入
+        # 实体： [len(entity2id.txt), 100*6个部分]
+        # 关系： [len(relation2id.txt), 100]
+        entity_embeddings = np.random.randn(
+            len(entity2id), args.embedding_size * args.k_factors)
+        relation_embeddings = np.random.randn(
+            len(relation2id), args.embedding_size)
+        print("Initialised relations and entities randomly")
+
+    # 转为tensor
+    return torch.FloatTensor(entity_embeddings), torch.FloatTensor(relation_embeddings)
+
+
+def init_entity_store(args, entity2id, relation2id, CUDA=False):
+    '''
+    --entity_store 不存在时按块生成初始实体嵌入写入文件，返回 (EntityStore, 关系嵌入)
+    '''
+    dim = args.embedding_size * args.k_factors
+    if args.pretrained_emb:
+        entity_vectors = load_vectors(os.path.join(args.data_dir, 'entity2vec.txt'))
+        relation_embeddings = tile_vectors(load_vectors(os.path.join(args.data_dir, 'relation2vec.txt')),
+                                           args.embedding_size)
+
+        def make_rows(start, end):
+            return tile_vectors(entity_vectors[start:end], args.embedding_size, args.k_factors)
+    else:
+        relation_embeddings = np.random.randn(len(relation2id), args.embedding_size)
+
+        def make_rows(start, end):
+            return np.random.randn(end - start, dim)
+
+    if not EntityStore.exists(args.entity_store):
+        EntityStore.create(args.entity_store, len(entity2id), dim, make_rows)
+    store = EntityStore(args.entity_store, args.cache_rows, args.cache_policy, 'cuda' if CUDA else 'cpu')
+    print("entity store {}: {} rows, caching {}".format(args.entity_store, store.num_rows, store.cache_rows))
+    return store, torch.FloatTensor(relation_embeddings)
+
+
+def build_model(args, entity_embeddings, relation_embeddings):
     if args.model_name == 'ConvKB':
         model = ConvKB(entity_embeddings, relation_embeddings, config=args)
     elif args.model_name == 'TransE':
@@ -143,90 +282,117 @@ def main():
         model = DisenE_Trans(entity_embeddings, relation_embeddings, config=args)
 
     else:
-        print("no such model name")
-
-    if args.load != 'None':
-        model.load_state_dict(torch.load(args.load))
-        print("model loaded")
+        raise ValueError("no such model name: {}".format(args.model_name))
+    return model
 
-    if CUDA:
-        print("using CUDA")
-        model.cuda()
 
-    best_epoch = 0
-    if args.evaluate == 0:
-        # 开始训练
-        best_epoch = train(args, train_loader, model, CUDA, model_path)
-    # evaluate(args, model, model_path, train_loader, output_file, best_epoch=best_epoch, best_or_final='best')
-    # evaluate(args, model, model_path, train_loader, output_file, best_epoch=best_epoch, best_or_final='final')
-    # model.load_state_dict(torch.load("trained_best.pth"))
-    # model.cuda()
-    # evaluate(args, model, model_path, train_loader, output_file, best_epoch=0, best_or_final='best')
+def use_candidate_index(args, train_loader, triples=None):
+    # evaluate 之后再做链接预测时沿用已经建好的索引
+    if not args.candidate_index or train_loader.candidate_index is not None:
+        return
+    train_loader.candidate_index = CandidateIndex.from_triples(
+        train_loader.train_indices, train_loader.num_entities, train_loader.num_relations, args.candidate_widen)
+    train_loader.candidate_index.report(triples)
 
-    # Disen_evaluate(args, model, train_loader)
 
 def Disen_evaluate(args, model, train_loader):
     print("开始链接预测---->")
+    use_candidate_index(args, train_loader)
+    if args.eval_workers > 1:
+        # 多进程评估在CPU上进行，训练后模型可能还在GPU上
+        model.cpu()
+    if args.scripted != 'None':
+        model = load_scorer(args.scripted, torch.device('cpu') if args.eval_workers > 1 else None)
+    elif args.quantize != 'none':
+        model = ScriptedScorer(build_scorer(model, args.model_name, args.quantize), model.entity_embeddings.device)
     model.eval()
-    result = []
+    if args.link_cache_dir != 'None':
+        settings = (args.model_name, args.quantize, args.candidate_index, args.candidate_widen,
+                    args.prune_factors, args.prune_mass)
+        train_loader.link_cache = LinkCache(args.link_cache_dir, model_fingerprint(model, settings),
+                                            args.link_cache_size)
 
     with torch.no_grad():
         sort_list = train_loader.get_validation_pred2(args, model)
         print("---->链接预测结束")
-        sort_list = np.array(sort_list)
+        write_link_results(train_loader, sort_list)
+
+
+def write_link_results(train_loader, sort_list, filename="result.json"):
+    result = []
+    sort_list = np.array(sort_list)
 
-        for realSort in sort_list:
-            li_res = []
-            for num in realSort:
-                li_res.append(train_loader.id2entity[num])
-            result.append(li_res)
+    # 用 Corpus 已有的词表把id映射回实体名
+    names = train_loader.entity_names(sort_list.reshape(-1))
+    topk = sort_list.shape[1] if sort_list.ndim == 2 else 0
+    for i in range(len(sort_list)):
+        result.append(names[i * topk:(i + 1) * topk])
 
-        output = dict()
+    output = dict()
 
-        output["results"] = result
+    output["results"] = result
 
-        with open("result.json", 'w') as f:
-            json.dump(output, f)
+    with open(filename, 'w') as f:
+        json.dump(output, f)
 
 
 
-def cal_atten_loss(batch_atten, batch_triples, batch_labels, iter_num, train_indices):
-    att_loss = torch.zeros(1).cuda()  # loss初始值为0
-    sample_num = args.sample_num  # 对应同样关系的sample_num个三元组 50
+def cal_atten_loss(args, batch_atten, batch_triples, batch_labels, iter_num, train_indices):
+    '''
+    batch_triples / batch_labels 可以是numpy数组(主机上的副本)，配对在主机上完成，不需要逐个元素同步
+    '''
+    att_loss = torch.zeros(1, device=batch_atten.device)  # loss初始值为0
+    batch_triples = _to_numpy(batch_triples)
+    batch_labels = _to_numpy(batch_labels).reshape(-1)
+    sample_num = min(args.sample_num, batch_triples.shape[0])  # 对应同样关系的sample_num个三元组 50
     tmp_size = args.batch_size  # 128
     if (iter_num + 1) * args.batch_size > len(train_indices):
         # 最后一个批次的三元组个数
         last_iter_size = len(train_indices) - args.batch_size * iter_num
         tmp_size = last_iter_size
 
-    cnt = 0
-    for i in range(tmp_size):
-        rel = batch_triples[i, 1]
-        att = batch_atten[i, :]
-        # False表示不可以取相同元素
-        random_idx = (np.random.choice(batch_triples.shape[0], sample_num, replace=False)).tolist()
-
-        for idx in random_idx:
-            # 关系相同并且是正样本
-            if rel == batch_triples[idx, 1] and batch_labels[idx] == 1:
-                tmp_att = batch_atten[idx, :]
-                # print("att, tmp", att, tmp_att, att_loss)
-                att_loss += torch.dist(att, tmp_att, p=2)
-                # print("dist", att_loss)
-                cnt += 1
+    # 每个三元组各抽一次样，与逐个抽样的随机数序列相同；False表示不可以取相同元素
+    random_idx = np.array([np.random.choice(batch_triples.shape[0], sample_num, replace=False)
+                           for _ in range(tmp_size)]).reshape(tmp_size, sample_num)
+    rels = batch_triples[:, 1]
+    # 关系相同并且是正样本
+    match = (rels[random_idx] == rels[:tmp_size, None]) & (batch_labels[random_idx] == 1)
+    anchor, pos = np.nonzero(match)
+    cnt = len(anchor)
 
     if cnt == 0:
         return att_loss
+    anchor = torch.from_numpy(anchor).to(batch_atten.device)
+    other = torch.from_numpy(random_idx[match]).to(batch_atten.device)
+    att_loss = att_loss + torch.norm(batch_atten[anchor] - batch_atten[other], p=2, dim=1).sum()
     return att_loss / cnt
 
 
-def train(args, train_loader, model, CUDA, model_path):
+def _to_numpy(x):
+    if isinstance(x, torch.Tensor):
+        return x.detach().cpu().numpy()
+    return np.asarray(x)
+
+
+def train(args, train_loader, model, CUDA, model_path, optimizer=None, scheduler=None, start_epoch=0, store=None,
+          shards=None):
+    '''
+    optimizer / scheduler / start_epoch : 从中间状态继续训练(sweep.py)，默认重新创建
+    store : EntityStore，实体表由它按批次换入换出并单独更新，optimizer 只负责其余参数
+    shards : dataloader.NegativeShards，批次(正样本顺序和负样本)从预先生成的文件中读取
+    '''
     print("model training")
 
-    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    if optimizer is None:
+        params = model.parameters()
+        if store is not None:
+            params = [param for name, param in model.named_parameters() if name != 'entity_embeddings']
+        optimizer = torch.optim.Adam(params, lr=args.lr, weight_decay=args.weight_decay)
 
-    # 调整学习率
-    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=args.step_size, gamma=args.gamma, last_epoch=-1)
+    if scheduler is None:
+        # 调整学习率
+        scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=args.step_size, gamma=args.gamma,
+                                                    last_epoch=-1)
 
     epoch_losses = []  # losses of all epochs
     print("Number of epochs {}".format(args.epochs))  # 800
@@ -234,13 +400,20 @@ def train(args, train_loader, model, CUDA, model_path):
     min_loss = 10000.0
     best_epoch = 0
     start_time = time.time()
-    for epoch in range(args.epochs):
+    for epoch in range(start_epoch, args.epochs):
         print("\nepoch-> ", epoch)
-        random.shuffle(train_loader.train_triples)
-        train_loader.train_indices = np.array(list(train_loader.train_triples)).astype(np.int32)
+        if shards is not None:
+            train_loader.train_indices = shards.start_epoch(epoch)
+        elif isinstance(train_loader.train_triples, np.ndarray):
+            np.random.shuffle(train_loader.train_triples)
+            train_loader.train_indices = train_loader.train_triples.astype(np.int32)
+        else:
+            random.shuffle(train_loader.train_triples)
+            train_loader.train_indices = np.array(list(train_loader.train_triples)).astype(np.int32)
 
         model.train()  # getting in training mode  启用batch normalization和drop out
-        epoch_loss = []  # losses of per epoch
+        # 每个epoch的loss在设备上累加，只在打印时读回主机，避免每次迭代都同步
+        epoch_loss_sum = 0.0
 
         if len(train_loader.train_indices) % args.batch_size == 0:
             num_iters_per_epoch = len(
@@ -252,9 +425,25 @@ def train(args, train_loader, model, CUDA, model_path):
 
         for iters in range(num_iters_per_epoch):
             start_time_iter = time.time()
-            # 得到正样本和负样本的三元组以及标签(正样本1 负样本-1)
-            batch_triples, batch_labels = train_loader.get_iteration_batch(iters)
-
+            if args.neg_mode == 'shared_pool':
+                # 只有正样本，负样本是整个批次共用的实体池
+                batch_triples, batch_pool, batch_pool_mask = train_loader.get_pool_batch(iters, args.pool_size)
+                batch_labels = np.ones((len(batch_triples), 1), dtype=np.float32)
+            elif shards is not None:
+                batch_triples, batch_labels = shards.get_batch(iters)
+            else:
+                # 得到正样本和负样本的三元组以及标签(正样本1 负样本-1)
+                batch_triples, batch_labels = train_loader.get_iteration_batch(iters)
+
+            if store is not None:
+                # 全局实体id -> 缓存换入的局部行号
+                if args.neg_mode == 'shared_pool':
+                    batch_triples, batch_pool = store.swap_in(model, batch_triples, batch_pool)
+                else:
+                    batch_triples, = store.swap_in(model, batch_triples)
+
+            # 主机上的副本，cal_atten_loss 用它配对
+            host_triples, host_labels = batch_triples, batch_labels
             if CUDA:
                 batch_triples = Variable(torch.LongTensor(batch_triples)).cuda()
                 batch_labels = Variable(torch.FloatTensor(batch_labels)).cuda()
@@ -264,7 +453,12 @@ def train(args, train_loader, model, CUDA, model_path):
                 batch_labels = Variable(torch.FloatTensor(batch_labels))
 
             # forward
-            pred_loss, batch_atten = model(batch_triples, batch_labels)
+            if args.neg_mode == 'shared_pool':
+                batch_pool = torch.LongTensor(batch_pool).to(batch_triples.device)
+                batch_pool_mask = torch.from_numpy(batch_pool_mask).to(batch_triples.device)
+                pred_loss, batch_atten = model.forward_pool(batch_triples, batch_pool, batch_pool_mask)
+            else:
+                pred_loss, batch_atten = model(batch_triples, batch_labels)
 
             optimizer.zero_grad()
 
@@ -276,50 +470,56 @@ def train(args, train_loader, model, CUDA, model_path):
                 sorted_att, sorted_indices_in = torch.sort(batch_atten, dim=-1, descending=True)
                 top_att = sorted_att[:, :args.top_n]
                 top_num_att = torch.sum(top_att, 1)
-                y2 = torch.ones(int(batch_triples.size(0))).cuda()
+                y2 = torch.ones(int(batch_triples.size(0)), device=batch_atten.device)
                 # 计算loss2
                 top_att_loss = torch.mean(y2 - top_num_att)
                 loss = loss + args.w1 * top_att_loss
-                top_att_loss_data = top_att_loss.data.item()
+                top_att_loss_data = top_att_loss.detach()
             # 计算的是论文中的L1
             if args.w2 != 0:
-                att_loss = cal_atten_loss(batch_atten, batch_triples, batch_labels.view(-1), iters,
+                att_loss = cal_atten_loss(args, batch_atten, host_triples, host_labels, iters,
                                           train_loader.train_indices)
                 loss = loss + args.w2 * att_loss
-                att_loss_data = att_loss.data.item()
+                att_loss_data = att_loss.detach()
 
             end_time_iter = time.time()
 
             loss.backward()
             optimizer.step()
+            if store is not None:
+                store.step(model, optimizer.param_groups[0]['lr'], args.weight_decay)
 
-            epoch_loss.append(loss.data.item())
+            epoch_loss_sum = epoch_loss_sum + loss.detach()
 
-            if iters % 50 == 0:
+            if iters % args.log_every == 0:
                 print("Iteration-> {0}  , Iteration_time-> {1:.4f} , Iteration_loss {2:.6f}, Pred_loss {3:.6f}, "
                       "Top_atten_loss {4:.6f}, Atten_diss_loss {5:.6f}".format(
-                    iters, end_time_iter - start_time_iter, loss.data.item(), pred_loss.data.item(), top_att_loss_data,
-                    att_loss_data))
+                    iters, end_time_iter - start_time_iter, loss.item(), pred_loss.item(), float(top_att_loss_data),
+                    float(att_loss_data)))
 
         scheduler.step()
         cur_lr = optimizer.param_groups[0]['lr']
-        avg_loss = sum(epoch_loss) / len(epoch_loss)
+        avg_loss = float(epoch_loss_sum) / num_iters_per_epoch
         print("Epoch {} , average loss {} , tot_time {}, learning rate {}".format(
             epoch, avg_loss, (time.time() - start_time) / 60 / 60, cur_lr))
+        if store is not None:
+            print("entity cache hit rate {:.4f}".format(store.hit_rate()))
+            store.reset_stats()
         epoch_losses.append(avg_loss)
 
         if avg_loss < min_loss:
             min_loss = avg_loss
             best_epoch = epoch
-            save_model(model, "best", model_path)
+            save_model(model, "best", model_path, store)
 
-    save_model(model, "final", model_path)
+    save_model(model, "final", model_path, store)
 
     return best_epoch
 
 
 def evaluate(args, model, model_path, train_loader, output_file, best_epoch=0, best_or_final='best'):
     print("model evaluating")
+    use_candidate_index(args, train_loader, train_loader.test_indices)
     # if best_epoch != 0:
     #     print("best_epoch", best_epoch)
     # if args.ckpt != 'None':
@@ -328,11 +528,23 @@ def evaluate(args, model, model_path, train_loader, output_file, best_epoch=0, b
     # print("ckpt_path:", ckpt_path)
     # model.load_state_dict(torch.load(ckpt_path))
     # print("model loaded")
-
-    model.cuda()
-    model.eval()
-    if args.model_name == 'DisenE_Trans' or args.model_name == 'TransE':
-        model = model.test
+    if args.eval_workers > 1:
+        # 多进程评估在CPU上进行，训练后模型可能还在GPU上
+        model.cpu()
+
+    if args.scripted != 'None':
+        model = load_scorer(args.scripted, torch.device('cpu') if args.eval_workers > 1 else None)
+    elif args.quantize != 'none':
+        if args.eval_workers <= 1 and torch.cuda.is_available():
+            model.cuda()
+        model = ScriptedScorer(build_scorer(model, args.model_name, args.quantize), model.entity_embeddings.device)
+    else:
+        # 多进程评估在CPU上进行
+        if args.eval_workers <= 1 and torch.cuda.is_available():
+            model.cuda()
+        model.eval()
+        if args.model_name == 'DisenE_Trans' or args.model_name == 'TransE':
+            model = model.test
     with torch.no_grad():
         MRR, MR, H1, H3, H10 = train_loader.get_validation_pred(args, model)
 
@@ -348,4 +560,4 @@ def evaluate(args, model, model_path, train_loader, output_file, best_epoch=0, b
 
 
 if __name__ == '__main__':
-    main()
+    main(parser.parse_args())
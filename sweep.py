@@ -0,0 +1,249 @@
+import torch
+import numpy as np
+
+import argparse
+import contextlib
+import copy
+import itertools
+import math
+import multiprocessing
+import os
+import random
+import time
+
+import run
+from dataloader import Corpus
+from process_data import build_data, load_vectors
+
+# 超参数搜索：数据只读入一次，fork出的试验进程共享；按successive halving逐轮淘汰较差的试验
+# python -u sweep.py --grid="k_factors=4,6;w1=0.05,0.1;margin=3,5" --rung_epochs=5 --max_epochs=45 --dataset=FB15k-237 --model_name=DisenE_Trans
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--grid", required=True, help='e.g. "k_factors=4,6;w1=0.05,0.1"')
+parser.add_argument("--sweep_dir", default="./sweeps/")
+parser.add_argument("--rung_epochs", type=int, default=5, help="epochs every trial gets in the first rung")
+parser.add_argument("--max_epochs", type=int, default=45)
+parser.add_argument("--eta", type=int, default=3, help="keep 1/eta of the trials after each rung")
+parser.add_argument("--eval_triples", type=int, default=500, help="validation triples used to rank trials")
+parser.add_argument("--max_parallel", type=int, default=0, help="0: decided by cores and memory")
+parser.add_argument("--threads_per_trial", type=int, default=2)
+parser.add_argument("--memory_mb", type=float, default=0, help="memory available to trials, 0: read from the OS")
+
+# fork出的子进程直接继承：Corpus、预训练向量、验证三元组
+_sweep_state = {}
+
+
+def cast_value(key, value, default):
+    # 按默认值的类型转换；bool("False") 为 True，布尔值单独解析
+    value = value.strip()
+    if isinstance(default, bool):
+        if value.lower() in ('1', 'true', 'yes'):
+            return True
+        if value.lower() in ('0', 'false', 'no'):
+            return False
+        raise ValueError("--grid value for {} must be true/false, got {}".format(key, value))
+    return type(default)(value)
+
+
+def parse_grid(grid, base_args):
+    keys, values = [], []
+    for item in grid.split(';'):
+        if not item.strip():
+            continue
+        key, vals = item.split('=')
+        key = key.strip()
+        if not hasattr(base_args, key):
+            raise ValueError("unknown hyperparameter in --grid: {}".format(key))
+        keys.append(key)
+        values.append([cast_value(key, v, getattr(base_args, key)) for v in vals.split(',')])
+
+    trials = []
+    for combination in itertools.product(*values):
+        trial_args = copy.deepcopy(base_args)
+        for key, value in zip(keys, combination):
+            setattr(trial_args, key, value)
+        trials.append((dict(zip(keys, combination)), trial_args))
+    return keys, trials
+
+
+def estimate_trial_mb(trial_args, num_entities, num_relations):
+    K, D = trial_args.k_factors, trial_args.embedding_size
+    # 参数、梯度、Adam的两个动量
+    param_floats = 4 * (num_entities * K * D + num_relations * D)
+    batch = trial_args.batch_size * (trial_args.valid_invalid_ratio + 1)
+    per_triple = 8 * K * D
+    if trial_args.model_name == 'DisenE':
+        per_triple += 3 * trial_args.out_channels * K * D
+    elif trial_args.model_name == 'ConvKB':
+        per_triple = 9 * D + 2 * trial_args.out_channels * D
+    # 再加上每个进程的python/torch固定开销
+    return 4 * (param_floats + batch * per_triple) / 2 ** 20 + 300
+
+
+def available_memory_mb():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float('inf')
+
+
+def trial_seed(seed, trial_id):
+    # 每个试验一个由 (seed, trial_id) 导出的种子
+    return int(np.random.SeedSequence([seed, trial_id]).generate_state(1)[0])
+
+
+def get_rng_state():
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    # 存成列表，torch.load(weights_only) 可以直接读回
+    return {'random': random.getstate(), 'numpy': (name, keys.tolist(), pos, has_gauss, cached_gaussian),
+            'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else []}
+
+
+def set_rng_state(state):
+    random.setstate(state['random'])
+    name, keys, pos, has_gauss, cached_gaussian = state['numpy']
+    np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+    torch.set_rng_state(state['torch'])
+    if state['cuda']:
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def run_trial(task):
+    trial_id, trial_args, epochs = task
+    state = _sweep_state
+    torch.set_num_threads(state['threads'])
+    trial_dir = os.path.join(state['sweep_dir'], "trial_{}".format(trial_id))
+    os.makedirs(trial_dir, exist_ok=True)
+
+    # 只在第一轮播种；之后的轮次从保存的随机数状态继续，批次和负样本接着上一轮往下走
+    seed = trial_seed(trial_args.seed, trial_id)
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+    with open(os.path.join(trial_dir, 'log.txt'), 'a') as log, contextlib.redirect_stdout(log):
+        corpus = state['corpus']
+        corpus.batch_size = trial_args.batch_size
+        corpus.invalid_valid_ratio = trial_args.valid_invalid_ratio
+
+        entity_embeddings, relation_embeddings = run.init_model_embeddings(
+            trial_args, corpus.entity2id, corpus.relation2id, vectors=state['vectors'])
+        model = run.build_model(trial_args, entity_embeddings, relation_embeddings)
+        CUDA = torch.cuda.is_available()
+        if CUDA:
+            model.cuda()
+
+        optimizer = torch.optim.Adam(model.parameters(), lr=trial_args.lr, weight_decay=trial_args.weight_decay)
+        scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=trial_args.step_size,
+                                                    gamma=trial_args.gamma, last_epoch=-1)
+        start_epoch = 0
+        state_path = os.path.join(trial_dir, 'state.pth')
+        if os.path.exists(state_path):
+            # 上一轮训练到的位置
+            checkpoint = torch.load(state_path, map_location='cuda' if CUDA else 'cpu')
+            model.load_state_dict(checkpoint['model'])
+            optimizer.load_state_dict(checkpoint['optimizer'])
+            scheduler.load_state_dict(checkpoint['scheduler'])
+            set_rng_state(checkpoint['rng'])
+            start_epoch = checkpoint['epoch']
+
+        trial_args.epochs = epochs
+        run.train(trial_args, corpus, model, CUDA, trial_dir, optimizer, scheduler, start_epoch)
+        torch.save({'model': model.state_dict(), 'optimizer': optimizer.state_dict(),
+                    'scheduler': scheduler.state_dict(), 'epoch': epochs, 'rng': get_rng_state()}, state_path)
+
+        model.eval()
+        scorer = model.test if trial_args.model_name in ('TransE', 'DisenE_Trans') else model
+        with torch.no_grad():
+            MRR, MR, H1, H3, H10 = corpus.get_validation_pred(trial_args, scorer, state['valid_triples'])
+    return trial_id, {'MRR': MRR, 'MR': MR, 'Hits@1': H1, 'Hits@3': H3, 'Hits@10': H10}
+
+
+def write_summary(path, keys, trials, results):
+    rows = sorted(results.items(), key=lambda item: -item[1]['metrics']['MRR'])
+    header = ["trial"] + keys + ["epochs", "MRR", "MR", "Hits@1", "Hits@3", "Hits@10", "status"]
+    lines = ["\t".join(header)]
+    for trial_id, result in rows:
+        params, metrics = trials[trial_id][0], result['metrics']
+        lines.append("\t".join([str(trial_id)] + [str(params[key]) for key in keys] + [str(result['epochs'])] +
+                               ["{:.4f}".format(metrics[m]) for m in ("MRR", "MR", "Hits@1", "Hits@3", "Hits@10")] +
+                               [result['status']]))
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    print("\n".join(lines))
+
+
+def main():
+    sweep_args, run_argv = parser.parse_known_args()
+    base_args = run.parser.parse_args(run_argv)
+    base_args.data_dir = os.path.join(base_args.data_dir, base_args.dataset)
+    sweep_dir = os.path.join(sweep_args.sweep_dir, base_args.dataset, base_args.model_name)
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    keys, trials = parse_grid(sweep_args.grid, base_args)
+    print("{} trials over {}".format(len(trials), keys))
+
+    # 只读入一次数据
+    start_time = time.time()
+    train_data, validation_data, test_data, link_data, entity2id, relation2id = build_data(
+        base_args.data_dir, streaming=base_args.stream_data, num_workers=base_args.load_workers)
+    corpus = Corpus(base_args, train_data, validation_data, test_data, link_data, entity2id, relation2id,
+                    base_args.batch_size, base_args.valid_invalid_ratio)
+    vectors = None
+    if base_args.pretrained_emb:
+        vectors = (load_vectors(os.path.join(base_args.data_dir, 'entity2vec.txt')),
+                   load_vectors(os.path.join(base_args.data_dir, 'relation2vec.txt')))
+    rng = np.random.RandomState(base_args.seed)
+    valid_triples = corpus.validation_indices[
+        rng.permutation(len(corpus.validation_indices))[:sweep_args.eval_triples]]
+    print("data loaded in {:.1f}s".format(time.time() - start_time))
+
+    # 按CPU核数和内存决定同时运行的试验数
+    cores = max(1, multiprocessing.cpu_count() // sweep_args.threads_per_trial)
+    memory_mb = sweep_args.memory_mb if sweep_args.memory_mb > 0 else available_memory_mb()
+    trial_mb = max(estimate_trial_mb(trial_args, len(entity2id), len(relation2id)) for _, trial_args in trials)
+    parallel = max(1, min(cores, int(memory_mb // trial_mb), len(trials)))
+    if sweep_args.max_parallel > 0:
+        parallel = min(parallel, sweep_args.max_parallel)
+    print("running {} trials at a time (~{:.0f} MB each)".format(parallel, trial_mb))
+
+    _sweep_state.update(corpus=corpus, vectors=vectors, valid_triples=valid_triples,
+                        sweep_dir=sweep_dir, threads=sweep_args.threads_per_trial)
+
+    results = {}
+    alive = list(range(len(trials)))
+    epochs = min(sweep_args.rung_epochs, sweep_args.max_epochs)
+    while alive:
+        print("\nrung: {} trials, {} epochs".format(len(alive), epochs))
+        tasks = [(trial_id, trials[trial_id][1], epochs) for trial_id in alive]
+        # 每个试验用一个新进程，结束后显存/内存都会释放
+        with multiprocessing.get_context('fork').Pool(parallel, maxtasksperchild=1) as pool:
+            for trial_id, metrics in pool.imap_unordered(run_trial, tasks):
+                results[trial_id] = {'metrics': metrics, 'epochs': epochs, 'status': 'running'}
+                print("trial {} {}: MRR {:.4f}, Hits@10 {:.4f}".format(
+                    trial_id, trials[trial_id][0], metrics['MRR'], metrics['Hits@10']))
+
+        if epochs >= sweep_args.max_epochs or len(alive) == 1:
+            for trial_id in alive:
+                results[trial_id]['status'] = 'completed'
+            break
+
+        alive.sort(key=lambda trial_id: -results[trial_id]['metrics']['MRR'])
+        keep = max(1, int(math.ceil(len(alive) / sweep_args.eta)))
+        for trial_id in alive[keep:]:
+            results[trial_id]['status'] = 'stopped@{}'.format(epochs)
+        alive = alive[:keep]
+        epochs = min(epochs * sweep_args.eta, sweep_args.max_epochs)
+
+    _sweep_state.clear()
+    print("\nsweep finished in {:.1f}s".format(time.time() - start_time))
+    write_summary(os.path.join(sweep_dir, 'summary.tsv'), keys, trials, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import argparse
+
+import pytest
+
+from common import add_data_args, load_corpus, make_config, synthetic_kg
+
+
+@pytest.fixture
+def kg():
+    """小的合成图谱：(Corpus, 实体嵌入, 关系嵌入, 配置)"""
+    args = add_data_args(argparse.ArgumentParser()).parse_args([
+        '--num_entities=120', '--num_relations=6', '--num_triples=1200', '--embedding_size=8',
+        '--k_factors=3', '--out_channels=4', '--batch_size=32', '--valid_invalid_ratio=4'])
+    config = make_config(args, model_name='DisenE', eval_memory_mb=0.05, eval_workers=0)
+    corpus, entity_emb, relation_emb = load_corpus(args, config)
+    return corpus, entity_emb, relation_emb, config
+
+
+def write_dataset(folder, num_entities=60, num_relations=4, num_triples=400, extra_columns=0, seed=0):
+    """按 run.py 的目录格式把合成图谱写成文本文件，extra_columns 在每行三元组后追加多余的列"""
+    train, valid, test, entity2id, relation2id = synthetic_kg(num_entities, num_relations, num_triples, seed=seed)
+    id2entity = {i: name for name, i in entity2id.items()}
+    id2relation = {i: name for name, i in relation2id.items()}
+    os.makedirs(folder, exist_ok=True)
+    for name, mapping in (('entity2id.txt', entity2id), ('relation2id.txt', relation2id)):
+        with open(os.path.join(folder, name), 'w') as f:
+            f.write("{}\n".format(len(mapping)))
+            for item, idx in mapping.items():
+                f.write("{}\t{}\n".format(item, idx))
+    for name, triples in (('train.txt', train), ('valid.txt', valid), ('test.txt', test)):
+        with open(os.path.join(folder, name), 'w') as f:
+            for h, r, t in triples:
+                extra = ["{:.1f}".format(c + 1) for c in range(extra_columns)]
+                f.write("\t".join([id2entity[h], id2relation[r], id2entity[t]] + extra) + "\n")
+    with open(os.path.join(folder, 'link_prediction1.txt'), 'w') as f:
+        for h, r, t in test[:5]:
+            f.write("{}\t{}\t?\n?\t{}\t{}\n".format(id2entity[h], id2relation[r], id2relation[r], id2entity[t]))
+    return train, valid, test, entity2id, relation2id
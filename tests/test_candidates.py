@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from candidates import HEAD, TAIL, CandidateIndex
+
+# 6个实体、3个关系；r0 与 r1 的头实体集合 {0, 2} / {0, 4}、尾实体集合 {1, 3} / {3, 4} 的Jaccard相似度都是 1/3
+TRIPLES = np.array([[0, 0, 1], [2, 0, 1], [0, 0, 3], [0, 0, 1],
+                    [0, 1, 3], [4, 1, 4],
+                    [5, 2, 0]])
+QUERIES = np.array([[2, 0, 3], [5, 0, 4], [0, 1, 1], [5, 2, 0]])
+
+
+def test_csr_layout():
+    index = CandidateIndex.from_triples(TRIPLES, num_entities=6, num_relations=3)
+    np.testing.assert_array_equal(index.offsets[HEAD], [0, 2, 4, 5])
+    np.testing.assert_array_equal(index.entities[HEAD], [0, 2, 0, 4, 5])
+    np.testing.assert_array_equal(index.offsets[TAIL], [0, 2, 4, 5])
+    np.testing.assert_array_equal(index.entities[TAIL], [1, 3, 3, 4, 0])
+    np.testing.assert_array_equal(index.candidates(1, TAIL), [3, 4])
+    np.testing.assert_array_equal(index.contains(QUERIES), [[True, True], [False, False],
+                                                            [True, False], [True, True]])
+
+
+@pytest.mark.parametrize("widen, heads, tails", [
+    (0.5, [[0, 2], [0, 4], [5]], [[1, 3], [3, 4], [0]]),
+    (0.3, [[0, 2, 4], [0, 2, 4], [5]], [[1, 3, 4], [1, 3, 4], [0]]),
+])
+def test_widen_by_jaccard(widen, heads, tails):
+    index = CandidateIndex.from_triples(TRIPLES, num_entities=6, num_relations=3, widen=widen)
+    for side, expected in ((HEAD, heads), (TAIL, tails)):
+        assert [index.candidates(r, side).tolist() for r in range(3)] == expected
+
+
+@pytest.mark.parametrize("widen, head_miss, tail_miss", [(0.0, 0.25, 0.5), (0.3, 0.25, 0.0)])
+def test_report_miss_rate(widen, head_miss, tail_miss):
+    index = CandidateIndex.from_triples(TRIPLES, num_entities=6, num_relations=3, widen=widen)
+    stats = index.report(QUERIES)
+    assert stats['head']['miss_rate'] == pytest.approx(head_miss)
+    assert stats['tail']['miss_rate'] == pytest.approx(tail_miss)
+    sizes = index.sizes(HEAD)
+    assert stats['head']['max'] == sizes.max()
+    assert stats['head']['scored_per_query'] == pytest.approx(sizes[QUERIES[:, 1]].mean())
+    assert 'miss_rate' not in index.report()['tail']
@@ -0,0 +1,43 @@
+import pytest
+import torch
+
+import run
+from cascade import load_stage
+from embedding_store import EntityStore
+
+
+def stage_args(**overrides):
+    args = run.parser.parse_args(['--pretrained_emb=0', '--cache_rows=16'])
+    for key, value in overrides.items():
+        setattr(args, key, value)
+    return args
+
+
+@pytest.mark.parametrize("layout", ["full", "factored", "entity_store"])
+def test_load_stage_layouts(kg, tmp_path, layout):
+    corpus, entity_emb, relation_emb, _ = kg
+    args = stage_args(model_name='DisenE_Trans', embedding_size=8, k_factors=3,
+                      factored_rank=2 if layout == 'factored' else 0)
+    model = run.build_model(args, entity_emb.clone(), relation_emb.clone()).eval()
+    state_dict = model.state_dict()
+    store = 'None'
+    if layout == 'entity_store':
+        store = str(tmp_path / 'store')
+        table = model.entity_embeddings.detach().numpy()
+        EntityStore.create(store, len(table), table.shape[1], lambda start, end: table[start:end])
+        state_dict = {key: value for key, value in state_dict.items() if key != 'entity_embeddings'}
+    path = str(tmp_path / 'stage.pth')
+    torch.save(state_dict, path)
+
+    # 形状参数都从checkpoint推出，与命令行上的无关
+    loaded, loaded_args = load_stage(stage_args(embedding_size=100, k_factors=6), 'DisenE_Trans',
+                                     path, store)
+    assert (loaded_args.embedding_size, loaded_args.k_factors) == (8, 3)
+    assert loaded_args.factored_rank == args.factored_rank
+    batch = torch.LongTensor(corpus.test_indices[:32])
+    with torch.no_grad():
+        torch.testing.assert_close(loaded.test(batch)[0], model.test(batch)[0])
+
+    if layout == 'entity_store':
+        with pytest.raises(ValueError, match='no entity table'):
+            load_stage(args, 'DisenE_Trans', path)
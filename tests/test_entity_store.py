@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+import run
+from common import build_model
+from conftest import write_dataset
+from embedding_store import EntityStore, MappedEntityTable
+
+
+@pytest.mark.parametrize("model_name", ["ConvKB", "DisenE"])
+def test_attach_normalizes_on_read(kg, tmp_path, model_name):
+    corpus, entity_emb, relation_emb, config = kg
+    torch.manual_seed(0)
+    model = build_model(model_name, entity_emb, relation_emb, config).eval()
+    table = model.entity_embeddings.detach().numpy().copy()
+    folder = str(tmp_path / 'store')
+    EntityStore.create(folder, len(table), table.shape[1], lambda start, end: table[start:end])
+    batch = torch.LongTensor(corpus.test_indices[:32])
+    with torch.no_grad():
+        expected = model(batch)[0]
+
+    model.entity_embeddings.data = torch.zeros(1, table.shape[1])
+    store = EntityStore(folder, cache_rows=16)
+    store.attach(model, normalize=True)
+    assert isinstance(model.entity_embeddings, MappedEntityTable)
+    assert model.do_normalize == 0
+    # 整张表不在参数/缓冲区中，model.cuda() 不会复制它
+    assert 'entity_embeddings' not in model.state_dict()
+    assert all(t.numel() < table.size for t in list(model.parameters()) + list(model.buffers()))
+    with torch.no_grad():
+        torch.testing.assert_close(model(batch)[0], expected)
+    # 文件中仍是未归一化的行
+    np.testing.assert_array_equal(np.load(os.path.join(folder, 'entity.npy')), table)
+
+
+def test_full_checkpoint_with_entity_store(tmp_path, monkeypatch):
+    # 链接预测结果 result.json 写在当前目录
+    monkeypatch.chdir(tmp_path)
+    data_dir = str(tmp_path / 'data')
+    write_dataset(os.path.join(data_dir, 'syn'))
+    argv = ['--data_dir', data_dir, '--dataset=syn', '--model_name=DisenE', '--pretrained_emb=0',
+            '--embedding_size=8', '--k_factors=2', '--out_channels=2', '--evaluate=1', '--eval_memory_mb=0.05']
+
+    # 先用完整的实体表评估一次，保存checkpoint
+    args = run.parser.parse_args(argv + ['--output_dir', str(tmp_path / 'full')])
+    entity_emb, relation_emb = run.init_model_embeddings(args, range(60), range(4))
+    model = run.build_model(args, entity_emb, relation_emb)
+    path = str(tmp_path / 'full.pth')
+    torch.save(model.state_dict(), path)
+    run.main(run.parser.parse_args(argv + ['--output_dir', str(tmp_path / 'full'), '--load', path]))
+
+    table = entity_emb.numpy()
+    store = str(tmp_path / 'store')
+    EntityStore.create(store, len(table), table.shape[1], lambda start, end: table[start:end])
+    run.main(run.parser.parse_args(argv + ['--output_dir', str(tmp_path / 'store_run'), '--load', path,
+                                           '--entity_store', store]))
+
+    def metrics(folder):
+        with open(os.path.join(folder, 'syn', 'results_model.txt')) as f:
+            return [line for line in f if not line.startswith('args')]
+    assert metrics(str(tmp_path / 'store_run')) == metrics(str(tmp_path / 'full'))
+    np.testing.assert_array_equal(np.load(os.path.join(store, 'entity.npy')), table)
@@ -0,0 +1,63 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+import incremental
+from common import build_model, make_config
+from models import FactoredEntityTable, entity_table
+
+
+def dense_rows(table, idx):
+    # base + coef @ basis 按行组合，K个因子共用 base
+    rows = table.base[idx].repeat(1, table.K) + table.coef[idx] @ table.basis
+    return F.normalize(rows, p=2, dim=1) if table.normalize else rows
+
+
+@pytest.mark.parametrize("normalize", [False, True])
+def test_rows_match_dense_composition(normalize):
+    torch.manual_seed(0)
+    table = FactoredEntityTable(torch.randn(40, 12), k_factors=3, rank=4, normalize=normalize)
+    idx = torch.LongTensor([5, 0, 39, 5, 17])
+    with torch.no_grad():
+        expected = dense_rows(table, idx)
+        torch.testing.assert_close(table(idx), expected)
+        torch.testing.assert_close(table[idx, :], expected)
+        torch.testing.assert_close(table.full(chunk_rows=7), dense_rows(table, torch.arange(40)))
+    assert table.shape == (40, 12)
+
+
+def test_entity_table_takes_over_normalization(kg):
+    corpus, entity_emb, relation_emb, config = kg
+    table, do_normalize = entity_table(entity_emb.clone(), make_config(config, factored_rank=2), 1)
+    assert isinstance(table, FactoredEntityTable) and table.normalize and do_normalize == 0
+    table, do_normalize = entity_table(entity_emb.clone(), make_config(config, factored_rank=0), 1)
+    assert isinstance(table, torch.nn.Parameter) and do_normalize == 1
+
+    # 分解的表打分与用组合出的完整表(已归一化)的稠密模型相同
+    torch.manual_seed(0)
+    factored = build_model('DisenE', entity_emb, relation_emb, make_config(config, factored_rank=2)).eval()
+    dense = build_model('DisenE', entity_emb, relation_emb, make_config(config, do_normalize=0)).eval()
+    state_dict = {key: value for key, value in factored.state_dict().items() if not key.startswith('entity_')}
+    state_dict['entity_embeddings'] = factored.entity_embeddings.full()
+    dense.load_state_dict(state_dict)
+    batch = torch.LongTensor(corpus.test_indices[:32])
+    with torch.no_grad():
+        torch.testing.assert_close(factored(batch)[0], dense(batch)[0])
+
+
+def test_grown_rows_keep_composition():
+    torch.manual_seed(0)
+    table = FactoredEntityTable(torch.randn(30, 12), k_factors=3, rank=4)
+    state_dict = {'entity_embeddings.' + name: value.detach().clone() for name, value in table.state_dict().items()}
+    new_rows = FactoredEntityTable(torch.randn(6, 12), k_factors=3, rank=4)
+    new_rows.basis.data = table.basis.data.clone()
+    grown = torch.cat([table.full(), new_rows.full()])
+    incremental.factor_new_rows(state_dict, grown)
+
+    # 加载到更大的表后，按行组合仍得到扩展后的完整表
+    bigger = FactoredEntityTable(torch.zeros(36, 12), k_factors=3, rank=4)
+    bigger.load_state_dict({key.split('.', 1)[1]: value for key, value in state_dict.items()})
+    with torch.no_grad():
+        torch.testing.assert_close(bigger.full(), dense_rows(bigger, torch.arange(36)))
+        torch.testing.assert_close(bigger.full()[:30], table.full())
+        torch.testing.assert_close(bigger.full(), grown, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,64 @@
+import copy
+
+import numpy as np
+import pytest
+import torch
+
+from common import build_model, make_config
+
+
+def loss_and_grads(model, batch, labels):
+    model.zero_grad()
+    loss, att = model(batch, labels)
+    (loss + att.pow(2).sum()).backward()
+    return loss.detach(), att.detach(), {name: param.grad.clone() for name, param in model.named_parameters()}
+
+
+def test_fused_matches_unfused(kg):
+    corpus, entity_emb, relation_emb, config = kg
+    # dropout 关掉，两种前向的 dropout mask 形状不同
+    config = make_config(config, dropout=0.0, fused_forward=0)
+    torch.manual_seed(0)
+    model = build_model('DisenE', entity_emb, relation_emb, config)
+    fused = copy.deepcopy(model)
+    fused.fused_forward = 1
+
+    batch = torch.LongTensor(corpus.train_indices[:48])
+    labels = torch.FloatTensor(np.where(np.arange(48) % 3 == 0, -1.0, 1.0))
+    model.train()
+    fused.train()
+    expected_loss, expected_att, expected_grads = loss_and_grads(model, batch, labels)
+    loss, att, grads = loss_and_grads(fused, batch, labels)
+    torch.testing.assert_close(loss, expected_loss, rtol=1e-5, atol=1e-6)
+    torch.testing.assert_close(att, expected_att, rtol=1e-5, atol=1e-6)
+    assert grads.keys() == expected_grads.keys()
+    for name in grads:
+        torch.testing.assert_close(grads[name], expected_grads[name], rtol=1e-4, atol=1e-6, msg=name)
+
+    # 推理时的分数(dropout 不起作用)
+    model.eval()
+    fused.eval()
+    with torch.no_grad():
+        torch.testing.assert_close(fused(batch)[0], model(batch)[0], rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("mode", ["block", "factor"])
+def test_grad_checkpoint_matches_default(kg, mode):
+    corpus, entity_emb, relation_emb, config = kg
+    config = make_config(config, dropout=0.3, fused_forward=0, grad_checkpoint='none')
+    torch.manual_seed(0)
+    model = build_model('DisenE', entity_emb, relation_emb, config).train()
+    checkpointed = copy.deepcopy(model)
+    checkpointed.grad_checkpoint = mode
+
+    batch = torch.LongTensor(corpus.train_indices[:48])
+    labels = torch.FloatTensor(np.where(np.arange(48) % 3 == 0, -1.0, 1.0))
+    # 相同的随机数状态下，dropout 掩码与默认前向相同
+    torch.manual_seed(1)
+    expected_loss, expected_att, expected_grads = loss_and_grads(model, batch, labels)
+    torch.manual_seed(1)
+    loss, att, grads = loss_and_grads(checkpointed, batch, labels)
+    torch.testing.assert_close(loss, expected_loss, rtol=1e-5, atol=1e-6)
+    torch.testing.assert_close(att, expected_att, rtol=1e-5, atol=1e-6)
+    for name in grads:
+        torch.testing.assert_close(grads[name], expected_grads[name], rtol=1e-4, atol=1e-6, msg=name)
@@ -0,0 +1,59 @@
+import os
+import shutil
+import sys
+
+import pytest
+import torch
+
+import incremental
+import run
+from conftest import write_dataset
+from models import FactoredEntityTable
+
+
+def test_factored_checkpoint_grows_exactly():
+    torch.manual_seed(0)
+    table = FactoredEntityTable(torch.randn(30, 12), k_factors=3, rank=4)
+    state_dict = {'entity_embeddings.' + name: value.detach().clone() for name, value in table.state_dict().items()}
+    full = incremental.factored_rows(state_dict)
+    torch.testing.assert_close(full, table.full())
+
+    # 新行在 base + coef @ basis 能表示的范围内时应当被精确还原
+    new_table = FactoredEntityTable(torch.randn(5, 12), k_factors=3, rank=4)
+    new_table.basis.data = table.basis.data.clone()
+    grown = torch.cat([full, new_table.full()])
+    incremental.factor_new_rows(state_dict, grown)
+    assert state_dict['entity_embeddings.base'].shape == (35, 4)
+    assert state_dict['entity_embeddings.coef'].shape == (35, 4)
+    assert torch.equal(state_dict['entity_embeddings.base'][:30], table.base.data)
+    assert torch.equal(state_dict['entity_embeddings.coef'][:30], table.coef.data)
+    torch.testing.assert_close(incremental.factored_rows(state_dict), grown, rtol=1e-4, atol=1e-5)
+
+
+def test_entity_store_checkpoint_rejected(tmp_path, monkeypatch):
+    path = str(tmp_path / 'dense.pth')
+    torch.save({'relation_embeddings': torch.zeros(4, 8)}, path)
+    monkeypatch.setattr(sys, 'argv', ['incremental.py', '--delta_dir', str(tmp_path), '--load', path,
+                                      '--data_dir', str(tmp_path), '--output_dir', str(tmp_path)])
+    with pytest.raises(ValueError, match='no entity table'):
+        incremental.main()
+
+
+def test_known_triples_leave_checkpoint_alone(tmp_path, monkeypatch, capsys):
+    data_dir, delta_dir = str(tmp_path / 'data'), str(tmp_path / 'delta')
+    write_dataset(os.path.join(data_dir, 'syn'))
+    os.makedirs(delta_dir)
+    # 增量中只有已经在训练集里的三元组
+    shutil.copy(os.path.join(data_dir, 'syn', 'train.txt'), os.path.join(delta_dir, 'train.txt'))
+    run_argv = ['--data_dir', data_dir, '--dataset=syn', '--model_name=DisenE', '--pretrained_emb=0',
+                '--embedding_size=8', '--k_factors=2', '--out_channels=2']
+    args = run.parser.parse_args(run_argv)
+    model = run.build_model(args, *run.init_model_embeddings(args, range(60), range(4)))
+    path = str(tmp_path / 'model.pth')
+    torch.save(model.state_dict(), path)
+
+    monkeypatch.setattr(sys, 'argv', ['incremental.py', '--delta_dir', delta_dir, '--load', path,
+                                      '--output_dir', str(tmp_path / 'out')] + run_argv)
+    incremental.main()
+    assert "0 new triples" in capsys.readouterr().out
+    assert os.listdir(str(tmp_path / 'out' / 'syn' / 'incremental')) == []
@@ -0,0 +1,74 @@
+import pytest
+import torch
+
+from common import MODELS, build_model
+from inference import ScriptedScorer, build_scorer, export_scorer, load_scorer, quantize_table
+
+
+def eager_scores(model, model_name, batch):
+    # 与 evaluate 一致：TransE / DisenE_Trans 用 model.test
+    scorer = model.test if model_name in ('TransE', 'DisenE_Trans') else model
+    return scorer(batch)[0].view(-1)
+
+
+@pytest.mark.parametrize("method", ["script", "trace"])
+@pytest.mark.parametrize("model_name", sorted(MODELS))
+def test_scripted_matches_eager(kg, tmp_path, model_name, method):
+    corpus, entity_emb, relation_emb, config = kg
+    model = build_model(model_name, entity_emb, relation_emb, config).eval()
+    batch = torch.LongTensor(corpus.test_indices[:64])
+    path = str(tmp_path / 'scorer.pt')
+    with torch.no_grad():
+        expected = eager_scores(model, model_name, batch)
+        export_scorer(model, model_name, path, method)
+        scores, _ = load_scorer(path, torch.device('cpu'))(batch)
+    torch.testing.assert_close(scores.view(-1), expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("quantize", ["row", "factor"])
+def test_quantized_table_error(kg, quantize):
+    _, entity_emb, _, config = kg
+    groups = 1 if quantize == 'row' else config.k_factors
+    q, scale = quantize_table(entity_emb, groups)
+    assert q.dtype == torch.int8
+    restored = (q.view(len(q), groups, -1).float() * scale.unsqueeze(-1)).view_as(entity_emb)
+    bound = scale.repeat_interleave(entity_emb.size(1) // groups, dim=1) / 2
+    assert ((restored - entity_emb).abs() <= bound + 1e-6).all()
+
+
+@pytest.mark.parametrize("quantize", ["row", "factor"])
+@pytest.mark.parametrize("model_name", sorted(MODELS))
+def test_quantized_matches_eager(kg, tmp_path, model_name, quantize):
+    corpus, entity_emb, relation_emb, config = kg
+    model = build_model(model_name, entity_emb, relation_emb, config).eval()
+    batch = torch.LongTensor(corpus.test_indices[:64])
+    path = str(tmp_path / 'scorer.pt')
+    with torch.no_grad():
+        expected = eager_scores(model, model_name, batch)
+        quantized, _ = ScriptedScorer(build_scorer(model, model_name, quantize), torch.device('cpu'))(batch)
+        export_scorer(model, model_name, path, quantize=quantize)
+        scripted, _ = load_scorer(path, torch.device('cpu'))(batch)
+    # 导出的量化打分与 --quantize 的评估路径一致，与float32的差别在量化误差范围内
+    torch.testing.assert_close(scripted.view(-1), quantized.view(-1), rtol=1e-5, atol=1e-5)
+    assert (quantized.view(-1) - expected).abs().max() <= 0.01 * expected.abs().max()
+
+
+@pytest.mark.parametrize("method", ["script", "trace"])
+@pytest.mark.parametrize("prune_factors, prune_mass, same_as_full", [(3, 0.0, True), (0, 1.0, True), (1, 0.0, False)])
+def test_pruned_scorer_matches_eager(kg, tmp_path, method, prune_factors, prune_mass, same_as_full):
+    corpus, entity_emb, relation_emb, config = kg
+    model = build_model('DisenE', entity_emb, relation_emb, config).eval()
+    assert config.k_factors == 3
+    batch = torch.LongTensor(corpus.test_indices[:64])
+    path = str(tmp_path / 'scorer.pt')
+    with torch.no_grad():
+        full = eager_scores(model, 'DisenE', batch)
+        model.prune_factors, model.prune_mass = prune_factors, prune_mass
+        expected = eager_scores(model, 'DisenE', batch)
+        built, _ = ScriptedScorer(build_scorer(model, 'DisenE'), torch.device('cpu'))(batch)
+        export_scorer(model, 'DisenE', path, method)
+        scripted, _ = load_scorer(path, torch.device('cpu'))(batch)
+    # --quantize / --export_scripted 与 eager 评估使用相同的因子剪枝
+    torch.testing.assert_close(built.view(-1), expected, rtol=1e-5, atol=1e-5)
+    torch.testing.assert_close(scripted.view(-1), expected, rtol=1e-5, atol=1e-5)
+    assert torch.allclose(expected, full, rtol=1e-5, atol=1e-5) == same_as_full
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+import torch
+
+from common import build_model
+from inference import export_scorer, load_scorer
+from link_cache import LinkCache, model_fingerprint
+
+
+def scripted(kg, tmp_path, model_name, seed, name):
+    _, entity_emb, relation_emb, config = kg
+    torch.manual_seed(seed)
+    model = build_model(model_name, entity_emb, relation_emb, config).eval()
+    path = str(tmp_path / name)
+    export_scorer(model, model_name, path, 'script')
+    return load_scorer(path, torch.device('cpu'))
+
+
+@pytest.mark.parametrize("model_name", ["DisenE", "DisenE_Trans"])
+def test_scripted_fingerprints_differ(kg, tmp_path, model_name):
+    # 冻结后 state_dict 为空，不同的权重也必须得到不同的缓存键
+    first = scripted(kg, tmp_path, model_name, 0, 'a.pt')
+    again = scripted(kg, tmp_path, model_name, 0, 'b.pt')
+    other = scripted(kg, tmp_path, model_name, 1, 'c.pt')
+    assert len(first.module.state_dict()) == 0
+    settings = (model_name, 'none')
+    assert model_fingerprint(first, settings) == model_fingerprint(again, settings)
+    assert model_fingerprint(first, settings) != model_fingerprint(other, settings)
+    assert model_fingerprint(first, settings) != model_fingerprint(first, (model_name, 'row'))
+
+
+def test_cache_entries_isolated(kg, tmp_path):
+    folder = str(tmp_path / 'cache')
+    keys = [model_fingerprint(scripted(kg, tmp_path, 'DisenE', seed, '%d.pt' % seed)) for seed in (0, 1)]
+    query = np.array([3, 1, -1])
+    cache = LinkCache(folder, keys[0])
+    cache.put(query, np.array([5, 7, 9]))
+    cache.save()
+
+    assert LinkCache(folder, keys[1]).get(query) is None
+    np.testing.assert_array_equal(LinkCache(folder, keys[0]).get(query), [5, 7, 9])
@@ -0,0 +1,65 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from dataloader import NegativeShards
+from neg_shards import write_shards
+
+
+@pytest.fixture
+def shards(kg, tmp_path):
+    corpus, _, _, config = kg
+    folder = str(tmp_path / 'shards')
+    write_shards(corpus, folder, 2, config.batch_size, config.valid_invalid_ratio, seed=0, num_workers=1)
+    return corpus, config, folder
+
+
+def test_replayed_batches_are_filtered(shards):
+    corpus, config, folder = shards
+    replay = NegativeShards(folder, corpus.train_indices, config.batch_size, config.valid_invalid_ratio,
+                            corpus.num_entities)
+    replay.start_epoch(1)
+    batch_triples, batch_labels = replay.get_batch(0)
+    assert len(batch_triples) == config.batch_size * (config.valid_invalid_ratio + 1)
+    negatives = batch_triples[batch_labels[:, 0] == -1]
+    assert (negatives[:, [0, 2]] < corpus.num_entities).all()
+    assert not corpus.is_valid(negatives).any()
+
+
+@pytest.mark.parametrize("key", ["valid_invalid_ratio", "num_entities"])
+def test_header_mismatch_rejected(shards, key):
+    corpus, config, folder = shards
+    ratio, num_entities = config.valid_invalid_ratio, corpus.num_entities
+    if key == 'valid_invalid_ratio':
+        ratio += 2
+    else:
+        num_entities += 1
+    with pytest.raises(ValueError, match=key):
+        NegativeShards(folder, corpus.train_indices, config.batch_size, ratio, num_entities)
+
+
+def test_missing_header_key_rejected(shards):
+    # 早期版本生成的分片没有 num_entities
+    corpus, config, folder = shards
+    path = os.path.join(folder, 'meta.json')
+    with open(path) as f:
+        meta = json.load(f)
+    del meta['num_entities']
+    with open(path, 'w') as f:
+        json.dump(meta, f)
+    with pytest.raises(ValueError, match='num_entities=None'):
+        NegativeShards(folder, corpus.train_indices, config.batch_size, config.valid_invalid_ratio,
+                       corpus.num_entities)
+
+
+def test_truncated_epoch_rejected(shards):
+    corpus, config, folder = shards
+    path = os.path.join(folder, 'negatives_0001.npy')
+    np.save(path, np.load(path)[:-1])
+    replay = NegativeShards(folder, corpus.train_indices, config.batch_size, config.valid_invalid_ratio,
+                            corpus.num_entities)
+    replay.start_epoch(0)
+    with pytest.raises(ValueError, match='negative shard 1'):
+        replay.start_epoch(1)
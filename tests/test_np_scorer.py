@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import torch
+
+from common import build_model
+from export import export_model
+from np_scorer import NumpyScorer
+from vocab import Vocab
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+@pytest.mark.parametrize("model_name", ["TransE", "DisenE_Trans"])
+def test_numpy_scorer_matches_torch(kg, tmp_path, model_name, dtype):
+    corpus, entity_emb, relation_emb, config = kg
+    torch.manual_seed(0)
+    model = build_model(model_name, entity_emb, relation_emb, config).eval()
+    export_dir = str(tmp_path / 'export')
+    export_model(model.state_dict(), model_name, Vocab.from_dict(corpus.entity2id),
+                 Vocab.from_dict(corpus.relation2id), export_dir, dtype)
+    scorer = NumpyScorer(export_dir)
+
+    # float16导出时，torch一侧也用舍入后的表
+    with torch.no_grad():
+        for name in ('entity_embeddings', 'relation_embeddings'):
+            table = getattr(model, name)
+            table.data = table.data.to(getattr(torch, dtype)).float()
+    batch = corpus.test_indices[:64]
+    with torch.no_grad():
+        expected = model.test(torch.LongTensor(batch))[0].view(-1).numpy()
+    np.testing.assert_allclose(scorer.score(batch), expected, rtol=1e-5, atol=1e-4)
+
+    # chunk_size 不整除实体数；与对全部实体打分后排序的结果一致
+    for h, r, t in batch[:6]:
+        for query, column in (((h, r, -1), 2), ((-1, r, t), 0)):
+            candidates = np.tile(np.array(query), (corpus.num_entities, 1))
+            candidates[:, column] = np.arange(corpus.num_entities)
+            with torch.no_grad():
+                all_scores = model.test(torch.LongTensor(candidates))[0].view(-1).numpy()
+            ids, scores = scorer.topk(query, k=10, chunk_size=37)
+            np.testing.assert_allclose(scores, np.sort(all_scores)[::-1][:10], rtol=1e-5, atol=1e-4)
+            np.testing.assert_allclose(all_scores[ids], scores, rtol=1e-5, atol=1e-4)
+
+
+def test_parse_queries(kg, tmp_path):
+    corpus, entity_emb, relation_emb, config = kg
+    model = build_model('TransE', entity_emb, relation_emb, config)
+    export_dir = str(tmp_path / 'export')
+    entity_vocab, relation_vocab = Vocab.from_dict(corpus.entity2id), Vocab.from_dict(corpus.relation2id)
+    export_model(model.state_dict(), 'TransE', entity_vocab, relation_vocab, export_dir)
+    scorer = NumpyScorer(export_dir)
+    h, r, t = entity_vocab.names([3])[0], relation_vocab.names([1])[0], entity_vocab.names([7])[0]
+    queries = scorer.parse_queries(["{}\t{}\t?\n".format(h, r), "?\t{}\t{}\n".format(r, t), "\n"])
+    np.testing.assert_array_equal(queries, [[3, 1, -1], [-1, 1, 7]])
+    with pytest.raises(KeyError):
+        scorer.parse_queries(["nope\t{}\t?".format(r)])
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import torch
+
+import dataloader
+from common import MODELS, build_model
+from dataloader import run_parallel
+
+
+def scorer_of(model, model_name):
+    return model.test if model_name in ('TransE', 'DisenE_Trans') else model
+
+
+@pytest.mark.parametrize("model_name", sorted(MODELS))
+def test_parallel_matches_sequential(kg, model_name):
+    corpus, entity_emb, relation_emb, config = kg
+    config.model_name = model_name
+    model = build_model(model_name, entity_emb, relation_emb, config).eval()
+    triples = corpus.test_indices[:20]
+    with torch.no_grad():
+        config.eval_workers = 0
+        sequential = corpus.get_validation_pred(config, scorer_of(model, model_name), triples)
+        config.eval_workers = 2
+        parallel = corpus.get_validation_pred(config, scorer_of(model, model_name), triples)
+    assert parallel == sequential
+
+
+@pytest.mark.parametrize("model_name", sorted(MODELS))
+def test_parallel_link_prediction_matches_sequential(kg, model_name):
+    corpus, entity_emb, relation_emb, config = kg
+    config.model_name = model_name
+    model = build_model(model_name, entity_emb, relation_emb, config).eval()
+    queries = corpus.test_indices[:20].copy()
+    queries[::2, 0] = -1
+    queries[1::2, 2] = -1
+    corpus.link_indices = queries
+
+    with torch.no_grad():
+        config.eval_workers = 0
+        sequential_links = corpus.get_validation_pred2(config, model)
+        config.eval_workers = 2
+        parallel_links = corpus.get_validation_pred2(config, model)
+
+    assert len(parallel_links) == len(sequential_links)
+    for a, b in zip(parallel_links, sequential_links):
+        np.testing.assert_array_equal(a, b)
+
+
+def _worker_table(shard):
+    model, triples = dataloader._eval_state['model'], dataloader._eval_state['triples']
+    with torch.no_grad():
+        model(torch.LongTensor(triples[list(shard)]))
+    table = model.entity_embeddings
+    return [(model.do_normalize, table.is_shared(), table.data_ptr())] * len(shard)
+
+
+@pytest.mark.parametrize("model_name", ["ConvKB", "DisenE"])
+def test_workers_share_normalized_table(kg, model_name):
+    corpus, entity_emb, relation_emb, config = kg
+    model = build_model(model_name, entity_emb, relation_emb, config).eval()
+    results = run_parallel(corpus, config, model, _worker_table, corpus.test_indices[:8], 2)
+
+    # 子进程中前向不再归一化，实体表仍是父进程放在共享内存中的那一份，且已经归一化
+    assert set(results) == {(0, True, model.entity_embeddings.data_ptr())}
+    assert model.do_normalize == config.do_normalize
+    norms = model.entity_embeddings.detach().norm(dim=1)
+    torch.testing.assert_close(norms, torch.ones_like(norms))
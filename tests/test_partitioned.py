@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import torch
+
+from partitioned import PartitionStore, sample_bucket_batch, to_local
+
+
+@pytest.fixture
+def store(tmp_path, kg):
+    corpus = kg[0]
+    store = PartitionStore(str(tmp_path / 'partitions'), corpus.num_entities, 3)
+    store.init(lambda start, end: np.arange(start, end, dtype=np.float32)[:, None].repeat(4, axis=1))
+    return store
+
+
+@pytest.mark.parametrize('ratio', [0, 1, 3, 4])
+def test_bucket_batch_labels(kg, store, ratio):
+    corpus = kg[0]
+    positives = corpus.train_indices[:10].astype(np.int64)
+    batch_triples, batch_labels = sample_bucket_batch(corpus, store, positives, 0, 1, ratio)
+    assert batch_triples.shape == (10 * (ratio + 1), 3)
+
+    # 标签与实际的正/负样本一致：ratio为奇数时多出的一份是正样本
+    is_positive = np.zeros(len(batch_triples), dtype=bool)
+    for copy in range(ratio + 1):
+        rows = slice(10 * copy, 10 * (copy + 1))
+        is_positive[rows] = (batch_triples[rows] == positives).all(axis=1)
+    negatives = 2 * 10 * (ratio // 2)
+    assert (batch_labels[:, 0] == -1).sum() == negatives
+    assert (batch_labels[is_positive, 0] == 1).all()
+    assert not corpus.is_valid(batch_triples[batch_labels[:, 0] == -1]).any()
+
+
+def test_slots_and_assembled_table(kg, store, tmp_path):
+    part_size, dim = store.part_size, store.dim
+    buffers = [torch.zeros(2 * part_size, dim) for _ in range(3)]
+    store.load_into(2, [tensor[:store.bounds(2)[1] - store.bounds(2)[0]] for tensor in buffers])
+    store.load_into(0, [tensor[part_size:2 * part_size] for tensor in buffers])
+    start, end = store.bounds(2)
+    assert torch.equal(buffers[0][:end - start, 0], torch.arange(start, end, dtype=torch.float32))
+    assert torch.equal(buffers[0][part_size:, 0], torch.arange(part_size, dtype=torch.float32))
+
+    # 槽位中的分区起点：全局id映射到对应的行
+    triples = np.array([[start, 0, 1], [end - 1, 0, start + 1]])
+    local = to_local(triples, store, {2: 0, 0: part_size})
+    assert (buffers[0][local[:, [0, 2]], 0].numpy() == triples[:, [0, 2]]).all()
+
+    table = store.full_table(str(tmp_path / 'full.npy'))
+    assert isinstance(table, np.memmap)
+    assert (table[:, 0] == np.arange(store.num_entities)).all()
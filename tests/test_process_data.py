@@ -0,0 +1,105 @@
+import gzip
+import os
+import re
+import shutil
+
+import numpy as np
+import pytest
+
+import run
+from conftest import write_dataset
+from dataloader import Corpus
+from process_data import build_data, load_data_stream
+from vocab import Vocab, load_vocab
+
+
+@pytest.mark.parametrize("extra_columns", [0, 1, 3])
+def test_stream_matches_load_data(tmp_path, extra_columns):
+    # 4列 * 6行 的 token 总数可以被3整除，按 token 切分会错位
+    write_dataset(str(tmp_path), extra_columns=extra_columns)
+    expected = build_data(str(tmp_path))
+    streamed = build_data(str(tmp_path), streaming=True)
+    for i in range(4):
+        np.testing.assert_array_equal(streamed[i], np.array(expected[i], dtype=np.int32).reshape(-1, 3))
+    assert len(streamed[4]) == len(expected[4]) and len(streamed[5]) == len(expected[5])
+
+
+def test_stream_small_chunks_and_gzip(tmp_path):
+    train, _, _, _, _ = write_dataset(str(tmp_path), extra_columns=1)
+    path = str(tmp_path / 'train.txt')
+    with open(path, 'rb') as f, gzip.open(path + '.gz', 'wb') as g:
+        shutil.copyfileobj(f, g)
+    entity_vocab = load_vocab(str(tmp_path / 'entity2id.txt'))
+    relation_vocab = load_vocab(str(tmp_path / 'relation2id.txt'))
+    plain = load_data_stream(path, entity_vocab, relation_vocab, chunk_bytes=64)
+    os.remove(path)
+    compressed = load_data_stream(path, entity_vocab, relation_vocab, chunk_bytes=64)
+    np.testing.assert_array_equal(plain, np.array(train, dtype=np.int32))
+    np.testing.assert_array_equal(compressed, plain)
+
+
+def test_stream_parallel(tmp_path):
+    train, _, _, _, _ = write_dataset(str(tmp_path), num_triples=2000, extra_columns=2)
+    entity_vocab = load_vocab(str(tmp_path / 'entity2id.txt'))
+    relation_vocab = load_vocab(str(tmp_path / 'relation2id.txt'))
+    triples = load_data_stream(str(tmp_path / 'train.txt'), entity_vocab, relation_vocab, num_workers=3,
+                               chunk_bytes=256)
+    np.testing.assert_array_equal(triples, np.array(train, dtype=np.int32))
+
+
+def test_stream_unknown_name(tmp_path):
+    write_dataset(str(tmp_path))
+    with open(str(tmp_path / 'valid.txt'), 'a') as f:
+        f.write("e0\tr0\tunknown_entity\n")
+    with pytest.raises(KeyError):
+        build_data(str(tmp_path), streaming=True)
+
+
+def test_streamed_corpus_filters_without_tuple_dict(tmp_path):
+    write_dataset(str(tmp_path))
+    data = build_data(str(tmp_path), streaming=True)
+    corpus = Corpus(None, *data, 16, 4)
+    assert corpus.valid_triples_dict is None
+    known = np.concatenate([corpus.train_indices, corpus.validation_indices, corpus.test_indices])
+    assert all(corpus.is_known(*triple) for triple in known[:50])
+
+    np.random.seed(0)
+    batch_triples, batch_labels = corpus.get_iteration_batch(0)
+    negatives = batch_triples[batch_labels.reshape(-1) == -1]
+    assert len(negatives) == 16 * 4 and not corpus.is_valid(negatives).any()
+
+
+def test_vocab_lookup_spans():
+    vocab = Vocab.from_names(["a", "/m/0abc", "/m/0ab", "relation/with/long/name"])
+    text = b"?\t/m/0ab /m/0abc a relation/with/long/name /m/0abcd /m"
+    spans = [match.span() for match in re.finditer(rb"\S+", text)]
+    starts = np.array([start for start, _ in spans])
+    lengths = np.array([end - start for start, end in spans])
+    expected = [-1, 2, 1, 0, 3, -1, -1]
+    np.testing.assert_array_equal(vocab.lookup_spans(np.frombuffer(text, dtype=np.uint8), starts, lengths), expected)
+    np.testing.assert_array_equal(vocab.lookup(text.decode().split()), expected)
+
+
+def test_link_results_use_corpus_vocab(tmp_path, kg):
+    data_dir = tmp_path / 'data'
+    write_dataset(str(data_dir))
+    # 非流式读入时 id 可以不连续，也不会在数据目录下建 cache/
+    with open(data_dir / 'entity2id.txt', 'a') as f:
+        f.write("gap_entity\t500\n")
+    args = kg[3]
+    outputs = []
+    for streaming in (False, True):
+        if streaming:
+            with open(data_dir / 'entity2id.txt') as f:
+                lines = f.readlines()[:-1]
+            with open(data_dir / 'entity2id.txt', 'w') as f:
+                f.writelines(lines)
+        data = build_data(str(data_dir), streaming=streaming)
+        corpus = Corpus(args, *data, args.batch_size, args.valid_invalid_ratio)
+        assert os.path.exists(data_dir / 'cache') == streaming
+        path = str(tmp_path / 'result_{}.json'.format(streaming))
+        run.write_link_results(corpus, [[0, 3, 5], [7, 1, 2]], path)
+        with open(path) as f:
+            outputs.append(f.read())
+    assert outputs[0] == outputs[1]
+    assert re.search(r'"results": \[\["\w+", "\w+", "\w+"\]', outputs[0])
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import torch
+
+import dataloader
+from common import MODELS, build_model
+
+
+def scorer_of(model, model_name):
+    return model.test if model_name in ('TransE', 'DisenE_Trans') else model
+
+
+@pytest.mark.parametrize("model_name", sorted(MODELS))
+def test_chunked_ranks_match_unchunked(kg, monkeypatch, model_name):
+    corpus, entity_emb, relation_emb, config = kg
+    config.model_name = model_name
+    torch.manual_seed(0)
+    scorer = scorer_of(build_model(model_name, entity_emb, relation_emb, config).eval(), model_name)
+    triples = corpus.test_indices[:15]
+    assert corpus.num_entities % 37 != 0
+
+    ranks = {}
+    for chunk_size in (37, corpus.num_entities):
+        monkeypatch.setattr(dataloader, 'eval_chunk_size', lambda args, model: chunk_size)
+        with torch.no_grad():
+            ranks[chunk_size] = [corpus.rank_triple(config, scorer, triple) for triple in triples]
+    assert ranks[37] == ranks[corpus.num_entities]
+
+    # 与逐个候选打分、去掉已知三元组后直接数出来的排名一致
+    known = set(map(tuple, np.concatenate([corpus.train_indices, corpus.validation_indices,
+                                           corpus.test_indices]).tolist()))
+    with torch.no_grad():
+        for triple, (head_rank, tail_rank) in zip(triples, ranks[37]):
+            true_score = scorer(torch.LongTensor(triple.reshape(1, 3)))[0].view(-1)[0]
+            expected = []
+            for column in (0, 2):
+                candidates = np.tile(triple, (corpus.num_entities, 1))
+                candidates[:, column] = np.arange(corpus.num_entities)
+                candidates = np.array([c for c in candidates.tolist() if tuple(c) not in known])
+                scores = scorer(torch.LongTensor(candidates))[0].view(-1)
+                expected.append(int((scores > true_score).sum()) + 1)
+            assert (head_rank, tail_rank) == tuple(expected)
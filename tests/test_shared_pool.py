@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import torch
+
+from common import build_model
+
+
+def known_triples(corpus):
+    return set(map(tuple, np.concatenate([corpus.train_indices, corpus.validation_indices,
+                                          corpus.test_indices]).tolist()))
+
+
+@pytest.mark.parametrize("model_name", ["TransE", "DisenE_Trans"])
+def test_pool_loss_matches_brute_force(kg, monkeypatch, model_name):
+    corpus, entity_emb, relation_emb, config = kg
+    model = build_model(model_name, entity_emb, relation_emb, config)
+    corpus.batch_size = 12
+    positives = corpus.train_indices[:12]
+    # 池中放入这些正样本自己的头/尾实体，保证有被掩掉的真三元组
+    pool = np.concatenate([positives[:4, 0], positives[4:8, 2], np.arange(0, corpus.num_entities, 7)])
+    monkeypatch.setattr(np.random, 'randint', lambda low, high, size: pool.copy())
+    batch_triples, batch_pool, pool_mask = corpus.get_pool_batch(0, len(pool))
+
+    known = known_triples(corpus)
+    expected_mask = np.zeros_like(pool_mask)
+    for i, (h, r, t) in enumerate(batch_triples.tolist()):
+        for j, p in enumerate(batch_pool.tolist()):
+            expected_mask[0, i, j] = (p, r, t) in known
+            expected_mask[1, i, j] = (h, r, p) in known
+    np.testing.assert_array_equal(pool_mask, expected_mask)
+    assert expected_mask[0, :4].any() and expected_mask[1, 4:8].any()
+
+    loss, _ = model.forward_pool(torch.LongTensor(batch_triples), torch.LongTensor(batch_pool),
+                                 torch.from_numpy(pool_mask))
+
+    # 逐个负样本用 test 打分(分数 = -距离)
+    with torch.no_grad():
+        pos_norm = -model.test(torch.LongTensor(batch_triples))[0].view(-1)
+        terms = []
+        for side, column in enumerate((0, 2)):
+            for i in range(len(batch_triples)):
+                corrupted = np.repeat(batch_triples[i:i + 1], len(batch_pool), axis=0)
+                corrupted[:, column] = batch_pool
+                neg_norm = -model.test(torch.LongTensor(corrupted))[0].view(-1)
+                keep = ~torch.from_numpy(pool_mask[side, i])
+                terms.append(torch.relu(pos_norm[i] - neg_norm + config.margin)[keep])
+        expected = torch.cat(terms).mean()
+    torch.testing.assert_close(loss.detach(), expected, rtol=1e-5, atol=1e-5)
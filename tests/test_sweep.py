@@ -0,0 +1,48 @@
+import argparse
+import random
+
+import numpy as np
+import pytest
+import torch
+
+from sweep import get_rng_state, parse_grid, set_rng_state, trial_seed
+
+
+def draw():
+    return random.random(), float(np.random.rand()), float(torch.rand(1))
+
+
+def test_trial_seeds():
+    assert trial_seed(42, 0) == trial_seed(42, 0)
+    assert len({trial_seed(42, trial_id) for trial_id in range(20)}) == 20
+    assert trial_seed(42, 1) != trial_seed(43, 1)
+
+
+def test_rng_state_survives_checkpoint(tmp_path):
+    # 下一轮从保存的状态继续，而不是重新播种得到与上一轮相同的随机数
+    random.seed(7)
+    np.random.seed(7)
+    torch.manual_seed(7)
+    first_rung = draw()
+    path = str(tmp_path / 'state.pth')
+    torch.save({'rng': get_rng_state()}, path)
+    expected = draw()
+
+    random.seed(7)
+    np.random.seed(7)
+    torch.manual_seed(7)
+    set_rng_state(torch.load(path)['rng'])
+    resumed = draw()
+    assert resumed == expected and resumed != first_rung
+
+
+def test_parse_grid_bools():
+    base_args = argparse.Namespace(test=False, k_factors=4, w1=0.1)
+    keys, trials = parse_grid("test=True,false; k_factors=4,6;w1=0.05", base_args)
+    assert keys == ['test', 'k_factors', 'w1']
+    assert [params for params, _ in trials] == [
+        {'test': True, 'k_factors': 4, 'w1': 0.05}, {'test': True, 'k_factors': 6, 'w1': 0.05},
+        {'test': False, 'k_factors': 4, 'w1': 0.05}, {'test': False, 'k_factors': 6, 'w1': 0.05}]
+    assert trials[2][1].test is False and base_args.test is False
+    with pytest.raises(ValueError):
+        parse_grid("test=maybe", base_args)
@@ -0,0 +1,167 @@
+import numpy as np
+
+import os
+
+# 紧凑的字符串表：所有名字按id顺序拼接在一个uint8缓冲区里，offsets记录每个名字的起止位置，
+# 名字->id 通过排好序的64位FNV-1a哈希做二分查找，全部操作都是向量化的，并且可以mmap加载
+
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+VOCAB_FILES = ('buffer', 'offsets', 'hashes', 'hash_ids')
+
+
+def _encode(names):
+    encoded = [name.encode('utf-8') for name in names]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return buffer, offsets
+
+
+def _fnv1a(buffer, offsets):
+    return _fnv1a_spans(buffer, offsets[:-1], np.diff(offsets))
+
+
+def _fnv1a_spans(buffer, starts, lengths):
+    # buffer[starts[i]:starts[i] + lengths[i]] 的哈希，片段不需要连续
+    hashes = np.full(len(starts), FNV_OFFSET, dtype=np.uint64)
+    if len(lengths) == 0:
+        return hashes
+    # 最短名字之内的字节所有行都有，不需要挑行
+    shortest = int(lengths.min())
+    for j in range(shortest):
+        hashes = (hashes ^ buffer[starts + j]) * FNV_PRIME
+    for j in range(shortest, int(lengths.max())):
+        rows = np.nonzero(lengths > j)[0]
+        hashes[rows] = (hashes[rows] ^ buffer[starts[rows] + j]) * FNV_PRIME
+    return hashes
+
+
+def _equal(buffer_a, starts_a, lengths_a, buffer_b, starts_b, lengths_b):
+    equal = lengths_a == lengths_b
+    if len(lengths_a) == 0:
+        return equal
+    shortest = int(min(lengths_a.min(), lengths_b.min()))
+    for j in range(shortest):
+        equal &= buffer_a[starts_a + j] == buffer_b[starts_b + j]
+    for j in range(shortest, int(lengths_a.max())):
+        rows = np.nonzero(equal & (lengths_a > j))[0]
+        equal[rows] = buffer_a[starts_a[rows] + j] == buffer_b[starts_b[rows] + j]
+    return equal
+
+
+class Vocab:
+    def __init__(self, buffer, offsets, hashes, hash_ids):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.hashes = hashes
+        self.hash_ids = hash_ids
+
+    @classmethod
+    def from_names(cls, names):
+        """names[i] 是id为i的名字"""
+        buffer, offsets = _encode(names)
+        hashes = _fnv1a(buffer, offsets)
+        hash_ids = np.argsort(hashes, kind='stable')
+        hashes = hashes[hash_ids]
+        if len(hashes) > 1 and (hashes[1:] == hashes[:-1]).any():
+            raise ValueError("duplicate names (or a 64-bit hash collision) in vocabulary")
+        return cls(buffer, offsets, hashes, hash_ids.astype(np.int64))
+
+    @classmethod
+    def from_file(cls, filename):
+        """读取 entity2id.txt / relation2id.txt (每行 "名字 id")"""
+        names, ids = [], []
+        with open(filename, 'r') as f:
+            for line in f:
+                line_split = line.strip().split()
+                if len(line_split) > 1:
+                    names.append(line_split[0].strip())
+                    ids.append(int(line_split[1].strip()))
+        ordered = [""] * (max(ids) + 1 if ids else 0)
+        for name, idx in zip(names, ids):
+            ordered[idx] = name
+        return cls.from_names(ordered)
+
+    @classmethod
+    def from_dict(cls, item2id):
+        ordered = [""] * (max(item2id.values()) + 1 if item2id else 0)
+        for name, idx in item2id.items():
+            ordered[idx] = name
+        return cls.from_names(ordered)
+
+    def save(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        for name in VOCAB_FILES:
+            np.save(os.path.join(folder, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        return cls(*[np.load(os.path.join(folder, name + '.npy'), mmap_mode=mmap_mode) for name in VOCAB_FILES])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lookup(self, names, missing=-1):
+        """名字列表 -> id数组，不存在的名字返回missing"""
+        query_buffer, query_offsets = _encode(names)
+        return self.lookup_spans(query_buffer, query_offsets[:-1], np.diff(query_offsets), missing)
+
+    def lookup_spans(self, buffer, starts, lengths, missing=-1):
+        """
+        名字是 buffer(uint8数组，UTF-8)中的片段 buffer[starts[i]:starts[i] + lengths[i]]，
+        不需要先构建字符串(process_data 流式读入时直接在读入的块上查找)
+        """
+        query_hashes = _fnv1a_spans(buffer, starts, lengths)
+
+        ids = np.full(len(query_hashes), missing, dtype=np.int64)
+        if len(self.hashes) == 0:
+            return ids
+
+        pos = np.minimum(np.searchsorted(self.hashes, query_hashes), len(self.hashes) - 1)
+        found = self.hashes[pos] == query_hashes
+        candidates = self.hash_ids[pos]
+        # 哈希相同时再逐字节确认一次
+        found &= _equal(self.buffer, self.offsets[candidates], np.diff(self.offsets)[candidates],
+                        buffer, starts, lengths)
+        ids[found] = candidates[found]
+        return ids
+
+    def names(self, ids):
+        """id数组 -> 名字列表"""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        starts, ends = self.offsets[ids], self.offsets[ids + 1]
+        buffer = self.buffer
+        return [bytes(buffer[s:e]).decode('utf-8') for s, e in zip(starts.tolist(), ends.tolist())]
+
+    def __getitem__(self, name):
+        idx = int(self.lookup([name])[0])
+        if idx < 0:
+            raise KeyError(name)
+        return idx
+
+    def __contains__(self, name):
+        return int(self.lookup([name])[0]) >= 0
+
+
+def load_vocab(filename, cache_dir=None):
+    """
+    从 entity2id.txt 构建词表，并缓存到 <数据目录>/cache/<文件名>/ 下，
+    之后直接mmap加载缓存(源文件更新后会重新构建)
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(filename), 'cache', os.path.basename(filename))
+    cache_file = os.path.join(cache_dir, VOCAB_FILES[-1] + '.npy')
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(filename):
+        return Vocab.load(cache_dir)
+
+    vocab = Vocab.from_file(filename)
+    try:
+        vocab.save(cache_dir)
+    except OSError:
+        # 只读的数据目录就不缓存了
+        pass
+    return vocab